@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Optional
+from config import Config
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Reasons for rejecting a request
+REJECT_QUEUE_FULL = "queue_full"
+REJECT_RATE_LIMITED = "rate_limited"
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted"""
+
+    def __init__(self, reason: str, position: int = 0, retry_after: float = 0.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.position = position
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Global concurrency cap in front of URL processing
+
+    Requests beyond the cap wait in a bounded queue that is served
+    round-robin across users, so one user sending many links cannot starve
+    everyone else. Each user is also limited by a token bucket.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, user_rate: float, user_burst: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+
+        self.active = 0
+        self.queued = 0
+        # user_id -> pending futures; iteration order is the round-robin order
+        self._queues: "OrderedDict[int, Deque[asyncio.Future]]" = OrderedDict()
+        # user_id -> token bucket, bounded so idle users are forgotten
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._max_buckets = 10000
+
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_rate = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @classmethod
+    def from_config(cls) -> "AdmissionController":
+        """Build a controller from Config settings"""
+        return cls(
+            Config.ADMISSION_MAX_CONCURRENT,
+            Config.ADMISSION_MAX_QUEUE,
+            Config.USER_RATE_LIMIT / Config.USER_RATE_WINDOW,
+            Config.USER_RATE_LIMIT
+        )
+
+    def check_rate(self, user_id: int):
+        """Take a token from the user's bucket or reject"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._buckets[user_id] = bucket
+            if len(self._buckets) > self._max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+
+        if not bucket.try_acquire():
+            self.rejected_rate += 1
+            raise AdmissionRejected(REJECT_RATE_LIMITED, retry_after=bucket.retry_after())
+
+    def _position(self, user_id: int) -> int:
+        """Estimate the round-robin position of the user's newest queued request"""
+        own = len(self._queues.get(user_id, ()))
+        return sum(min(len(pending), own) for pending in self._queues.values()) or 1
+
+    async def run(self, user_id: int, func: Callable[[], Awaitable[Any]],
+                  on_queued: Optional[Callable[[int], Awaitable[Any]]] = None, rate_limited: bool = True) -> Any:
+        """Run func() once admitted; raise AdmissionRejected to fail fast
+
+        rate_limited=False skips the user's token bucket, for callers that
+        already charged it (a batch takes one token for all its links).
+        """
+        if rate_limited:
+            self.check_rate(user_id)
+
+        if self.active >= self.max_concurrent or self.queued:
+            if self.queued >= self.max_queue:
+                self.rejected_full += 1
+                raise AdmissionRejected(REJECT_QUEUE_FULL, position=self.queued + 1)
+            await self._wait_for_slot(user_id, on_queued)
+        else:
+            self.active += 1
+
+        self.admitted += 1
+        try:
+            return await func()
+        finally:
+            self._release()
+
+    async def _wait_for_slot(self, user_id: int, on_queued: Optional[Callable[[int], Awaitable[Any]]]):
+        """Queue the request until a slot is handed over to it"""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append(future)
+        self.queued += 1
+        queued_at = time.monotonic()
+
+        # Everything awaited after queueing must be covered, or a cancelled caller leaves its
+        # future in the queue and the slot later handed to it is never released
+        try:
+            if on_queued:
+                try:
+                    await on_queued(self._position(user_id))
+                except Exception as e:
+                    logger.debug("Queued notification failed: %s", e)
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # The slot was handed to us just before cancellation; pass it on
+                self._release()
+            else:
+                self._discard(user_id, future)
+            raise
+
+        waited = time.monotonic() - queued_at
+        self.waits += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def _discard(self, user_id: int, future: asyncio.Future):
+        """Remove a cancelled request from the queue"""
+        pending = self._queues.get(user_id)
+        if pending and future in pending:
+            pending.remove(future)
+            self.queued -= 1
+            if not pending:
+                del self._queues[user_id]
+
+    def _release(self):
+        """Free a slot and hand it to the next user in round-robin order"""
+        while self._queues:
+            user_id, pending = next(iter(self._queues.items()))
+            future = pending.popleft()
+            self.queued -= 1
+            if pending:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if not future.done():
+                # The slot moves to the waiter; active stays the same
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def get_stats(self) -> dict:
+        """Get admission statistics"""
+        return {
+            'active': self.active,
+            'max_concurrent': self.max_concurrent,
+            'queued': self.queued,
+            'max_queue': self.max_queue,
+            'queued_users': len(self._queues),
+            'admitted': self.admitted,
+            'rejected_full': self.rejected_full,
+            'rejected_rate': self.rejected_rate,
+            'avg_wait': self.wait_total / self.waits if self.waits else 0.0,
+            'max_wait': self.wait_max
+        }
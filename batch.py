@@ -0,0 +1,196 @@
+import asyncio
+import io
+import logging
+import time
+from typing import Dict, List, Optional
+from pyrogram.errors import MessageNotModified
+from pyrogram.types import Message
+from config import Config
+from downloader import InstagramDownloader, InstagramLink
+from admission import AdmissionController, AdmissionRejected
+from metrics import LINKS_PROCESSED
+from resolver import MediaItem
+from utils import gather_bounded
+
+logger = logging.getLogger(__name__)
+
+# Longest text Telegram accepts in one message; longer batch results are sent as a file
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class BatchResult:
+    """Outcome of one link of a batch"""
+
+    def __init__(self, link: InstagramLink):
+        self.link = link
+        self.info: Optional[dict] = None
+        self.error: Optional[str] = None
+
+
+class BatchProcessor:
+    """Resolves many Instagram links for one user and reports them in a single reply
+
+    Links are resolved BATCH_CONCURRENCY at a time, each through the
+    admission controller so batches share capacity fairly with single
+    links. Progress goes into one message edited at most every
+    BATCH_PROGRESS_INTERVAL seconds; the results come back as one message,
+    or as a text file when they don't fit.
+    """
+
+    def __init__(self, downloader: InstagramDownloader, admission: AdmissionController):
+        self.downloader = downloader
+        self.admission = admission
+        # user_id -> batches running for that user
+        self.active: Dict[int, int] = {}
+
+        self.batches = 0
+        self.links = 0
+        self.rejected = 0
+
+    async def run(self, message: Message, links: List[InstagramLink]):
+        """Process a batch of links for the message's sender"""
+        user_id = message.from_user.id
+        if self.active.get(user_id, 0) >= Config.BATCH_MAX_ACTIVE:
+            self.rejected += 1
+            await message.reply_text("⏳ Your previous batch is still running. Please wait for it to finish.")
+            return
+
+        # A whole batch takes one token of the user's rate limit
+        try:
+            self.admission.check_rate(user_id)
+        except AdmissionRejected as e:
+            self.rejected += 1
+            await message.reply_text(
+                f"🐢 You're sending links too fast. Please try again in {max(1, round(e.retry_after))} seconds."
+            )
+            return
+
+        skipped = max(0, len(links) - Config.BATCH_MAX_URLS)
+        links = links[:Config.BATCH_MAX_URLS]
+
+        self.active[user_id] = self.active.get(user_id, 0) + 1
+        self.batches += 1
+        try:
+            await self._run(message, links, skipped)
+        finally:
+            self.active[user_id] -= 1
+            if not self.active[user_id]:
+                del self.active[user_id]
+
+    async def _run(self, message: Message, links: List[InstagramLink], skipped: int):
+        user_id = message.from_user.id
+        results = [BatchResult(link) for link in links]
+        note = f" ({skipped} more skipped, the limit is {Config.BATCH_MAX_URLS})" if skipped else ""
+        progress_msg = await message.reply_text(f"📦 Processing {len(links)} Instagram links{note}...")
+
+        done = 0
+        reported = 0
+        started = time.monotonic()
+
+        async def resolve(result: BatchResult):
+            nonlocal done
+            try:
+                result.info = await self.admission.run(
+                    user_id, lambda: self.downloader.process_link(result.link), rate_limited=False
+                )
+                if not result.info or not result.info.get('items'):
+                    result.error = "not found"
+                    LINKS_PROCESSED.inc(("failed",))
+                else:
+                    LINKS_PROCESSED.inc(("links",))
+            except AdmissionRejected as e:
+                result.error = "bot busy"
+                LINKS_PROCESSED.inc((e.reason,))
+            except Exception as e:
+                result.error = "error"
+                LINKS_PROCESSED.inc(("error",))
+                logger.error("Error processing %s in batch: %s", result.link.url, e)
+            done += 1
+
+        async def report_progress():
+            nonlocal reported
+            while True:
+                await asyncio.sleep(Config.BATCH_PROGRESS_INTERVAL)
+                if done == reported:
+                    continue
+                reported = done
+                failed = sum(1 for result in results if result.error)
+                await self._edit(
+                    progress_msg,
+                    f"📦 Processing {len(links)} Instagram links{note}...\n\n"
+                    f"📊 Progress: {done}/{len(links)}\n"
+                    f"✅ Resolved: {done - failed}\n"
+                    f"❌ Failed: {failed}"
+                )
+
+        reporter = asyncio.create_task(report_progress())
+        try:
+            await gather_bounded(Config.BATCH_CONCURRENCY, (resolve(result) for result in results))
+        finally:
+            reporter.cancel()
+
+        self.links += len(links)
+        failed = sum(1 for result in results if result.error)
+        summary = (
+            f"✅ **Batch complete:** {len(links) - failed}/{len(links)} links resolved"
+            f"{f', {failed} failed' if failed else ''} in {time.monotonic() - started:.1f}s"
+        )
+        logger.info("Batch of %d links for user %s: %d failed", len(links), user_id, failed)
+
+        text = summary + "\n\n" + "\n".join(
+            self._format_markdown(index, result) for index, result in enumerate(results, 1)
+        )
+        if len(text) <= TELEGRAM_MESSAGE_LIMIT:
+            if not await self._edit(progress_msg, text, disable_web_page_preview=True):
+                await message.reply_text(text, disable_web_page_preview=True)
+            return
+
+        # Too long for one message: send everything as a text file
+        document = io.BytesIO(
+            "\n\n".join(self._format_plain(index, result) for index, result in enumerate(results, 1)).encode()
+        )
+        document.name = "instagram_links.txt"
+        await message.reply_document(document, caption=summary)
+        await self._edit(progress_msg, summary + "\n\n📄 Links are in the attached file.")
+
+    @staticmethod
+    def _item_details(item: MediaItem) -> str:
+        details = item.describe()
+        return f" ({details})" if details else ""
+
+    def _format_markdown(self, index: int, result: BatchResult) -> str:
+        if result.error:
+            return f"**{index}.** {result.link.url} ❌ {result.error}"
+        links = " • ".join(
+            f"[{item.kind.title()} {number}]({item.url}){self._item_details(item)}"
+            for number, item in enumerate(result.info['items'], 1)
+        )
+        return f"**{index}.** {result.link.url}\n{links}"
+
+    def _format_plain(self, index: int, result: BatchResult) -> str:
+        if result.error:
+            return f"{index}. {result.link.url} - failed: {result.error}"
+        lines = [f"{index}. {result.link.url}"]
+        for number, item in enumerate(result.info['items'], 1):
+            lines.append(f"   {item.kind} {number}{self._item_details(item)}: {item.url}")
+        return "\n".join(lines)
+
+    async def _edit(self, message: Message, text: str, **kwargs) -> bool:
+        """Edit a status message; return False if Telegram refused (e.g. flood limits)"""
+        try:
+            await message.edit_text(text, **kwargs)
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            logger.debug("Could not edit batch progress: %s", e)
+            return False
+        return True
+
+    def get_stats(self) -> dict:
+        """Get batch statistics"""
+        return {
+            'active': sum(self.active.values()),
+            'batches': self.batches,
+            'links': self.links,
+            'rejected': self.rejected
+        }
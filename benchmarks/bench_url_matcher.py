@@ -0,0 +1,70 @@
+"""Micro-benchmark: per-message cost of Instagram URL matching
+
+Compares the previous implementation (two patterns recompiled through
+re.match, called once in the handler and again while processing) with the
+precompiled single-pass matcher in downloader.py.
+
+Usage:
+    python benchmarks/bench_url_matcher.py [iterations]
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import find_instagram_urls, parse_instagram_url
+
+MESSAGES = [
+    "https://www.instagram.com/reel/C0aBcDeFgHi/",
+    "https://www.instagram.com/p/C0aBcDeFgHi/?igsh=MWQ1ZGUxMzBkMA==",
+    "https://instagram.com/some.user/reel/C0aBcDeFgHi",
+    "hello, can you download this for me?",
+    "check https://www.instagram.com/reel/C0aBcDeFgHi/ and https://www.instagram.com/p/D1bCdEfGhIj/",
+]
+
+
+def legacy_is_valid_instagram_url(url: str) -> bool:
+    """The matcher used before: two patterns, looked up through re's cache on every call"""
+    instagram_patterns = [
+        r'https?://(?:www\.)?instagram\.com/(?:p|reel|tv)/[\w-]+/?',
+        r'https?://(?:www\.)?instagram\.com/[\w.-]+/(?:p|reel|tv)/[\w-]+/?'
+    ]
+
+    for pattern in instagram_patterns:
+        if re.match(pattern, url):
+            return True
+    return False
+
+
+def legacy_per_message(text: str):
+    # Validated in handle_instagram_url, then again in process_instagram_url
+    if legacy_is_valid_instagram_url(text):
+        legacy_is_valid_instagram_url(text)
+
+
+def new_per_message(text: str):
+    # One scan that validates, extracts shortcodes and finds embedded URLs
+    for link in find_instagram_urls(text):
+        link.shortcode
+
+
+def new_single_url(text: str):
+    parse_instagram_url(text)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    for name, func in (
+        ("legacy (2x re.match, 2 patterns)", legacy_per_message),
+        ("new parse_instagram_url", new_single_url),
+        ("new find_instagram_urls", new_per_message),
+    ):
+        seconds = timeit.timeit(lambda: [func(text) for text in MESSAGES], number=iterations)
+        per_message = seconds / (iterations * len(MESSAGES)) * 1e9
+        print(f"{name:<36} {per_message:8.0f} ns/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Micro-benchmark: memory and lookup cost of the in-memory user set
+
+Compares the previous representation (a Python set of ints) with the
+CompactUserSet from userset.py at 1M and 10M users. IDs are random and
+spread like Telegram user IDs (up to ~8e9, so every int is a separate
+object). Memory is measured with tracemalloc while the structure is built;
+lookups are half hits and half misses.
+
+Usage:
+    python benchmarks/bench_userset.py [sizes...] [--lookups 200000]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from userset import CompactUserSet
+
+MAX_USER_ID = 8_000_000_000
+
+
+def measure(build):
+    """Build a structure and return it with the bytes it holds and the build time"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    structure = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return structure, size, elapsed
+
+
+def report(name: str, size: int, count: int, build: float, lookup: float, iterate: float):
+    print(
+        f"{name:<16} {size / 2**20:9.1f} MB {size / count:7.1f} B/user "
+        f"build {build:6.2f}s  lookup {lookup * 1e9:6.0f} ns  iterate {iterate:6.2f}s"
+    )
+
+
+def run(count: int, lookups: int):
+    print(f"\n{count:,} users")
+    rng = random.Random(count)
+    ids = sorted(set(rng.sample(range(1, MAX_USER_ID), count)))
+    probes = [ids[rng.randrange(len(ids))] if i % 2 else rng.randrange(1, MAX_USER_ID) for i in range(lookups)]
+
+    # "+ 0" makes fresh int objects, as rows read from SQLite are
+    rows = iter(ids)
+    users, size, build = measure(lambda: set(user_id + 0 for user_id in rows))
+    lookup = timeit.timeit(lambda: [user_id in users for user_id in probes], number=1) / lookups
+    started = time.perf_counter()
+    for _ in users:
+        pass
+    report("set", size, count, build, lookup, time.perf_counter() - started)
+    del users
+    gc.collect()
+
+    rows = iter(ids)
+    users, size, build = measure(lambda: CompactUserSet(rows))
+    lookup = timeit.timeit(lambda: [user_id in users for user_id in probes], number=1) / lookups
+    started = time.perf_counter()
+    for _ in users:
+        pass
+    report("CompactUserSet", size, count, build, lookup, time.perf_counter() - started)
+
+    # New users land in the middle of a chunk, which shifts up to 2 * load entries
+    new_ids = [rng.randrange(1, MAX_USER_ID) for _ in range(lookups)]
+    add = timeit.timeit(lambda: [users.add(user_id) for user_id in new_ids], number=1) / lookups
+    remove = timeit.timeit(lambda: [users.discard(user_id) for user_id in new_ids], number=1) / lookups
+    print(f"{'':<16} add {add * 1e9:6.0f} ns  remove {remove * 1e9:6.0f} ns")
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive: {value}")
+    return number
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("sizes", nargs="*", type=positive_int, default=[1_000_000, 10_000_000],
+                        help="numbers of users to measure (default: 1000000 10000000)")
+    parser.add_argument("--lookups", type=positive_int, default=200_000, help="membership probes per size")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for count in args.sizes:
+        run(count, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
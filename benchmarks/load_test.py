@@ -0,0 +1,412 @@
+"""Load test: URL handling and broadcasts against fake Telegram and a stub API
+
+Drives the real InstagramBot and BroadcastManager in-process. URL messages
+are fed as updates through Pyrogram's Dispatcher with the production
+number of handler workers (HANDLER_WORKERS), so the registered handlers,
+their decorators and the hand-off to background tasks are part of the
+measured path. Telegram is replaced by a fake Client/Message with
+configurable latency and FloodWait injection, and
+the nekorinn API by a local aiohttp stub with configurable latency and
+error rate. All randomness is seeded, so runs with the same arguments are
+comparable between commits.
+
+Reports throughput, p50/p95/p99 latency and peak RSS as JSON; pass
+--baseline with an earlier report to print the relative change.
+
+Usage:
+    python benchmarks/load_test.py [--messages 2000] [--concurrency 100] [--broadcast-users 2000]
+                                   [--api-latency 0.05] [--api-error-rate 0.0] [--telegram-latency 0.01]
+                                   [--flood-rate 0.0] [--flood-seconds 1] [--output report.json]
+                                   [--baseline old.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import count
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Configured through the environment before the bot modules read it
+os.environ.setdefault("BOT_TOKEN", "0:load-test")
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "load-test")
+os.environ.setdefault("ADMIN_USER_ID", "1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("METRICS_PORT", "0")
+
+from aiohttp import web
+from pyrogram.enums import ChatType
+from pyrogram.errors import FloodWait
+from pyrogram.handlers import MessageHandler
+
+
+class FakeTelegram:
+    """Simulated Telegram API latency and FloodWait errors, shared by fake clients and messages"""
+
+    def __init__(self, latency: float, flood_rate: float, flood_seconds: int, seed: int):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.random = random.Random(seed)
+        self.message_ids = count(1000)
+        self.calls = 0
+        self.flood_waits = 0
+        self.send_latencies: List[float] = []
+
+    async def call(self):
+        """One API round trip, possibly rejected with FloodWait"""
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWait(value=self.flood_seconds)
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+        self.type = ChatType.PRIVATE
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.first_name = f"user{user_id}"
+        self.username = f"user{user_id}"
+
+
+class FakeMessage:
+    """The subset of pyrogram.types.Message the handlers use"""
+
+    def __init__(self, telegram: FakeTelegram, chat_id: int, text: str = "", user_id: Optional[int] = None):
+        self.telegram = telegram
+        self.id = next(telegram.message_ids)
+        self.chat = FakeChat(chat_id)
+        self.from_user = FakeUser(user_id or chat_id)
+        self.text = text
+        self.command = text[1:].split() if text.startswith("/") else None
+        self.video = None
+        self.document = None
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self.telegram.call()
+        return FakeMessage(self.telegram, self.chat.id, text)
+
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self.telegram.call()
+        self.text = text
+        return self
+
+    async def delete(self):
+        await self.telegram.call()
+
+
+class FakeUpdate:
+    """A raw update carrying an already built FakeMessage"""
+
+    def __init__(self, message: FakeMessage):
+        self.message = message
+
+
+async def parse_fake_update(update: FakeUpdate, users: dict, chats: dict):
+    """Dispatcher update parser: FakeUpdates are new messages"""
+    return update.message, MessageHandler
+
+
+class FakeClient:
+    """The subset of pyrogram.Client the broadcast manager uses"""
+
+    def __init__(self, telegram: FakeTelegram):
+        self.telegram = telegram
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> FakeMessage:
+        started = time.perf_counter()
+        await self.telegram.call()
+        self.telegram.send_latencies.append(time.perf_counter() - started)
+        return FakeMessage(self.telegram, chat_id, text)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs):
+        await self.telegram.call()
+
+
+class StubInstagramApi:
+    """Local stand-in for the nekorinn downloader API"""
+
+    def __init__(self, latency: float, error_rate: float, seed: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        # Exponentially distributed latency around the configured mean
+        await asyncio.sleep(self.random.expovariate(1 / self.latency) if self.latency else 0)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"status": False}, status=503)
+        shortcode = request.query.get("url", "").rstrip("/").rsplit("/", 1)[-1]
+        cdn = f"{request.scheme}://{request.host}/cdn"
+        return web.json_response({
+            "status": True,
+            "result": {
+                "downloadUrl": [f"{cdn}/{shortcode}.mp4"],
+                "metadata": {"username": "loadtest", "like": 1, "comment": 1, "caption": "load test"}
+            }
+        })
+
+    async def handle_cdn_head(self, request: web.Request) -> web.Response:
+        return web.Response(headers={"Content-Length": str(2 * 1024 * 1024), "Content-Type": "video/mp4"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/downloader/instagram", self.handle)
+        # Answers the downloader's HEAD size probes
+        app.router.add_route("HEAD", "/cdn/{name}", self.handle_cdn_head)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/downloader/instagram"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 and max in milliseconds (nearest rank)"""
+    if not samples:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    ordered = sorted(samples)
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "p50_ms": round(rank(0.50), 2),
+        "p95_ms": round(rank(0.95), 2),
+        "p99_ms": round(rank(0.99), 2),
+        "max_ms": round(ordered[-1] * 1000, 2)
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_url_load(bot, dispatcher, telegram: FakeTelegram, args) -> dict:
+    """Send args.messages URL messages from distinct users with args.concurrency in flight
+
+    Each message goes through the dispatcher's update queue; its latency runs
+    until the background task started by the text handler has replied.
+    """
+    # A fixed share of repeated posts exercises the cache and lookup coalescing
+    rng = random.Random(args.seed)
+    distinct = max(1, int(args.messages * args.distinct_ratio))
+    shortcodes = [f"LT{index:07d}" for index in range(distinct)]
+    pending = [
+        (100_000 + index, f"https://www.instagram.com/reel/{rng.choice(shortcodes)}/")
+        for index in range(args.messages)
+    ]
+
+    latencies: List[float] = []
+    calls_before = telegram.calls
+
+    # Resolved when the handler chain has finished a message, by message id
+    handled: Dict[int, asyncio.Future] = {}
+    handle_instagram_url = bot.handle_instagram_url
+
+    async def handle_and_signal(message):
+        try:
+            await handle_instagram_url(message)
+        finally:
+            handled.pop(message.id).set_result(None)
+
+    bot.handle_instagram_url = handle_and_signal
+
+    async def virtual_user():
+        while pending:
+            user_id, url = pending.pop()
+            message = FakeMessage(telegram, user_id, url)
+            handled[message.id] = asyncio.get_running_loop().create_future()
+            started = time.perf_counter()
+            dispatcher.updates_queue.put_nowait((FakeUpdate(message), {}, {}))
+            await handled[message.id]
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    cache = bot.downloader.cache.get_stats()
+    return {
+        "messages": len(latencies),
+        "handler_workers": len(dispatcher.handler_worker_tasks),
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(len(latencies) / elapsed, 1),
+        **percentiles(latencies),
+        "telegram_calls": telegram.calls - calls_before,
+        "cache_hit_rate": round(cache["hit_rate"], 1),
+        "upstream": {key: value for key, value in bot.downloader.get_upstream_stats().items() if key != "backends"}
+    }
+
+
+async def run_broadcast(bot, telegram: FakeTelegram, args) -> dict:
+    """Broadcast one message to args.broadcast_users users"""
+    # The URL phase registered its senders as users too
+    bot.db.clear_users()
+    for user_id in range(1, args.broadcast_users + 1):
+        bot.db.add_user(user_id)
+    await bot.db.flush()
+
+    admin = FakeMessage(telegram, 1, "/broadcast load test")
+    telegram.send_latencies.clear()
+    floods_before = telegram.flood_waits
+
+    started = time.perf_counter()
+    job = await bot.broadcast_manager.broadcast_message("load test", admin)
+    result = await job.task
+    elapsed = time.perf_counter() - started
+
+    return {
+        "users": args.broadcast_users,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(result["success"] / elapsed, 1),
+        "sent": result["success"],
+        "failed": result["failed"],
+        "flood_waits": telegram.flood_waits - floods_before,
+        "final_rate": round(bot.broadcast_manager.rate_limiter.rate, 2),
+        "send_latency": percentiles(telegram.send_latencies)
+    }
+
+
+def compare(report: dict, baseline: dict):
+    """Print relative changes of the headline numbers against a baseline report"""
+    rows = [
+        ("urls", "throughput_per_s"), ("urls", "p50_ms"), ("urls", "p95_ms"), ("urls", "p99_ms"),
+        ("broadcast", "seconds"), ("broadcast", "throughput_per_s"), (None, "peak_rss_mb")
+    ]
+    print(f"\nvs baseline {baseline.get('commit', '?')}:", file=sys.stderr)
+    for section, key in rows:
+        new = report.get(section, {}).get(key) if section else report.get(key)
+        old = baseline.get(section, {}).get(key) if section else baseline.get(key)
+        if new is None or not old:
+            continue
+        name = f"{section}.{key}" if section else key
+        print(f"  {name:<28} {old:>10} -> {new:<10} ({(new - old) / old * 100:+.1f}%)", file=sys.stderr)
+
+
+async def main(args) -> dict:
+    api = StubInstagramApi(args.api_latency, args.api_error_rate, args.seed)
+    await api.start()
+
+    workdir = tempfile.mkdtemp(prefix="instabot-load-")
+    os.chdir(workdir)
+
+    from config import Config
+    Config.RESOLVER_BACKENDS = f"nekorinn={api.url}"
+    Config.USER_RATE_LIMIT = max(Config.USER_RATE_LIMIT, args.messages)
+    Config.DATABASE_FILE = os.path.join(workdir, "users.db")
+    Config.BROADCAST_DB_FILE = os.path.join(workdir, "broadcasts.db")
+    Config.CACHE_DB_FILE = os.path.join(workdir, "cache.db")
+    if args.broadcast_rate:
+        Config.BROADCAST_RATE = args.broadcast_rate
+
+    from bot import InstagramBot
+
+    telegram = FakeTelegram(args.telegram_latency, args.flood_rate, args.flood_seconds, args.seed)
+    bot = InstagramBot()
+    # The real client's dispatcher runs the registered handlers; replies go through the fakes
+    dispatcher = bot.app.dispatcher
+    dispatcher.update_parsers[FakeUpdate] = parse_fake_update
+    # The bot's own account, which command filters look up
+    bot.app.me = FakeUser(2)
+    bot.app = FakeClient(telegram)
+    bot.broadcast_manager.app = bot.app
+
+    await bot.downloader.start()
+    bot.db.start()
+    await dispatcher.start()
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": vars(args).copy(),
+    }
+    report["params"].pop("output", None)
+    report["params"].pop("baseline", None)
+    try:
+        if args.messages:
+            # URL phase without FloodWaits: they are a broadcast concern
+            flood_rate, telegram.flood_rate = telegram.flood_rate, 0.0
+            report["urls"] = await run_url_load(bot, dispatcher, telegram, args)
+            telegram.flood_rate = flood_rate
+        if args.broadcast_users:
+            report["broadcast"] = await run_broadcast(bot, telegram, args)
+        report["stub_api"] = {"requests": api.requests, "errors": api.errors}
+        report["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        await dispatcher.stop()
+        await bot.tasks.cancel()
+        await bot.broadcast_manager.close()
+        await bot.downloader.close()
+        await bot.db.close()
+        await api.stop()
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=2000, help="URL messages to handle (0 skips)")
+    parser.add_argument("--concurrency", type=int, default=100, help="URL messages in flight")
+    parser.add_argument("--distinct-ratio", type=float, default=0.5, help="share of distinct posts among URLs")
+    parser.add_argument("--broadcast-users", type=int, default=2000, help="broadcast recipients (0 skips)")
+    parser.add_argument("--broadcast-rate", type=float, default=0.0, help="override BROADCAST_RATE (msgs/s)")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="mean stub API latency in seconds")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="share of stub API 503 responses")
+    parser.add_argument("--telegram-latency", type=float, default=0.01, help="fake Telegram call latency")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of broadcast sends raising FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1, help="FloodWait duration")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
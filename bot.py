@@ -2,41 +2,84 @@ import asyncio
 import logging
 import os
 import re
+from typing import List, Optional
 from pyrogram import Client, filters
-from pyrogram.types import Message
+from pyrogram.types import InlineQuery, Message
 from pyrogram.errors import FloodWait, MessageNotModified
 from config import Config
-from downloader import InstagramDownloader
-from utils import setup_logging, admin_only
-from database import UserDatabase
+from downloader import InstagramDownloader, InstagramLink, find_instagram_urls
+from resolver import MediaItem
+from utils import BackgroundTasks, setup_logging, admin_only, format_file_size
+from database import UserDatabase, SEGMENT_HELP, parse_segment
 from broadcast import BroadcastManager
+from media import MediaSender, MediaTooLargeError
+from admission import AdmissionController, AdmissionRejected, REJECT_QUEUE_FULL
+from metrics import LINKS_PROCESSED, MetricsServer, track_handler
+from logs import with_request_id
+from diagnostics import Diagnostics
+from sharding import ShardDispatcher
+from batch import BatchProcessor
+from inline import InlineHandler
 
 # Configure logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
 class InstagramBot:
-    def __init__(self):
+    def __init__(self, shard_index: Optional[int] = None):
         # Validate configuration
         Config.validate()
-        
-        # Initialize Pyrogram client
+
+        # Shard workers only process forwarded URL messages; the main process receives updates
+        self.shard_index = shard_index
+        is_shard = shard_index is not None
+
+        # Initialize Pyrogram client (one session per process)
         self.app = Client(
-            Config.SESSION_NAME,
+            Config.SESSION_NAME if not is_shard else f"{Config.SESSION_NAME}_shard{shard_index}",
             api_id=Config.API_ID,
             api_hash=Config.API_HASH,
-            bot_token=Config.BOT_TOKEN
+            bot_token=Config.BOT_TOKEN,
+            workers=Config.HANDLER_WORKERS,
+            no_updates=is_shard
         )
+
+        # Handler work that outlives its update (URL processing); admission control is the real limit
+        self.tasks = BackgroundTasks()
         
         # Initialize downloader
         self.downloader = InstagramDownloader()
 
+        # Initialize media uploads (only in upload delivery mode)
+        self.media = MediaSender(self.app, self.downloader, shard_index) if Config.DELIVERY_MODE == "upload" else None
+
+        # Initialize admission control for URL processing
+        self.admission = AdmissionController.from_config()
+
+        # Initialize batch mode for many links at once
+        self.batches = BatchProcessor(self.downloader, self.admission)
+
+        # Initialize inline mode ("@bot <link>" in any chat)
+        self.inline = InlineHandler(self.downloader, self.admission)
+
+        # Initialize Prometheus metrics endpoint and event loop lag monitor
+        self.metrics_server = MetricsServer.from_config(shard_index)
+
+        # Initialize opt-in event loop diagnostics
+        self.diagnostics = Diagnostics()
+
+        if is_shard:
+            return
+
         # Initialize database
         self.db = UserDatabase()
 
         # Initialize broadcast manager
         self.broadcast_manager = BroadcastManager(self.app, self.db)
 
+        # Initialize worker processes for URL processing (SHARD_WORKERS > 1)
+        self.shards = ShardDispatcher(self.app, Config.SHARD_WORKERS) if Config.SHARD_WORKERS > 1 else None
+
         # Register handlers
         self.register_handlers()
     
@@ -44,28 +87,93 @@ class InstagramBot:
         """Register message handlers"""
         
         @self.app.on_message(filters.command("start"))
+        @track_handler("start")
+        @with_request_id
         async def start_command(client, message: Message):
             await self.handle_start(message)
 
         @self.app.on_message(filters.command("broadcast"))
+        @track_handler("broadcast")
+        @with_request_id
         @admin_only
         async def broadcast_command(client, message: Message):
             await self.handle_broadcast(message)
 
+        @self.app.on_message(filters.command("broadcasts"))
+        @track_handler("broadcasts")
+        @with_request_id
+        @admin_only
+        async def broadcasts_command(client, message: Message):
+            await message.reply_text(await self.broadcast_manager.list_jobs())
+
+        @self.app.on_message(filters.command(["broadcast_pause", "broadcast_resume", "broadcast_cancel"]))
+        @track_handler("broadcast_control")
+        @with_request_id
+        @admin_only
+        async def broadcast_control_command(client, message: Message):
+            await self.handle_broadcast_control(message)
+
         @self.app.on_message(filters.command("stats"))
+        @track_handler("stats")
+        @with_request_id
         @admin_only
         async def stats_command(client, message: Message):
             await self.handle_stats(message)
 
+        @self.app.on_message(filters.command("profile"))
+        @track_handler("profile")
+        @with_request_id
+        @admin_only
+        async def profile_command(client, message: Message):
+            await self.handle_profile(message)
+
         @self.app.on_message(filters.command("test_broadcast"))
+        @track_handler("test_broadcast")
+        @with_request_id
         @admin_only
         async def test_broadcast_command(client, message: Message):
             await self.handle_test_broadcast(message)
 
         @self.app.on_message(filters.text & filters.private)
+        @with_request_id
         async def handle_message(client, message: Message):
-            await self.handle_instagram_url(message)
+            # Add user to database if not exists
+            self.db.add_user(message.from_user.id)
+            if self.shards and not message.text.startswith('/'):
+                if not await self.shards.dispatch(message):
+                    await message.reply_text("⏳ The bot is busy right now. Please try again in a minute.")
+                return
+            # Resolving can take seconds; keep it off the dispatcher worker so other updates keep flowing
+            self.tasks.spawn(self.process_message(message))
+
+        @self.app.on_message(filters.document & filters.private)
+        @with_request_id
+        async def document_message(client, message: Message):
+            self.db.add_user(message.from_user.id)
+            # A batch runs for minutes; keep it off the dispatcher worker
+            self.tasks.spawn(self.process_document(message))
+
+        @self.app.on_inline_query()
+        @with_request_id
+        async def inline_query(client, query: InlineQuery):
+            # Debouncing sleeps and resolving takes seconds; a newer query must not wait behind them
+            self.tasks.spawn(self.process_inline_query(query))
     
+    @track_handler("text")
+    async def process_message(self, message: Message):
+        """Handle a private text message in the background"""
+        await self.handle_instagram_url(message)
+
+    @track_handler("document")
+    async def process_document(self, message: Message):
+        """Handle an uploaded file in the background"""
+        await self.handle_document(message)
+
+    @track_handler("inline")
+    async def process_inline_query(self, query: InlineQuery):
+        """Answer an inline query in the background"""
+        await self.inline.handle(query)
+
     async def handle_start(self, message: Message):
         """Handle /start command"""
         user_id = message.from_user.id
@@ -84,11 +192,13 @@ class InstagramBot:
             "1. Copy an Instagram video URL\n"
             "2. Send it to me\n"
             "3. Wait for the download to complete\n\n"
+            "**Many links?** Paste them all in one message or send a .txt file, "
+            f"up to {Config.BATCH_MAX_URLS} at a time.\n\n"
             "Bot by @medusaXD"
         )
 
         await message.reply_text(welcome_text)
-        logger.info(f"Start command used by user {user_id}")
+        logger.info("Start command used by user %s", user_id)
     
     async def handle_broadcast(self, message: Message):
         """Handle /broadcast command"""
@@ -97,25 +207,180 @@ class InstagramBot:
         if len(command_parts) < 2:
             await message.reply_text(
                 "📢 **Broadcast Command Usage:**\n\n"
-                "`/broadcast <your message>`\n\n"
-                "**Example:**\n"
-                "`/broadcast Hello everyone! The bot has been updated with new features.`\n\n"
+                "`/broadcast <your message>`\n"
+                "`/broadcast segment=<segment> <your message>`\n\n"
+                f"**Segments:** {SEGMENT_HELP}\n\n"
+                "**Examples:**\n"
+                "`/broadcast Hello everyone! The bot has been updated with new features.`\n"
+                "`/broadcast segment=active:30,never_failed We are back online!`\n\n"
                 "**Other commands:**\n"
+                "• `/broadcasts` - List recent broadcasts\n"
+                "• `/broadcast_pause <id>` - Pause a running broadcast\n"
+                "• `/broadcast_resume <id>` - Resume a paused broadcast\n"
+                "• `/broadcast_cancel <id>` - Cancel a broadcast\n"
                 "• `/stats` - View bot statistics\n"
+                "• `/profile [seconds]` - Profile the event loop (diagnostics mode)\n"
                 "• `/test_broadcast` - Send test message to yourself"
             )
             return
 
         broadcast_message = command_parts[1]
+        segment = "all"
+        if broadcast_message.startswith("segment="):
+            spec, _, broadcast_message = broadcast_message.partition(' ')
+            segment = spec[len("segment="):]
+            try:
+                parse_segment(segment)
+            except ValueError as e:
+                await message.reply_text(f"❌ {e}\n\n**Segments:** {SEGMENT_HELP}")
+                return
+            if not broadcast_message.strip():
+                await message.reply_text("❌ Broadcast message is empty.")
+                return
 
         # Start broadcast immediately (admin command)
-        await self.broadcast_manager.broadcast_message(broadcast_message, message)
+        await self.broadcast_manager.broadcast_message(broadcast_message, message, segment)
+
+    async def handle_broadcast_control(self, message: Message):
+        """Handle /broadcast_pause, /broadcast_resume and /broadcast_cancel"""
+        command = message.command[0].lower()
+        if len(message.command) < 2 or not message.command[1].isdigit():
+            await message.reply_text(f"Usage: `/{command} <broadcast id>`\n\nSee `/broadcasts` for IDs.")
+            return
+
+        job_id = int(message.command[1])
+        if command == "broadcast_pause":
+            reply = await self.broadcast_manager.pause_job(job_id)
+        elif command == "broadcast_resume":
+            reply = await self.broadcast_manager.resume_job(job_id)
+        else:
+            reply = await self.broadcast_manager.cancel_job(job_id)
+        await message.reply_text(reply)
 
     async def handle_stats(self, message: Message):
         """Handle /stats command"""
         stats_text = await self.broadcast_manager.get_broadcast_stats()
+
+        pool = self.downloader.get_pool_stats()
+        stats_text += (
+            f"\n🌐 **HTTP Pool**\n"
+            f"🔌 Open connections: {pool['open_connections']}/{pool['limit']}\n"
+            f"💤 Idle connections: {pool['idle_connections']}\n"
+            f"⏳ Acquire waits: {pool['waits']} (avg {pool['avg_wait'] * 1000:.1f} ms, "
+            f"max {pool['max_wait'] * 1000:.1f} ms)\n"
+        )
+
+        cache = self.downloader.cache.get_stats()
+        stats_text += (
+            f"\n🗂 **Result Cache** ({cache['backend']})\n"
+            f"📦 Entries: {cache['size']}/{cache['max_size']}\n"
+            f"🎯 Hits: {cache['hits']} ({cache['hit_rate']:.1f}%)\n"
+            f"🔍 Misses: {cache['misses']}\n"
+            f"♻️ Evictions: {cache['evictions']} (expired: {cache['expirations']})\n"
+        )
+
+        admission = self.admission.get_stats()
+        stats_text += (
+            f"\n🚦 **Admission Control**\n"
+            f"⚙️ Active: {admission['active']}/{admission['max_concurrent']}\n"
+            f"📥 Queue depth: {admission['queued']}/{admission['max_queue']} "
+            f"({admission['queued_users']} users)\n"
+            f"⏳ Queue wait: avg {admission['avg_wait']:.2f}s, max {admission['max_wait']:.2f}s\n"
+            f"🚫 Rejected: {admission['rejected_full']} busy, {admission['rejected_rate']} rate limited\n"
+        )
+
+        batches = self.batches.get_stats()
+        stats_text += (
+            f"\n📦 **Batches**\n"
+            f"⚙️ Running: {batches['active']} • Total: {batches['batches']} ({batches['links']} links resolved)\n"
+            f"🚫 Rejected: {batches['rejected']}\n"
+        )
+
+        inline = self.inline.get_stats()
+        stats_text += (
+            f"\n🔎 **Inline Queries**\n"
+            f"⚡ Cached: {inline.get('cached', 0)} • Resolved: {inline.get('resolved', 0)} • "
+            f"Pending: {inline.get('pending', 0)}\n"
+            f"⏱ Debounced: {inline.get('debounced', 0)} • Rejected: {inline.get('rejected', 0)} • "
+            f"Invalid: {inline.get('invalid', 0)}\n"
+        )
+
+        upstream = self.downloader.get_upstream_stats()
+        stats_text += (
+            f"\n🛡 **Upstream APIs**\n"
+            f"🔁 Retries: {upstream['retries']} • Failovers: {upstream['failovers']} • "
+            f"Fast-failed: {upstream['fast_failed']}\n"
+            f"🪞 Hedged requests: {upstream['hedges']} ({upstream['hedges_won']} won)\n"
+        )
+        for backend in upstream['backends']:
+            stats_text += (
+                f"• `{backend['name']}`: breaker {backend['state']} (opened {backend['times_opened']}x), "
+                f"{backend['ewma_latency'] * 1000:.0f} ms avg, p95 {backend['p95'] * 1000:.0f} ms, "
+                f"{backend['error_rate']:.0f}% errors\n"
+            )
+
+        if self.media:
+            media = self.media.get_stats()
+            stats_text += (
+                f"\n📤 **Uploads**\n"
+                f"⬆️ Uploaded: {media['uploads']} ({format_file_size(media['bytes_downloaded'])} downloaded)\n"
+                f"♻️ Re-sent by file_id: {media['reused']} ({media['cached_file_ids']} cached)\n"
+                f"🖼 Media groups sent: {media['groups']}\n"
+                f"⬇️ Downloads: {media['download_active']}/{media['download_concurrency']} active, "
+                f"{media['download_waiting']} waiting, avg {format_file_size(int(media['download_avg_throughput']))}/s\n"
+                f"💽 Temp disk: {format_file_size(media['download_disk_reserved'])} / "
+                f"{format_file_size(media['download_disk_budget'])}\n"
+            )
+
+        if self.shards:
+            shards = self.shards.get_stats()
+            stats_text += (
+                f"\n🧩 **Shard Workers**\n"
+                f"⚙️ Alive: {shards['alive']}/{shards['workers']} (restarts: {shards['restarts']})\n"
+                f"📨 Dispatched: {', '.join(str(count) for count in shards['dispatched'])}\n"
+                f"🚫 Rejected (queue full): {shards['rejected']}\n"
+                f"ℹ️ Sections above cover the main process; workers expose their own /metrics\n"
+            )
+
+        flights = self.downloader.singleflight.get_stats()
+        stats_text += (
+            f"\n🔀 **Lookup Coalescing**\n"
+            f"🛫 Upstream lookups: {flights['leaders']}\n"
+            f"🤝 Coalesced callers: {flights['coalesced']}\n"
+            f"⏱ In flight: {flights['in_flight']} (abandoned: {flights['abandoned']})\n"
+        )
+
         await message.reply_text(stats_text)
 
+    async def handle_profile(self, message: Message):
+        """Handle /profile command"""
+        if not self.diagnostics.enabled:
+            await message.reply_text("❌ Diagnostics are disabled. Set `DIAGNOSTICS_ENABLED=true` to use `/profile`.")
+            return
+        if self.diagnostics.profiler.running:
+            await message.reply_text("⏳ A profile is already being taken.")
+            return
+
+        seconds = 10
+        if len(message.command) > 1:
+            if not message.command[1].isdigit() or int(message.command[1]) < 1:
+                await message.reply_text("Usage: `/profile [seconds]`")
+                return
+            seconds = min(int(message.command[1]), Config.PROFILE_MAX_SECONDS)
+
+        status_msg = await message.reply_text(f"🔬 Profiling the event loop for {seconds}s...")
+        path = await self.diagnostics.profiler.profile(seconds)
+        watchdog = self.diagnostics.watchdog.get_stats()
+        await message.reply_document(
+            path,
+            caption=(
+                f"🔥 Collapsed stacks for {seconds}s (flamegraph.pl / speedscope)\n"
+                f"🐌 Loop stalls over {watchdog['threshold'] * 1000:.0f} ms: {watchdog['stalls']} "
+                f"(max {watchdog['max_stall'] * 1000:.0f} ms)"
+            )
+        )
+        await status_msg.delete()
+
     async def handle_test_broadcast(self, message: Message):
         """Handle /test_broadcast command"""
         success = await self.broadcast_manager.send_test_broadcast(message.from_user.id)
@@ -126,18 +391,15 @@ class InstagramBot:
 
     async def handle_instagram_url(self, message: Message):
         """Handle Instagram URL messages"""
-        user_id = message.from_user.id
         text = message.text.strip()
 
-        # Add user to database if not exists
-        self.db.add_user(user_id)
-        
         # Skip if message is a command
         if text.startswith('/'):
             return
 
-        # Check if message contains Instagram URL
-        if not self.downloader.is_valid_instagram_url(text):
+        # Find Instagram URLs anywhere in the message
+        links = find_instagram_urls(text)
+        if not links:
             await message.reply_text(
                 "❌ Please send a valid Instagram URL.\n\n"
                 "**Examples:**\n"
@@ -146,31 +408,90 @@ class InstagramBot:
                 "• https://www.instagram.com/tv/ABC123/"
             )
             return
-        
+
+        if len(links) > Config.MAX_URLS_PER_MESSAGE:
+            # Too many for one reply each: resolve them together into one consolidated reply
+            await self.batches.run(message, links)
+            return
+
+        for link in links:
+            await self.handle_instagram_link(message, link)
+
+    async def handle_document(self, message: Message):
+        """Handle an uploaded .txt file of Instagram URLs as a batch"""
+        document = message.document
+        file_name = (document.file_name or "").lower()
+        if not file_name.endswith(".txt") and document.mime_type != "text/plain":
+            await message.reply_text("❌ Please send Instagram URLs as text, or as a .txt file with one URL per line.")
+            return
+        if document.file_size and document.file_size > Config.BATCH_MAX_FILE_SIZE:
+            await message.reply_text(
+                f"❌ The file is too large (max {format_file_size(Config.BATCH_MAX_FILE_SIZE)})."
+            )
+            return
+
+        data = await message.download(in_memory=True)
+        links = find_instagram_urls(data.getvalue().decode("utf-8", errors="replace"))
+        if not links:
+            await message.reply_text("❌ No Instagram URLs found in the file.")
+            return
+        await self.batches.run(message, links)
+
+    async def handle_instagram_link(self, message: Message, link: InstagramLink):
+        """Resolve a single Instagram link and reply with its download links"""
+        user_id = message.from_user.id
+
         # Send processing message
         processing_msg = await message.reply_text("🔄 Processing your request...")
-        
+
+        async def on_queued(position: int):
+            await processing_msg.edit_text(f"⏳ The bot is busy, you are in the queue (position {position})...")
+
         try:
-            # Get video information
-            video_info = await self.downloader.process_instagram_url(text)
+            # Get video information once admitted
+            try:
+                video_info = await self.admission.run(
+                    user_id, lambda: self.downloader.process_link(link), on_queued
+                )
+            except AdmissionRejected as e:
+                LINKS_PROCESSED.inc((e.reason,))
+                if e.reason == REJECT_QUEUE_FULL:
+                    await processing_msg.edit_text(
+                        f"⏳ The bot is busy right now (queue position {e.position}). Please try again in a minute."
+                    )
+                else:
+                    await processing_msg.edit_text(
+                        f"🐢 You're sending links too fast. Please try again in {max(1, round(e.retry_after))} seconds."
+                    )
+                return
             
-            if not video_info or not video_info.get('urls'):
+            if not video_info:
+                LINKS_PROCESSED.inc(("failed",))
                 await processing_msg.edit_text(
                     "❌ Failed to fetch video information. Please check the URL and try again."
                 )
                 return
             
-            # Get video URLs and metadata
-            video_urls = video_info['urls']
+            # Get media items (several for a carousel) and metadata
+            items = video_info['items']
             metadata = video_info.get('metadata', {})
-            original_url = video_info.get('original_url', text)
+            original_url = video_info.get('original_url', link.url)
 
-            if not video_urls:
+            if not items:
                 await processing_msg.edit_text("❌ No video found in the provided URL.")
                 return
 
+            # Upload the media itself when enabled, falling back to links on failure
+            if self.media and await self.upload_media(message, processing_msg, link, items, metadata):
+                LINKS_PROCESSED.inc(("uploaded",))
+                logger.info("Successfully uploaded %d Instagram items for user %s", len(items), user_id)
+                return
+
             # Format the response message
-            response_text = "✅ **Instagram Video Download Links**\n\n"
+            if all(item.kind == "video" for item in items):
+                response_text = "✅ **Instagram Video Download Links**\n\n"
+            else:
+                response_text = "✅ **Instagram Post Download Links**\n\n"
 
             # Add metadata if available
             if metadata:
@@ -190,8 +511,10 @@ class InstagramBot:
 
             # Add download URLs
             response_text += "📥 **Download Links:**\n"
-            for i, video_url in enumerate(video_urls, 1):
-                response_text += f"**{i}.** [Download Video {i}]({video_url})\n"
+            for i, item in enumerate(items, 1):
+                details = item.describe()
+                suffix = f" ({details})" if details else ""
+                response_text += f"**{i}.** [Download {item.kind.title()} {i}]({item.url}){suffix}\n"
 
             response_text += "\n💡 **How to download:**\n"
             response_text += "• Tap any download link above\n"
@@ -205,10 +528,12 @@ class InstagramBot:
                 disable_web_page_preview=True
             )
 
-            logger.info(f"Successfully processed Instagram URL for user {user_id}")
+            LINKS_PROCESSED.inc(("links",))
+            logger.info("Successfully processed Instagram URL for user %s", user_id)
 
         except Exception as e:
-            logger.error(f"Error processing Instagram URL: {e}")
+            LINKS_PROCESSED.inc(("error",))
+            logger.error("Error processing Instagram URL: %s", e)
             try:
                 await processing_msg.edit_text(
                     "❌ An error occurred while processing your request. Please try again later."
@@ -216,14 +541,59 @@ class InstagramBot:
             except MessageNotModified:
                 pass
     
+    async def upload_media(self, message: Message, processing_msg: Message, link: InstagramLink,
+                           items: List[MediaItem], metadata: dict) -> bool:
+        """Send the post as Telegram uploads (one media group for a carousel); return False to fall back to links"""
+        caption = f"👤 @{metadata['username']}\n\n" if metadata.get('username') else ""
+        caption += "Bot by @medusaXD"
+
+        try:
+            await processing_msg.edit_text(
+                "📤 Uploading video..." if len(items) == 1 else f"📤 Uploading {len(items)} items..."
+            )
+            await self.media.send_items(message, link.shortcode, items, caption)
+        except MediaTooLargeError as e:
+            logger.info("Not uploading %s: %s", link.shortcode, e)
+            return False
+        except Exception as e:
+            logger.error("Error uploading %s, sending links instead: %s", link.shortcode, e)
+            return False
+
+        try:
+            await processing_msg.delete()
+        except Exception:
+            pass
+        return True
+
     async def run(self):
         """Start the bot"""
         logger.info("Starting Instagram Downloader Bot...")
+        await self.metrics_server.start()
+        await self.diagnostics.start()
+        await self.downloader.start()
+        self.db.start()
+        if self.shards:
+            self.shards.start()
         await self.app.start()
         logger.info("Bot started successfully!")
-        
-        # Keep the bot running
-        await asyncio.Event().wait()
+
+        # Continue broadcasts interrupted by the last shutdown
+        await self.broadcast_manager.resume_jobs()
+
+        try:
+            # Keep the bot running
+            await asyncio.Event().wait()
+        finally:
+            logger.info("Shutting down Instagram Downloader Bot...")
+            await self.tasks.cancel()
+            await self.broadcast_manager.close()
+            if self.shards:
+                await self.shards.stop()
+            await self.app.stop()
+            await self.downloader.close()
+            await self.db.close()
+            await self.metrics_server.stop()
+            await self.diagnostics.stop()
 
 async def main():
     """Main function"""
@@ -1,118 +1,558 @@
 import asyncio
 import logging
-from typing import List
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
 from pyrogram import Client
 from pyrogram.types import Message
 from pyrogram.errors import FloodWait, UserIsBlocked, ChatWriteForbidden, PeerIdInvalid
+from config import Config
 from database import UserDatabase
+from ratelimit import TokenBucket
+from utils import format_duration, format_file_size
+from metrics import (
+    BROADCAST_MESSAGES, BROADCAST_RATE, CACHE_LOOKUPS, DB_WRITE_LATENCY, FLOOD_WAITS, FLOOD_WAIT_SECONDS,
+    LINKS_PROCESSED, LOOP_LAG, MESSAGE_LATENCY, UPSTREAM_LATENCY, UPSTREAM_REQUESTS
+)
+from broadcast_store import (
+    BroadcastJobStore, STATUS_PREPARING, STATUS_RUNNING, STATUS_PAUSED, STATUS_CANCELLED, STATUS_COMPLETED,
+    STATUS_FAILED,
+    OUTCOME_SENT, OUTCOME_FAILED, OUTCOME_BLOCKED, OUTCOME_INVALID
+)
 
 logger = logging.getLogger(__name__)
 
+def percent(part: int, total: int) -> float:
+    """part as a percentage of total (0 for an empty job)"""
+    return part / total * 100 if total else 0.0
+
+class BroadcastJob:
+    """In-memory state of a broadcast job that is running or paused"""
+
+    def __init__(self, job: dict):
+        self.job_id = job['job_id']
+        self.message = job['message']
+        self.status = job['status']
+        self.total = job['total']
+        self.processed = job['processed']
+        self.success = job['success']
+        self.failed = job['failed']
+        self.blocked = job['blocked']
+        self.chat_id = job['chat_id']
+        self.status_message_id = job['status_message_id']
+
+        # Outcomes not yet checkpointed: (outcome, user_id)
+        self.outcomes: List[Tuple[str, int]] = []
+
+        # Blocked/invalid users to remove from the user store at the next checkpoint
+        self.prune: List[int] = []
+
+        # Users whose delivery failed, counted in the user store at the next checkpoint
+        self.failures: List[int] = []
+
+        # Workers wait on this event; cleared while the job is paused
+        self.resume_event = asyncio.Event()
+        if self.status == STATUS_RUNNING:
+            self.resume_event.set()
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+
+        # Progress reporting for the current run (not persisted)
+        self.errors: Dict[str, int] = {}
+        self.run_started_at = time.monotonic()
+        self.run_started_processed = self.processed
+        self.reported_processed: Optional[int] = None
+
+    def record_error(self, kind: str):
+        """Count an error by kind for the progress breakdown"""
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def throughput(self) -> float:
+        """Messages processed per second since this run started"""
+        elapsed = time.monotonic() - self.run_started_at
+        done = self.processed - self.run_started_processed
+        return done / elapsed if elapsed > 0 else 0.0
+
+    def counters(self) -> dict:
+        """Get the job's counters"""
+        return {
+            "processed": self.processed,
+            "success": self.success,
+            "failed": self.failed,
+            "blocked": self.blocked
+        }
+
+class RecipientFeed:
+    """Hands a job's pending recipients to its workers, one page at a time
+
+    Pages are read by keyset (user_id after the last one handed out), so
+    memory stays at one page however many recipients the job has, and
+    recipients whose outcome is not checkpointed yet are never read twice.
+    Retries are served before new recipients.
+    """
+
+    def __init__(self, store: BroadcastJobStore, job_id: int, page_size: int):
+        self.store = store
+        self.job_id = job_id
+        self.page_size = page_size
+        self._page: Deque[int] = deque()
+        self._retries: Deque[Tuple[int, int]] = deque()
+        self._after: Optional[int] = None
+        self._exhausted = False
+        self._lock = asyncio.Lock()
+
+    def retry(self, user_id: int, attempt: int):
+        """Send to a recipient again later"""
+        self._retries.append((user_id, attempt))
+
+    async def next(self) -> Optional[Tuple[int, int]]:
+        """The next (user_id, attempt) to send, or None when there is nothing left"""
+        if self._retries:
+            return self._retries.popleft()
+        async with self._lock:
+            if not self._page and not self._exhausted:
+                page = await self.store.pending_recipients(self.job_id, self._after, self.page_size)
+                if len(page) < self.page_size:
+                    self._exhausted = True
+                if page:
+                    self._after = page[-1]
+                    self._page.extend(page)
+            if self._page:
+                return self._page.popleft(), 0
+        # Another worker may have queued a retry while this one waited for the page
+        return self._retries.popleft() if self._retries else None
+
+
 class BroadcastManager:
     def __init__(self, app: Client, db: UserDatabase):
         self.app = app
         self.db = db
+
+        # Global send pacing shared by all broadcast workers
+        self.workers = Config.BROADCAST_WORKERS
+        self.max_rate = Config.BROADCAST_RATE
+        self.max_retries = Config.BROADCAST_MAX_RETRIES
+        self.rate_limiter = TokenBucket(Config.BROADCAST_RATE, Config.BROADCAST_BURST)
+        self.flood_waits = 0
+        BROADCAST_RATE.set_function(lambda: {(): self.rate_limiter.rate})
+
+        # Persisted broadcast jobs; running and paused ones are also kept in memory
+        self.store = BroadcastJobStore()
+        self.jobs: Dict[int, BroadcastJob] = {}
     
-    async def broadcast_message(self, message: str, admin_message: Message) -> dict:
-        """Broadcast message to all users"""
-        users = self.db.get_all_users()
-        total_users = len(users)
+    async def broadcast_message(self, message: str, admin_message: Message,
+                                segment: str = "all") -> Optional[BroadcastJob]:
+        """Start broadcasting a message to the users of a segment (everyone by default)
+
+        Returns once the job is running, with the job (None if nobody was
+        found); it continues in job.task and is resumable from the store.
+        """
+        if await self.db.count_segment(segment) == 0:
+            await admin_message.reply_text(f"❌ No users found in segment `{segment}`.")
+            return None
+
+        # Recipients are streamed from the user store in batches, never as one list. The job
+        # stays "preparing" (not resumable) until the snapshot is complete, so a crash midway
+        # cannot resume it with only part of its recipients.
+        job_id = await self.store.create_job(message, [], admin_message.chat.id, STATUS_PREPARING)
+        try:
+            async for user_ids in self.db.iter_segment(segment, Config.BROADCAST_SNAPSHOT_BATCH):
+                await self.store.add_recipients(job_id, user_ids)
+        except BaseException as e:
+            logger.error("Broadcast #%s failed while snapshotting recipients: %r", job_id, e)
+            await asyncio.shield(self._fail_preparing(job_id))
+            if isinstance(e, Exception):
+                await admin_message.reply_text(f"❌ Broadcast #{job_id} failed while collecting recipients.")
+            raise
+        stored = await self.store.get_job(job_id)
+        if stored['total'] == 0:
+            # The segment emptied between counting and the snapshot: nothing to send
+            await self.store.set_status(job_id, STATUS_COMPLETED)
+            await admin_message.reply_text(f"❌ No users found in segment `{segment}`.")
+            return None
+        await self.store.set_status(job_id, STATUS_RUNNING)
+        stored['status'] = STATUS_RUNNING
+        job = BroadcastJob(stored)
+        total_users = job.total
+        logger.info("Broadcast #%s created for segment %r with %d recipients", job_id, segment, total_users)
+
+        # Runs detached: the /broadcast handler returns while the job may run for hours. Started
+        # before the status reply so a failed reply cannot leave a running job without a task.
+        self._start_job(job)
+
+        # Send confirmation to admin; progress edits start once the message exists
+        try:
+            status_msg = await admin_message.reply_text(
+                f"📢 **Broadcast #{job_id}: sending to {total_users} users...**\n\n"
+                f"✅ Sent: 0\n"
+                f"❌ Failed: 0\n"
+                f"🚫 Blocked: 0\n"
+                f"📊 Progress: 0/{total_users}\n\n"
+                f"⏸ `/broadcast_pause {job_id}` • ❌ `/broadcast_cancel {job_id}`"
+            )
+            job.status_message_id = status_msg.id
+            await self.store.set_status_message(job_id, status_msg.chat.id, status_msg.id)
+        except Exception as e:
+            logger.error("Error sending the status message of broadcast #%s: %s", job_id, e)
+        return job
+
+    def _start_job(self, job: BroadcastJob):
+        """Run a job in the background; failures are logged and reported by _run_job"""
+        job.task = asyncio.create_task(self._run_job(job))
+        job.task.add_done_callback(self._consume_exception)
+
+    @staticmethod
+    def _consume_exception(task: asyncio.Task):
+        """Retrieve a background job's exception, already logged and reported by _run_job"""
+        if not task.cancelled():
+            task.exception()
+
+    async def _run_job(self, job: BroadcastJob) -> dict:
+        """Send a job, marking it failed if it stops with an error (cancellation keeps it resumable)"""
+        try:
+            return await self._send_job(job)
+        except Exception as e:
+            logger.exception("Broadcast #%s failed", job.job_id)
+            await self._fail_job(job, e)
+            raise
+
+    async def _fail_job(self, job: BroadcastJob, error: Exception):
+        """Record a job as failed and tell the admin"""
+        job.status = STATUS_FAILED
+        self.jobs.pop(job.job_id, None)
+        try:
+            await self.store.set_status(job.job_id, STATUS_FAILED)
+        except Exception as e:
+            logger.error("Error marking broadcast #%s failed: %s", job.job_id, e)
+        try:
+            await self.app.send_message(
+                job.chat_id,
+                f"❌ Broadcast #{job.job_id} failed at {job.processed}/{job.total}: {type(error).__name__}: {error}"
+            )
+        except Exception as e:
+            logger.error("Error notifying admin about failed broadcast #%s: %s", job.job_id, e)
+
+    async def _send_job(self, job: BroadcastJob) -> dict:
+        """Send a job to its remaining recipients, checkpointing progress as it goes"""
+        self.jobs[job.job_id] = job
+
+        # Only recipients without a recorded outcome are (re)sent, streamed page by page
+        feed = RecipientFeed(self.store, job.job_id, Config.BROADCAST_SNAPSHOT_BATCH)
+        workers = [
+            asyncio.create_task(self._broadcast_worker(feed, job))
+            for _ in range(max(1, min(self.workers, job.total - job.processed)))
+        ]
+        job.run_started_at = time.monotonic()
+        job.run_started_processed = job.processed
+        checkpointer = asyncio.create_task(self._checkpoint_loop(job))
+        reporter = asyncio.create_task(self._progress_loop(job))
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            checkpointer.cancel()
+            reporter.cancel()
+            await self._checkpoint(job)
+
+        if job.cancelled:
+            job.status = STATUS_CANCELLED
+            title = f"❌ **Broadcast #{job.job_id} Cancelled**"
+        else:
+            job.status = STATUS_COMPLETED
+            title = f"📢 **Broadcast #{job.job_id} Complete!**"
+        await self.store.set_status(job.job_id, job.status)
+        self.jobs.pop(job.job_id, None)
+
+        # Final status update
+        final_message = (
+            f"{title}\n\n"
+            f"✅ Successfully sent: {job.success}\n"
+            f"❌ Failed to send: {job.failed}\n"
+            f"🚫 Blocked users: {job.blocked}\n"
+            f"📊 Total users: {job.total}\n\n"
+            f"📈 Success rate: {percent(job.success, job.total):.1f}%"
+        )
         
-        if total_users == 0:
-            await admin_message.reply_text("❌ No users found in database.")
-            return {"success": 0, "failed": 0, "blocked": 0, "total": 0}
+        try:
+            await self.app.edit_message_text(job.chat_id, job.status_message_id, final_message)
+        except Exception:
+            await self.app.send_message(job.chat_id, final_message)
         
-        # Send confirmation to admin
-        status_msg = await admin_message.reply_text(
-            f"📢 **Broadcasting message to {total_users} users...**\n\n"
-            f"✅ Sent: 0\n"
-            f"❌ Failed: 0\n"
-            f"🚫 Blocked: 0\n"
-            f"📊 Progress: 0/{total_users}"
+        logger.info(
+            "Broadcast #%s %s: %d sent, %d failed, %d blocked",
+            job.job_id, job.status, job.success, job.failed, job.blocked
         )
         
-        success_count = 0
-        failed_count = 0
-        blocked_count = 0
-        
-        for i, user_id in enumerate(users):
+        return {
+            "success": job.success,
+            "failed": job.failed,
+            "blocked": job.blocked,
+            "total": job.total
+        }
+
+    async def _fail_preparing(self, job_id: int):
+        """Mark a job whose recipient snapshot did not complete as failed"""
+        try:
+            await self.store.set_status(job_id, STATUS_FAILED)
+        except Exception as e:
+            logger.error("Error marking broadcast #%s failed: %s", job_id, e)
+
+    async def _checkpoint_loop(self, job: BroadcastJob):
+        """Periodically persist the job's outcomes and counters"""
+        while True:
+            await asyncio.sleep(Config.BROADCAST_CHECKPOINT_INTERVAL)
+            await self._checkpoint(job)
+
+    async def _checkpoint(self, job: BroadcastJob):
+        """Persist outcomes collected since the last checkpoint in one transaction"""
+        prune, job.prune = job.prune, []
+        if prune:
+            removed = self.db.remove_users(prune)
+            logger.info("Broadcast #%s: pruned %d blocked/invalid users from database", job.job_id, removed)
+
+        failures, job.failures = job.failures, []
+        if failures:
+            self.db.record_failures(failures)
+
+        outcomes, job.outcomes = job.outcomes, []
+        try:
+            await self.store.checkpoint(job.job_id, outcomes, job.counters())
+        except Exception as e:
+            logger.error("Error checkpointing broadcast #%s: %s", job.job_id, e)
+            job.outcomes = outcomes + job.outcomes
+
+    async def _broadcast_worker(self, feed: RecipientFeed, job: BroadcastJob):
+        """Send to the feed's recipients, pacing every send through the shared rate limiter"""
+        while not job.cancelled:
+            await job.resume_event.wait()
+            if job.cancelled:
+                return
+            entry = await feed.next()
+            if entry is None:
+                return
+            user_id, attempt = entry
+
+            await self.rate_limiter.acquire()
             try:
-                await self.app.send_message(user_id, message)
-                success_count += 1
-                
-                # Update status every 10 users or at the end
-                if (i + 1) % 10 == 0 or i == total_users - 1:
-                    try:
-                        await status_msg.edit_text(
-                            f"📢 **Broadcasting message to {total_users} users...**\n\n"
-                            f"✅ Sent: {success_count}\n"
-                            f"❌ Failed: {failed_count}\n"
-                            f"🚫 Blocked: {blocked_count}\n"
-                            f"📊 Progress: {i + 1}/{total_users}"
-                        )
-                    except Exception:
-                        pass
-                
+                await self.app.send_message(user_id, job.message)
+                job.success += 1
+                outcome = OUTCOME_SENT
+                self._on_send_success()
+
             except FloodWait as e:
-                logger.warning(f"FloodWait: {e.value} seconds")
-                await asyncio.sleep(e.value)
-                try:
-                    await self.app.send_message(user_id, message)
-                    success_count += 1
-                except Exception:
-                    failed_count += 1
-                    
+                self._on_flood_wait(e.value)
+                job.record_error("flood_wait")
+                if attempt < self.max_retries:
+                    # Retry later; the pause applies to every worker through the rate limiter
+                    feed.retry(user_id, attempt + 1)
+                    continue
+                job.failed += 1
+                outcome = OUTCOME_FAILED
+                job.failures.append(user_id)
+
             except (UserIsBlocked, ChatWriteForbidden):
-                blocked_count += 1
-                # Remove blocked users from database
-                self.db.remove_user(user_id)
-                logger.info(f"Removed blocked user {user_id} from database")
-                
+                job.blocked += 1
+                job.record_error("blocked")
+                outcome = OUTCOME_BLOCKED
+                # Blocked users are removed from the database in bulk at the next checkpoint
+                job.prune.append(user_id)
+
             except PeerIdInvalid:
-                failed_count += 1
-                # Remove invalid users from database
-                self.db.remove_user(user_id)
-                logger.info(f"Removed invalid user {user_id} from database")
-                
+                job.failed += 1
+                job.record_error("invalid")
+                outcome = OUTCOME_INVALID
+                # Invalid users are removed from the database in bulk at the next checkpoint
+                job.prune.append(user_id)
+
             except Exception as e:
-                failed_count += 1
-                logger.error(f"Error sending message to {user_id}: {e}")
-            
-            # Small delay to avoid hitting rate limits
-            await asyncio.sleep(0.1)
-        
-        # Final status update
-        final_message = (
-            f"📢 **Broadcast Complete!**\n\n"
-            f"✅ Successfully sent: {success_count}\n"
-            f"❌ Failed to send: {failed_count}\n"
-            f"🚫 Blocked users: {blocked_count}\n"
-            f"📊 Total users: {total_users}\n\n"
-            f"📈 Success rate: {(success_count/total_users)*100:.1f}%"
-        )
-        
+                job.failed += 1
+                job.record_error(type(e).__name__)
+                outcome = OUTCOME_FAILED
+                job.failures.append(user_id)
+                logger.error("Error sending message to %s: %s", user_id, e)
+
+            job.outcomes.append((outcome, user_id))
+            job.processed += 1
+            BROADCAST_MESSAGES.inc((outcome,))
+
+    async def _progress_loop(self, job: BroadcastJob):
+        """Edit the admin's status message at most once per interval, only when progress changed"""
+        while True:
+            await asyncio.sleep(Config.BROADCAST_PROGRESS_INTERVAL)
+            if job.processed == job.reported_processed or not job.status_message_id:
+                continue
+            await self._update_status(job)
+
+    async def _update_status(self, job: BroadcastJob):
+        """Edit the admin's status message"""
+        throughput = job.throughput()
+        remaining = job.total - job.processed
+        eta = format_duration(remaining / throughput) if throughput > 0 else "unknown"
+        errors = ", ".join(f"{kind}: {count}" for kind, count in sorted(job.errors.items())) or "none"
+        if job.status == STATUS_PAUSED:
+            state = "⏸ Paused"
+        else:
+            state = f"⚡ {throughput:.1f} msg/s • ⏳ ETA: {eta}"
+
+        # Status edits count against the same Telegram rate budget as the broadcast itself
+        await self.rate_limiter.acquire()
+        job.reported_processed = job.processed
         try:
-            await status_msg.edit_text(final_message)
+            await self.app.edit_message_text(
+                job.chat_id,
+                job.status_message_id,
+                f"📢 **Broadcast #{job.job_id}: sending to {job.total} users...**\n\n"
+                f"✅ Sent: {job.success}\n"
+                f"❌ Failed: {job.failed}\n"
+                f"🚫 Blocked: {job.blocked}\n"
+                f"📊 Progress: {job.processed}/{job.total} ({percent(job.processed, job.total):.1f}%)\n"
+                f"{state}\n"
+                f"🧾 Errors: {errors}\n\n"
+                f"⏸ `/broadcast_pause {job.job_id}` • ❌ `/broadcast_cancel {job.job_id}`"
+            )
+        except FloodWait as e:
+            self._on_flood_wait(e.value)
         except Exception:
-            await admin_message.reply_text(final_message)
-        
-        logger.info(f"Broadcast completed: {success_count} sent, {failed_count} failed, {blocked_count} blocked")
-        
-        return {
-            "success": success_count,
-            "failed": failed_count,
-            "blocked": blocked_count,
-            "total": total_users
-        }
+            pass
+
+    async def resume_jobs(self):
+        """Load unfinished jobs after a restart and continue the running ones"""
+        # Snapshots interrupted by the restart are incomplete; they are failed, never sent
+        for stored in await self.store.list_jobs((STATUS_PREPARING,), limit=100):
+            logger.warning("Broadcast #%s was interrupted while snapshotting recipients", stored['job_id'])
+            await self._fail_preparing(stored['job_id'])
+
+        for stored in await self.store.list_jobs((STATUS_RUNNING, STATUS_PAUSED), limit=100):
+            job = BroadcastJob(stored)
+            self.jobs[job.job_id] = job
+            if job.status != STATUS_RUNNING:
+                continue
+            logger.info("Resuming broadcast #%s (%d/%d processed)", job.job_id, job.processed, job.total)
+            self._start_job(job)
+            try:
+                await self.app.send_message(
+                    job.chat_id,
+                    f"♻️ Resuming broadcast #{job.job_id} after restart ({job.processed}/{job.total} processed)"
+                )
+            except Exception as e:
+                logger.error("Error notifying admin about resumed broadcast #%s: %s", job.job_id, e)
+
+    async def pause_job(self, job_id: int) -> str:
+        """Pause a running job"""
+        job = self.jobs.get(job_id)
+        if not job or job.status != STATUS_RUNNING:
+            return f"❌ Broadcast #{job_id} is not running."
+        job.status = STATUS_PAUSED
+        job.resume_event.clear()
+        await self.store.set_status(job_id, STATUS_PAUSED)
+        await self._checkpoint(job)
+        return f"⏸ Broadcast #{job_id} paused at {job.processed}/{job.total}. Resume with `/broadcast_resume {job_id}`."
+
+    async def resume_job(self, job_id: int) -> str:
+        """Resume a paused job"""
+        job = self.jobs.get(job_id)
+        if not job or job.status != STATUS_PAUSED:
+            return f"❌ Broadcast #{job_id} is not paused."
+        job.status = STATUS_RUNNING
+        await self.store.set_status(job_id, STATUS_RUNNING)
+        job.resume_event.set()
+        if job.task is None or job.task.done():
+            # Paused before a restart: nothing is running it yet
+            self._start_job(job)
+        return f"▶️ Broadcast #{job_id} resumed at {job.processed}/{job.total}."
+
+    async def cancel_job(self, job_id: int) -> str:
+        """Cancel a running or paused job"""
+        job = self.jobs.get(job_id)
+        if not job:
+            return f"❌ Broadcast #{job_id} is not running or paused."
+        job.cancelled = True
+        job.resume_event.set()
+        if job.task is None or job.task.done():
+            job.status = STATUS_CANCELLED
+            await self.store.set_status(job_id, STATUS_CANCELLED)
+            self.jobs.pop(job_id, None)
+        return f"❌ Broadcast #{job_id} cancelled at {job.processed}/{job.total}."
+
+    async def list_jobs(self) -> str:
+        """Describe the most recent broadcast jobs"""
+        jobs = await self.store.list_jobs(limit=10)
+        if not jobs:
+            return "📭 No broadcasts yet."
+        lines = ["📋 **Recent Broadcasts**\n"]
+        for stored in jobs:
+            # Prefer live counters for jobs that are in progress
+            job = self.jobs.get(stored['job_id'])
+            counters = job.counters() if job else stored
+            status = job.status if job else stored['status']
+            lines.append(
+                f"**#{stored['job_id']}** {status} - {counters['processed']}/{stored['total']} "
+                f"(✅ {counters['success']} ❌ {counters['failed']} 🚫 {counters['blocked']})"
+            )
+        return "\n".join(lines)
+
+    async def close(self):
+        """Stop running jobs, keeping their state so they resume on the next start"""
+        tasks = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.store.close()
+
+    def _on_send_success(self):
+        """Additively restore the send rate after a FloodWait (about +step msgs/s per second)"""
+        if self.rate_limiter.rate < self.max_rate:
+            new_rate = self.rate_limiter.rate + Config.BROADCAST_RECOVERY_STEP / self.rate_limiter.rate
+            self.rate_limiter.set_rate(min(self.max_rate, new_rate))
+
+    def _on_flood_wait(self, seconds: float):
+        """Pause all workers and multiplicatively cut the send rate"""
+        self.flood_waits += 1
+        FLOOD_WAITS.inc()
+        FLOOD_WAIT_SECONDS.inc(amount=seconds)
+        if self.rate_limiter.is_paused():
+            # Another worker already reacted to this flood window
+            self.rate_limiter.pause(seconds)
+            return
+        new_rate = max(Config.BROADCAST_MIN_RATE, self.rate_limiter.rate * Config.BROADCAST_BACKOFF_FACTOR)
+        self.rate_limiter.pause(seconds)
+        self.rate_limiter.set_rate(new_rate)
+        logger.warning("FloodWait: pausing broadcast for %s seconds, rate lowered to %.1f msg/s", seconds, new_rate)
     
     async def get_broadcast_stats(self) -> str:
         """Get broadcast statistics"""
         stats = self.db.get_stats()
-        return (
+        text = (
             f"📊 **Bot Statistics**\n\n"
-            f"👥 Total users: {stats['total_users']}\n"
+            f"👥 Total users: {stats['total_users']} ({format_file_size(stats['memory_bytes'])} in memory)\n"
             f"📅 Database file: {self.db.db_file}\n"
         )
+
+        # Same figures as the Prometheus endpoint, summarised
+        cache_hits = CACHE_LOOKUPS.value(("results", "hit")) + CACHE_LOOKUPS.value(("results", "backend_hit"))
+        cache_lookups = cache_hits + CACHE_LOOKUPS.value(("results", "miss"))
+        upstream_errors = sum(
+            value for (backend, status), value in UPSTREAM_REQUESTS.series().items() if status != "200"
+        )
+        text += (
+            f"\n📈 **Metrics**\n"
+            f"💬 Messages handled: {MESSAGE_LATENCY.count()} "
+            f"(avg {MESSAGE_LATENCY.mean() * 1000:.0f} ms, p95 {MESSAGE_LATENCY.quantile(0.95) * 1000:.0f} ms)\n"
+            f"🔗 Links: " + (", ".join(
+                f"{labels[0]} {int(value)}" for labels, value in sorted(LINKS_PROCESSED.series().items())
+            ) or "none") + "\n"
+            f"🌍 Upstream calls: {int(UPSTREAM_REQUESTS.total())} ({int(upstream_errors)} non-200), "
+            f"p95 {UPSTREAM_LATENCY.quantile(0.95) * 1000:.0f} ms\n"
+            f"🎯 Cache hit rate: {(cache_hits / cache_lookups * 100) if cache_lookups else 0.0:.1f}%\n"
+            f"💾 DB writes: {DB_WRITE_LATENCY.count()} (p95 {DB_WRITE_LATENCY.quantile(0.95) * 1000:.1f} ms)\n"
+            f"📢 Broadcast sends: {int(BROADCAST_MESSAGES.value(('sent',)))} ok, "
+            f"{int(BROADCAST_MESSAGES.total() - BROADCAST_MESSAGES.value(('sent',)))} not delivered • "
+            f"{self.rate_limiter.rate:.1f} msg/s\n"
+            f"🌊 FloodWaits: {int(FLOOD_WAITS.value())} ({int(FLOOD_WAIT_SECONDS.value())}s total)\n"
+            f"🐌 Event loop lag: p99 {LOOP_LAG.quantile(0.99) * 1000:.1f} ms\n"
+        )
+        return text
     
     async def send_test_broadcast(self, admin_user_id: int) -> bool:
         """Send test broadcast to admin only"""
@@ -126,5 +566,5 @@ class BroadcastManager:
             await self.app.send_message(admin_user_id, test_message)
             return True
         except Exception as e:
-            logger.error(f"Error sending test broadcast: {e}")
+            logger.error("Error sending test broadcast: %s", e)
             return False
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+from config import Config
+from metrics import DB_WRITE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Job states; a preparing job is still having its recipients snapshotted and is never resumed
+STATUS_PREPARING = "preparing"
+STATUS_RUNNING = "running"
+STATUS_PAUSED = "paused"
+STATUS_CANCELLED = "cancelled"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+# Per-recipient outcomes; NULL in the database means not processed yet
+OUTCOME_SENT = "sent"
+OUTCOME_FAILED = "failed"
+OUTCOME_BLOCKED = "blocked"
+OUTCOME_INVALID = "invalid"
+
+JOB_COLUMNS = (
+    "job_id", "message", "status", "created_at", "updated_at", "total",
+    "processed", "success", "failed", "blocked", "chat_id", "status_message_id"
+)
+
+
+class BroadcastJobStore:
+    """SQLite store for broadcast jobs, their cursor and per-recipient outcomes
+
+    Recipients are snapshotted when a job is created; the cursor is the set
+    of recipients whose outcome is still NULL. Outcomes are written in
+    batches (checkpoints), so updates cost one transaction per interval
+    rather than one write per recipient.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or Config.BROADCAST_DB_FILE
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcastdb")
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT NOT NULL, status TEXT NOT NULL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, total INTEGER NOT NULL, "
+            "processed INTEGER NOT NULL DEFAULT 0, success INTEGER NOT NULL DEFAULT 0, "
+            "failed INTEGER NOT NULL DEFAULT 0, blocked INTEGER NOT NULL DEFAULT 0, "
+            "chat_id INTEGER, status_message_id INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recipients ("
+            "job_id INTEGER NOT NULL, user_id INTEGER NOT NULL, outcome TEXT, "
+            "PRIMARY KEY (job_id, user_id)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    async def _run(self, func, *args):
+        """Run a database call on the store's writer thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _row_to_job(self, row: Optional[tuple]) -> Optional[dict]:
+        """Convert a jobs row into a dict"""
+        return dict(zip(JOB_COLUMNS, row)) if row else None
+
+    def _create_job(self, message: str, user_ids: List[int], chat_id: int, status: str) -> int:
+        now = time.time()
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (message, status, created_at, updated_at, total, chat_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (message, status, now, now, len(user_ids), chat_id)
+            )
+            job_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO recipients (job_id, user_id) VALUES (?, ?)",
+                ((job_id, user_id) for user_id in user_ids)
+            )
+        return job_id
+
+    async def create_job(self, message: str, user_ids: Iterable[int], chat_id: int,
+                         status: str = STATUS_RUNNING) -> int:
+        """Create a job and snapshot its recipients
+
+        Create it as STATUS_PREPARING when more recipients follow through
+        add_recipients, and set it running once the snapshot is complete.
+        """
+        return await self._run(self._create_job, message, list(user_ids), chat_id, status)
+
+    def _add_recipients(self, job_id: int, user_ids: List[int]) -> int:
+        with self._conn:
+            added = self._conn.executemany(
+                "INSERT OR IGNORE INTO recipients (job_id, user_id) VALUES (?, ?)",
+                ((job_id, user_id) for user_id in user_ids)
+            ).rowcount
+            self._conn.execute("UPDATE jobs SET total = total + ? WHERE job_id = ?", (added, job_id))
+        return added
+
+    async def add_recipients(self, job_id: int, user_ids: Iterable[int]) -> int:
+        """Add a batch of recipients to a job's snapshot and return how many were new"""
+        return await self._run(self._add_recipients, job_id, list(user_ids))
+
+    def _get_job(self, job_id: int) -> Optional[dict]:
+        row = self._conn.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return self._row_to_job(row)
+
+    async def get_job(self, job_id: int) -> Optional[dict]:
+        """Get a job by ID"""
+        return await self._run(self._get_job, job_id)
+
+    def _list_jobs(self, statuses: Optional[Tuple[str, ...]], limit: int) -> List[dict]:
+        query = f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs"
+        params: tuple = ()
+        if statuses:
+            query += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            params = tuple(statuses)
+        query += " ORDER BY job_id DESC LIMIT ?"
+        rows = self._conn.execute(query, params + (limit,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    async def list_jobs(self, statuses: Optional[Tuple[str, ...]] = None, limit: int = 10) -> List[dict]:
+        """List the most recent jobs, optionally filtered by status"""
+        return await self._run(self._list_jobs, statuses, limit)
+
+    def _pending_recipients(self, job_id: int, after: Optional[int], limit: int) -> List[int]:
+        rows = self._conn.execute(
+            "SELECT user_id FROM recipients WHERE job_id = ? AND outcome IS NULL AND user_id > ? "
+            "ORDER BY user_id LIMIT ?",
+            (job_id, after if after is not None else -2**63, limit)
+        )
+        return [row[0] for row in rows]
+
+    async def pending_recipients(self, job_id: int, after: Optional[int] = None, limit: int = 1000) -> List[int]:
+        """Get a page of recipients that have not been processed yet, by user_id after the given one"""
+        return await self._run(self._pending_recipients, job_id, after, limit)
+
+    def _checkpoint(self, job_id: int, outcomes: List[Tuple[str, int]], counters: dict):
+        with self._conn:
+            if outcomes:
+                self._conn.executemany(
+                    "UPDATE recipients SET outcome = ? WHERE job_id = ? AND user_id = ?",
+                    ((outcome, job_id, user_id) for outcome, user_id in outcomes)
+                )
+            self._conn.execute(
+                "UPDATE jobs SET processed = ?, success = ?, failed = ?, blocked = ?, updated_at = ? "
+                "WHERE job_id = ?",
+                (counters['processed'], counters['success'], counters['failed'],
+                 counters['blocked'], time.time(), job_id)
+            )
+
+    async def checkpoint(self, job_id: int, outcomes: List[Tuple[str, int]], counters: dict):
+        """Persist a batch of (outcome, user_id) results and the job counters"""
+        with DB_WRITE_LATENCY.time(("broadcasts",)):
+            await self._run(self._checkpoint, job_id, outcomes, counters)
+
+    def _set_status(self, job_id: int, status: str):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                (status, time.time(), job_id)
+            )
+
+    async def set_status(self, job_id: int, status: str):
+        """Update a job's status"""
+        await self._run(self._set_status, job_id, status)
+
+    def _set_status_message(self, job_id: int, chat_id: int, message_id: int):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET chat_id = ?, status_message_id = ? WHERE job_id = ?",
+                (chat_id, message_id, job_id)
+            )
+
+    async def set_status_message(self, job_id: int, chat_id: int, message_id: int):
+        """Remember which message shows the job's progress"""
+        await self._run(self._set_status_message, job_id, chat_id, message_id)
+
+    async def close(self):
+        """Close the database"""
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
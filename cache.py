@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+from config import Config
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Sentinel returned by ResultCache.get() when a key is not cached
+MISSING = object()
+
+
+class SQLiteCacheBackend:
+    """Persistent cache backend storing JSON values in a SQLite table"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Get (value, expires_at) for a key, or None if not stored"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float):
+        """Store a value until expires_at"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        """Delete a key"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        """Delete all expired entries and return how many were removed"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+
+
+class ResultCache:
+    """Bounded in-memory LRU cache with TTLs and an optional persistent backend"""
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float,
+                 backend: Optional[SQLiteCacheBackend] = None, name: str = "results"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.backend = backend
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._hit_labels = (name, "hit")
+        self._backend_hit_labels = (name, "backend_hit")
+        self._miss_labels = (name, "miss")
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.backend_hits = 0
+
+    @classmethod
+    def from_config(cls) -> "ResultCache":
+        """Build a cache from Config settings"""
+        backend = None
+        # Shard worker processes share results through the SQLite backend
+        if Config.CACHE_BACKEND == "sqlite" or Config.SHARD_WORKERS > 1:
+            backend = SQLiteCacheBackend(Config.CACHE_DB_FILE)
+            purged = backend.purge_expired()
+            logger.info("Opened persistent cache %s (%d expired entries purged)", Config.CACHE_DB_FILE, purged)
+        return cls(Config.CACHE_MAX_SIZE, Config.CACHE_TTL, Config.CACHE_NEGATIVE_TTL, backend)
+
+    async def get(self, key: str, default: Any = MISSING) -> Any:
+        """Get a cached value, falling back to the persistent backend"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc(self._hit_labels)
+                return value
+            del self._entries[key]
+            self.expirations += 1
+
+        if self.backend:
+            try:
+                stored = await asyncio.to_thread(self.backend.get, key)
+            except Exception as e:
+                logger.error("Cache backend read failed: %s", e)
+                stored = None
+            if stored is not None and stored[1] > now:
+                self._store(key, stored[0], stored[1])
+                self.hits += 1
+                self.backend_hits += 1
+                CACHE_LOOKUPS.inc(self._backend_hit_labels)
+                return stored[0]
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc(self._miss_labels)
+        return default
+
+    async def set(self, key: str, value: Any):
+        """Cache a value; None is cached as a failed result with the negative TTL"""
+        ttl = self.ttl if value is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._store(key, value, expires_at)
+
+        if self.backend:
+            try:
+                await asyncio.to_thread(self.backend.set, key, value, expires_at)
+            except Exception as e:
+                logger.error("Cache backend write failed: %s", e)
+
+    def _store(self, key: str, value: Any, expires_at: float):
+        """Insert into the in-memory LRU, evicting the oldest entries"""
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def close(self):
+        """Close the persistent backend"""
+        if self.backend:
+            self.backend.close()
+
+    def get_stats(self) -> dict:
+        """Get cache statistics"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) * 100 if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'backend': "sqlite" if self.backend else "memory",
+            'backend_hits': self.backend_hits
+        }
@@ -17,12 +17,110 @@ class Config:
     # Instagram API Configuration
     INSTAGRAM_API_URL = "https://api.nekorinn.my.id/downloader/instagram"
 
+    # Resolver backends as comma-separated "type=url" entries (types: nekorinn, generic)
+    RESOLVER_BACKENDS = os.getenv("RESOLVER_BACKENDS", f"nekorinn={INSTAGRAM_API_URL}")
+    RESOLVER_RACE = os.getenv("RESOLVER_RACE", "false").lower() == "true"  # query the two fastest at once
+    RESOLVER_EWMA_ALPHA = float(os.getenv("RESOLVER_EWMA_ALPHA", "0.2"))  # weight of the newest sample
+
     # Bot Configuration
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB limit for Telegram
+    DELIVERY_MODE = os.getenv("DELIVERY_MODE", "link")  # "link" (CDN links) or "upload" (send the video)
+    MEDIA_DOWNLOAD_TIMEOUT = float(os.getenv("MEDIA_DOWNLOAD_TIMEOUT", "120"))  # seconds per download
+    MEDIA_CHUNK_SIZE = 64 * 1024  # bytes read from the CDN at a time
+    MEDIA_SPOOL_SIZE = int(os.getenv("MEDIA_SPOOL_SIZE", str(1024 * 1024)))  # bytes kept in memory before spilling to disk
+    MEDIA_PROBE_CONCURRENCY = int(os.getenv("MEDIA_PROBE_CONCURRENCY", "5"))  # parallel HEAD size probes, 0 disables
+    MEDIA_PROBE_TIMEOUT = float(os.getenv("MEDIA_PROBE_TIMEOUT", "3"))  # seconds per HEAD request
+    DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "downloads")  # temp directory for media being uploaded
+    DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "3"))  # parallel media downloads
+    DOWNLOAD_BANDWIDTH = int(os.getenv("DOWNLOAD_BANDWIDTH", "0"))  # bytes/s across all downloads, 0 = unlimited
+    DOWNLOAD_DISK_BUDGET = int(os.getenv("DOWNLOAD_DISK_BUDGET", str(300 * 1024 * 1024)))  # bytes in DOWNLOAD_DIR
+    FILE_ID_CACHE_SIZE = int(os.getenv("FILE_ID_CACHE_SIZE", "50000"))  # entries
+    FILE_ID_CACHE_TTL = int(os.getenv("FILE_ID_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
     DOWNLOAD_TIMEOUT = 30  # seconds
+    UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))  # seconds
+    UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "15"))  # seconds between reads
+    UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+    UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))  # seconds
+    UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "4"))  # seconds
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # consecutive failures
+    BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))  # seconds open before probing
+    HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0"))  # e.g. 95 to hedge slow requests, 0 disables
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))  # latency samples needed before hedging
+    MAX_URLS_PER_MESSAGE = int(os.getenv("MAX_URLS_PER_MESSAGE", "5"))  # answered one by one; more use batch mode
+
+    # Admission Control Configuration
+    ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "20"))  # URLs processed at once
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))  # waiting URLs before rejecting
+    USER_RATE_LIMIT = int(os.getenv("USER_RATE_LIMIT", "10"))  # requests per window per user
+    USER_RATE_WINDOW = float(os.getenv("USER_RATE_WINDOW", "60"))  # seconds
+    # Pyrogram dispatcher tasks; handlers hand URL work to tasks, so these only need to outnumber bursts of updates
+    HANDLER_WORKERS = int(os.getenv("HANDLER_WORKERS", str(ADMISSION_MAX_CONCURRENT + 4)))
+
+    # Inline Mode Configuration (enable inline mode for the bot in @BotFather)
+    INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", "0.6"))  # seconds without a newer query before resolving
+    INLINE_ANSWER_BUDGET = float(os.getenv("INLINE_ANSWER_BUDGET", "6"))  # seconds before answering "resolving…"
+    INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))  # seconds Telegram may cache resolved answers
+
+    # Batch Mode Configuration (messages with more than MAX_URLS_PER_MESSAGE links, or a .txt file)
+    BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", "100"))  # links per batch, the rest are skipped
+    BATCH_MAX_ACTIVE = int(os.getenv("BATCH_MAX_ACTIVE", "1"))  # batches running at once per user
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "5"))  # links of one batch resolved at once
+    BATCH_PROGRESS_INTERVAL = float(os.getenv("BATCH_PROGRESS_INTERVAL", "3"))  # seconds between progress edits
+    BATCH_MAX_FILE_SIZE = int(os.getenv("BATCH_MAX_FILE_SIZE", str(256 * 1024)))  # bytes, uploaded .txt files
+
+    # HTTP Connection Pool Configuration
+    HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))  # total connections
+    HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "30"))
+    HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))  # seconds
+    HTTP_KEEPALIVE_TIMEOUT = int(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))  # seconds
+
+    # Result Cache Configuration
+    CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))  # entries
+    CACHE_TTL = int(os.getenv("CACHE_TTL", "3600"))  # seconds, successful lookups
+    CACHE_NEGATIVE_TTL = int(os.getenv("CACHE_NEGATIVE_TTL", "60"))  # seconds, failed lookups
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # "memory" or "sqlite"
+    CACHE_DB_FILE = os.getenv("CACHE_DB_FILE", "cache.db")
+
+    # Broadcast Configuration
+    BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "10"))  # concurrent senders
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # msgs/s, Telegram allows ~30 for bots
+    BROADCAST_BURST = float(os.getenv("BROADCAST_BURST", "5"))  # token bucket capacity
+    BROADCAST_MIN_RATE = float(os.getenv("BROADCAST_MIN_RATE", "1"))  # msgs/s floor after backoff
+    BROADCAST_BACKOFF_FACTOR = float(os.getenv("BROADCAST_BACKOFF_FACTOR", "0.5"))  # rate cut on FloodWait
+    BROADCAST_RECOVERY_STEP = float(os.getenv("BROADCAST_RECOVERY_STEP", "1"))  # msgs/s regained per second
+    BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))  # FloodWait retries per user
+    BROADCAST_DB_FILE = os.getenv("BROADCAST_DB_FILE", "broadcasts.db")  # persisted broadcast jobs
+    BROADCAST_CHECKPOINT_INTERVAL = float(os.getenv("BROADCAST_CHECKPOINT_INTERVAL", "2"))  # seconds
+    BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))  # seconds between status edits
+    BROADCAST_SNAPSHOT_BATCH = int(os.getenv("BROADCAST_SNAPSHOT_BATCH", "1000"))  # recipients read per query
 
     # Database Configuration
-    DATABASE_FILE = "users.json"
+    DATABASE_FILE = os.getenv("DATABASE_FILE", "users.db")  # SQLite (WAL mode)
+    LEGACY_DATABASE_FILE = "users.json"  # migrated into DATABASE_FILE on startup
+    DB_FLUSH_BATCH_SIZE = int(os.getenv("DB_FLUSH_BATCH_SIZE", "500"))  # pending changes
+    DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", "2"))  # seconds, max durability window
+
+    # Metrics Configuration
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))  # Prometheus /metrics endpoint, 0 = disabled
+    LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # seconds between event loop lag samples
+
+    # Sharding Configuration
+    SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))  # URL worker processes, 1 = single process
+    SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))  # pending messages per worker
+    SHARD_SHUTDOWN_TIMEOUT = float(os.getenv("SHARD_SHUTDOWN_TIMEOUT", "10"))  # seconds to finish on shutdown
+
+    # Logging Configuration
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+    LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")  # "logger=rate,...", e.g. "database=0.1" keeps 10% of INFO
+
+    # Diagnostics Configuration (opt-in)
+    DIAGNOSTICS_ENABLED = os.getenv("DIAGNOSTICS_ENABLED", "false").lower() == "true"
+    SLOW_CALLBACK_THRESHOLD = float(os.getenv("SLOW_CALLBACK_THRESHOLD", "0.1"))  # seconds before a stack is logged
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # seconds between samples
+    PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "60"))  # longest /profile run
+    DIAGNOSTICS_DIR = os.getenv("DIAGNOSTICS_DIR", "diagnostics")  # where profiles are written
     
     # Validate required environment variables
     @classmethod
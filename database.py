@@ -1,83 +1,347 @@
+import asyncio
 import json
 import os
 import logging
-from typing import Set, List
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Dict, Iterable, Optional, Tuple
 from config import Config
+from metrics import DB_WRITE_LATENCY
+from userset import CompactUserSet
 
 logger = logging.getLogger(__name__)
 
+SEGMENT_HELP = (
+    "`all`, `active:<days>`, `inactive:<days>`, `new:<days>`, `never_failed`, `max_failures:<n>` "
+    "(combine with commas, e.g. `active:30,never_failed`)"
+)
+
+
+def parse_segment(spec: str) -> Tuple[str, tuple]:
+    """Turn a segment spec like "active:30,never_failed" into an SQL condition and its parameters"""
+    clauses: List[str] = []
+    params: List[float] = []
+    now = time.time()
+    for term in filter(None, (part.strip() for part in spec.lower().split(','))):
+        name, _, arg = term.partition(':')
+        if name == 'all' and not arg:
+            continue
+        if name == 'never_failed' and not arg:
+            clauses.append("failures = 0")
+            continue
+        if not arg.isdigit():
+            raise ValueError(f"Invalid segment: {term!r}")
+        value = int(arg)
+        if name == 'active':
+            clauses.append("last_active >= ?")
+            params.append(now - value * 86400)
+        elif name == 'inactive':
+            # Users from before activity tracking have no last_active and count as inactive
+            clauses.append("(last_active IS NULL OR last_active < ?)")
+            params.append(now - value * 86400)
+        elif name == 'new':
+            clauses.append("first_seen >= ?")
+            params.append(now - value * 86400)
+        elif name == 'max_failures':
+            clauses.append("failures <= ?")
+            params.append(value)
+        else:
+            raise ValueError(f"Invalid segment: {term!r}")
+    return " AND ".join(clauses) or "1", tuple(params)
+
+
 class UserDatabase:
     def __init__(self):
         self.db_file = Config.DATABASE_FILE
-        self.users: Set[int] = set()
+        self.legacy_file = Config.LEGACY_DATABASE_FILE
+        self.users = CompactUserSet()
+
+        # Changes not yet written to disk: user_id -> True (add) / False (remove)
+        self._pending: Dict[int, bool] = {}
+        # Coalesced hot-path updates: user_id -> last activity time / new delivery failures
+        self._activity: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+
+        # Write-behind settings: flush when the batch fills up or the interval elapses
+        self.flush_batch_size = Config.DB_FLUSH_BATCH_SIZE
+        self.flush_interval = Config.DB_FLUSH_INTERVAL
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # All SQLite access after startup happens on this single thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="userdb")
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY)")
+        self.migrate_schema()
+        self._conn.commit()
+
+        self.migrate_legacy_file()
         self.load_users()
-    
+
+    def migrate_schema(self):
+        """Add the activity columns and their indexes to databases created before they existed"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(users)")}
+        for column, definition in (
+            ("first_seen", "REAL"),
+            ("last_active", "REAL"),
+            ("failures", "INTEGER NOT NULL DEFAULT 0"),
+        ):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_users_first_seen ON users (first_seen)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_users_failures ON users (failures)")
+
+    def migrate_legacy_file(self):
+        """One-shot import of users from the old users.json file"""
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+        try:
+            with open(self.legacy_file, 'r') as f:
+                data = json.load(f)
+            legacy_users = [int(user_id) for user_id in data.get('users', [])]
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+                    ((user_id,) for user_id in legacy_users)
+                )
+            os.replace(self.legacy_file, self.legacy_file + ".migrated")
+            logger.info("Migrated %d users from %s to %s", len(legacy_users), self.legacy_file, self.db_file)
+        except Exception as e:
+            logger.error("Error migrating users from %s: %s", self.legacy_file, e)
+
     def load_users(self):
-        """Load users from JSON file"""
+        """Load users from the SQLite database"""
         try:
-            if os.path.exists(self.db_file):
-                with open(self.db_file, 'r') as f:
-                    data = json.load(f)
-                    self.users = set(data.get('users', []))
-                logger.info(f"Loaded {len(self.users)} users from database")
-            else:
-                logger.info("Database file not found, starting with empty user list")
+            # Primary key order, so the IDs stream straight into the sorted array
+            rows = self._conn.execute("SELECT user_id FROM users ORDER BY user_id")
+            self.users = CompactUserSet(row[0] for row in rows)
+            logger.info("Loaded %d users from database", len(self.users))
         except Exception as e:
-            logger.error(f"Error loading users from database: {e}")
-            self.users = set()
-    
+            logger.error("Error loading users from database: %s", e)
+            self.users = CompactUserSet()
+
+    def _write_batch(self, changes: Dict[int, bool], activity: Dict[int, float], failures: Dict[int, int]):
+        """Apply a batch of changes in a single transaction (runs on the writer thread)"""
+        now = time.time()
+        added = [
+            (user_id, activity.get(user_id, now), activity.get(user_id, now))
+            for user_id, present in changes.items() if present
+        ]
+        removed = [(user_id,) for user_id, present in changes.items() if not present]
+        with self._conn:
+            if added:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, first_seen, last_active) VALUES (?, ?, ?)", added
+                )
+            if activity:
+                self._conn.executemany(
+                    "UPDATE users SET last_active = ? WHERE user_id = ?",
+                    ((seen, user_id) for user_id, seen in activity.items())
+                )
+            if failures:
+                self._conn.executemany(
+                    "UPDATE users SET failures = failures + ? WHERE user_id = ?",
+                    ((count, user_id) for user_id, count in failures.items())
+                )
+            if removed:
+                self._conn.executemany("DELETE FROM users WHERE user_id = ?", removed)
+
+    def _take_pending(self) -> Tuple[Dict[int, bool], Dict[int, float], Dict[int, int]]:
+        """Hand over everything not yet written"""
+        batch = (self._pending, self._activity, self._failures)
+        self._pending, self._activity, self._failures = {}, {}, {}
+        return batch
+
+    def _restore_pending(self, changes: Dict[int, bool], activity: Dict[int, float], failures: Dict[int, int]):
+        """Put a failed batch back unless newer changes superseded it"""
+        for user_id, present in changes.items():
+            self._pending.setdefault(user_id, present)
+        for user_id, seen in activity.items():
+            self._activity.setdefault(user_id, seen)
+        for user_id, count in failures.items():
+            self._failures[user_id] = self._failures.get(user_id, 0) + count
+
+    def _pending_count(self) -> int:
+        return len(self._pending) + len(self._activity) + len(self._failures)
+
+    def start(self):
+        """Start the background write-behind flush task"""
+        if self._flush_task is None:
+            self._flush_event = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            logger.info(
+                "User database write-behind started (batch=%d, interval=%ss)",
+                self.flush_batch_size, self.flush_interval
+            )
+
+    async def _flush_loop(self):
+        """Flush pending changes when the batch is full or the interval elapses"""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write all pending changes to disk in one transaction off the event loop"""
+        if not self._pending_count():
+            return
+        batch = self._take_pending()
+        try:
+            # Shielded so a cancelled flush task still completes the queued write
+            with DB_WRITE_LATENCY.time(("users",)):
+                await asyncio.shield(
+                    asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, *batch)
+                )
+        except Exception as e:
+            logger.error("Error saving users to database: %s", e)
+            self._restore_pending(*batch)
+
+    def _schedule_write(self):
+        """Queue pending changes for the write-behind task"""
+        if self._flush_task is None:
+            # Write-behind not running (e.g. scripts): write synchronously
+            self.save_users()
+        elif self._pending_count() >= self.flush_batch_size:
+            self._flush_event.set()
+
     def save_users(self):
-        """Save users to JSON file"""
+        """Synchronously write all pending changes to the database"""
+        if not self._pending_count():
+            return
+        batch = self._take_pending()
         try:
-            data = {
-                'users': list(self.users),
-                'total_users': len(self.users)
-            }
-            with open(self.db_file, 'w') as f:
-                json.dump(data, f, indent=2)
-            logger.info(f"Saved {len(self.users)} users to database")
+            with DB_WRITE_LATENCY.time(("users",)):
+                self._executor.submit(self._write_batch, *batch).result()
         except Exception as e:
-            logger.error(f"Error saving users to database: {e}")
-    
+            logger.error("Error saving users to database: %s", e)
+            self._restore_pending(*batch)
+
+    async def close(self):
+        """Flush pending changes and close the database"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown(wait=True)
+        logger.info("User database closed (%d users)", len(self.users))
+
     def add_user(self, user_id: int) -> bool:
-        """Add a user to the database"""
+        """Add a user to the database, or record activity of a known one"""
+        self._activity[user_id] = time.time()
         if user_id not in self.users:
             self.users.add(user_id)
-            self.save_users()
-            logger.info(f"Added new user: {user_id}")
+            self._pending[user_id] = True
+            self._schedule_write()
+            logger.info("Added new user: %s", user_id)
             return True
+        # Activity alone is written with the next interval flush
         return False
-    
+
+    def record_failures(self, user_ids: Iterable[int]):
+        """Count a failed delivery for each user"""
+        for user_id in user_ids:
+            self._failures[user_id] = self._failures.get(user_id, 0) + 1
+        self._schedule_write()
+
     def remove_user(self, user_id: int) -> bool:
         """Remove a user from the database"""
         if user_id in self.users:
             self.users.remove(user_id)
-            self.save_users()
-            logger.info(f"Removed user: {user_id}")
+            self._pending[user_id] = False
+            self._schedule_write()
+            logger.info("Removed user: %s", user_id)
             return True
         return False
-    
-    def get_all_users(self) -> List[int]:
-        """Get all users as a list"""
-        return list(self.users)
-    
+
+    def remove_users(self, user_ids: Iterable[int]) -> int:
+        """Remove many users at once and return how many were removed"""
+        removed = 0
+        for user_id in user_ids:
+            if user_id in self.users:
+                self.users.remove(user_id)
+                self._pending[user_id] = False
+                removed += 1
+        if removed:
+            self._schedule_write()
+            logger.info("Removed %d users", removed)
+        return removed
+
+    def get_all_users(self) -> Iterator[int]:
+        """Iterate over all users in ID order without copying them"""
+        return iter(self.users)
+
+    def _segment_page(self, condition: str, params: tuple, after: int, limit: int) -> List[int]:
+        rows = self._conn.execute(
+            f"SELECT user_id FROM users WHERE {condition} AND user_id > ? ORDER BY user_id LIMIT ?",
+            params + (after, limit)
+        )
+        return [row[0] for row in rows]
+
+    async def iter_segment(self, spec: str = "all", batch_size: int = 1000) -> AsyncIterator[List[int]]:
+        """Stream the users of a segment in batches of IDs, straight from SQLite
+
+        Pages are fetched by user_id (keyset pagination), so concurrent writes
+        never invalidate the iteration and at most one batch is in memory.
+        """
+        condition, params = parse_segment(spec)
+        # Make recent activity and new users visible to the query
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        after = -1 << 63
+        while True:
+            page = await loop.run_in_executor(
+                self._executor, self._segment_page, condition, params, after, batch_size
+            )
+            if not page:
+                return
+            yield page
+            after = page[-1]
+
+    async def count_segment(self, spec: str = "all") -> int:
+        """Count the users of a segment"""
+        condition, params = parse_segment(spec)
+        await self.flush()
+
+        def count() -> int:
+            return self._conn.execute(f"SELECT COUNT(*) FROM users WHERE {condition}", params).fetchone()[0]
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, count)
+
     def get_user_count(self) -> int:
         """Get total number of users"""
         return len(self.users)
-    
+
     def is_user_exists(self, user_id: int) -> bool:
         """Check if user exists in database"""
         return user_id in self.users
-    
+
     def clear_users(self):
         """Clear all users (admin only)"""
         self.users.clear()
-        self.save_users()
+        self._take_pending()
+
+        def clear():
+            with self._conn:
+                self._conn.execute("DELETE FROM users")
+
+        self._executor.submit(clear).result()
         logger.warning("All users cleared from database")
-    
+
     def get_stats(self) -> dict:
         """Get database statistics"""
         return {
             'total_users': len(self.users),
-            'users': list(self.users)
+            'memory_bytes': self.users.memory_usage()
         }
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from types import FrameType
+from typing import Dict, List, Optional
+from config import Config
+from utils import ensure_directory_exists
+
+logger = logging.getLogger(__name__)
+
+
+def collapse_stack(frame: Optional[FrameType]) -> str:
+    """Render a frame's stack root-first as "file:function;file:function" for flamegraphs"""
+    names: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class LoopWatchdog:
+    """Logs the event loop's stack whenever a callback blocks it for too long
+
+    A task on the loop bumps a heartbeat every interval; a daemon thread
+    checks the heartbeat and, when it is older than interval + threshold,
+    grabs the loop thread's current frame. That frame is the code that is
+    blocking the loop, so it is logged once per stall.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+        self.stalls = 0
+        self.max_stall = 0.0
+
+    def start(self):
+        """Start the heartbeat task and the watchdog thread"""
+        if self._task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info("Event loop watchdog started (threshold %.0f ms)", self.threshold * 1000)
+
+    async def _beat(self):
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported = 0.0
+        while not self._stopped.wait(self.interval):
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.threshold:
+                continue
+
+            self.max_stall = max(self.max_stall, stalled)
+            if reported == heartbeat:
+                # Already logged this stall
+                continue
+            reported = heartbeat
+            self.stalls += 1
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>\n"
+            logger.warning("Event loop blocked for %.0f ms, current stack:\n%s", stalled * 1000, stack.rstrip())
+
+    async def stop(self):
+        """Stop the heartbeat task and the watchdog thread"""
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def get_stats(self) -> dict:
+        """Get watchdog statistics"""
+        return {
+            'stalls': self.stalls,
+            'max_stall': self.max_stall,
+            'threshold': self.threshold
+        }
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack from a background thread
+
+    Samples are aggregated as collapsed stacks ("a;b;c count" lines), the
+    input format of flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, interval: float, output_dir: str):
+        self.interval = interval
+        self.output_dir = output_dir
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        """Whether a profile is being taken"""
+        return self._lock.locked()
+
+    def _sample(self, thread_id: int, seconds: float) -> Dict[str, int]:
+        """Collect samples for seconds (runs on a worker thread)"""
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[collapse_stack(frame)] += 1
+            del frame
+            time.sleep(self.interval)
+        return stacks
+
+    async def profile(self, seconds: float) -> str:
+        """Profile the event loop thread for seconds and return the collapsed-stack file path"""
+        async with self._lock:
+            thread_id = threading.get_ident()
+            started = time.strftime("%Y%m%d-%H%M%S")
+            stacks = await asyncio.to_thread(self._sample, thread_id, seconds)
+
+            ensure_directory_exists(self.output_dir)
+            path = os.path.join(self.output_dir, f"profile-{started}.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info("Wrote %d samples over %gs to %s", sum(stacks.values()), seconds, path)
+            return path
+
+
+class Diagnostics:
+    """Opt-in loop watchdog and on-demand sampling profiler"""
+
+    def __init__(self):
+        self.enabled = Config.DIAGNOSTICS_ENABLED
+        self.watchdog = LoopWatchdog(Config.SLOW_CALLBACK_THRESHOLD)
+        self.profiler = SamplingProfiler(Config.PROFILE_SAMPLE_INTERVAL, Config.DIAGNOSTICS_DIR)
+
+    async def start(self):
+        """Start the watchdog when diagnostics are enabled"""
+        if self.enabled:
+            self.watchdog.start()
+
+    async def stop(self):
+        """Stop the watchdog"""
+        await self.watchdog.stop()
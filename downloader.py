@@ -1,91 +1,234 @@
 import aiohttp
+import asyncio
 import re
+import time
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, NamedTuple
 from config import Config
+from cache import ResultCache, MISSING
+from singleflight import SingleFlight
+from resolver import MediaItem, Resolver, parse_item
+from utils import gather_bounded
 
 logger = logging.getLogger(__name__)
 
+# Matches an Instagram post URL (/p/<id>, /reel/<id>, /tv/<id>, optionally
+# prefixed by a username) and captures the media type and shortcode in one pass
+INSTAGRAM_URL_PATTERN = re.compile(r'https?://(?:www\.)?instagram\.com/(?:[\w.-]+/)?(p|reel|tv)/([\w-]+)')
+
+class InstagramLink(NamedTuple):
+    """A parsed Instagram post URL"""
+    media_type: str
+    shortcode: str
+
+    @property
+    def url(self) -> str:
+        """Canonical post URL without tracking parameters"""
+        return f"https://www.instagram.com/{self.media_type}/{self.shortcode}/"
+
+def parse_instagram_url(url: str) -> Optional[InstagramLink]:
+    """Parse a string that starts with an Instagram post URL"""
+    match = INSTAGRAM_URL_PATTERN.match(url)
+    return InstagramLink(*match.groups()) if match else None
+
+def find_instagram_urls(text: str) -> List[InstagramLink]:
+    """Find all Instagram post URLs in a text, de-duplicated by shortcode"""
+    if 'instagram.com/' not in text:
+        return []
+    links: Dict[str, InstagramLink] = {}
+    for media_type, shortcode in INSTAGRAM_URL_PATTERN.findall(text):
+        if shortcode not in links:
+            links[shortcode] = InstagramLink(media_type, shortcode)
+    return list(links.values())
+
 class InstagramDownloader:
     def __init__(self):
-        self.api_url = Config.INSTAGRAM_API_URL
         self.timeout = Config.DOWNLOAD_TIMEOUT
         self.max_file_size = Config.MAX_FILE_SIZE
+
+        # Cache of processed results keyed by shortcode
+        self.cache = ResultCache.from_config()
+
+        # Coalesces concurrent lookups for the same shortcode
+        self.singleflight = SingleFlight()
+
+        # Upstream backends with latency-based routing, retries and failover
+        self.resolver = Resolver.from_config()
+
+        # Shared HTTP session, created in start() and closed in close()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.connector: Optional[aiohttp.TCPConnector] = None
+
+        # Connection pool wait statistics
+        self.pool_waits = 0
+        self.pool_wait_total = 0.0
+        self.pool_wait_max = 0.0
+
+    async def start(self):
+        """Create the shared HTTP session and connection pool"""
+        if self.session and not self.session.closed:
+            return
+
+        self.connector = aiohttp.TCPConnector(
+            limit=Config.HTTP_POOL_LIMIT,
+            limit_per_host=Config.HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=Config.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=Config.HTTP_KEEPALIVE_TIMEOUT
+        )
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_queued_start.append(self._on_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_queued_end)
+
+        self.session = aiohttp.ClientSession(
+            connector=self.connector,
+            timeout=aiohttp.ClientTimeout(
+                total=self.timeout,
+                connect=Config.UPSTREAM_CONNECT_TIMEOUT,
+                sock_read=Config.UPSTREAM_READ_TIMEOUT
+            ),
+            trace_configs=[trace_config]
+        )
+        logger.info(
+            "HTTP session started (limit=%d, per_host=%d, dns_ttl=%ss)",
+            Config.HTTP_POOL_LIMIT, Config.HTTP_POOL_LIMIT_PER_HOST, Config.HTTP_DNS_CACHE_TTL
+        )
+
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self.session and not self.session.closed:
+            await self.session.close()
+            logger.info("HTTP session closed")
+        self.session = None
+        self.connector = None
+        self.cache.close()
+
+    async def _on_queued_start(self, session, context, params):
+        """Remember when a request started waiting for a free connection"""
+        context.queued_at = time.monotonic()
+
+    async def _on_queued_end(self, session, context, params):
+        """Record how long a request waited for a free connection"""
+        waited = time.monotonic() - getattr(context, 'queued_at', time.monotonic())
+        self.pool_waits += 1
+        self.pool_wait_total += waited
+        self.pool_wait_max = max(self.pool_wait_max, waited)
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Get connection pool statistics"""
+        open_connections = 0
+        idle_connections = 0
+        if self.connector and not self.connector.closed:
+            idle_connections = sum(len(conns) for conns in getattr(self.connector, '_conns', {}).values())
+            open_connections = len(getattr(self.connector, '_acquired', ())) + idle_connections
+
+        return {
+            'open_connections': open_connections,
+            'idle_connections': idle_connections,
+            'limit': Config.HTTP_POOL_LIMIT,
+            'limit_per_host': Config.HTTP_POOL_LIMIT_PER_HOST,
+            'waits': self.pool_waits,
+            'avg_wait': self.pool_wait_total / self.pool_waits if self.pool_waits else 0.0,
+            'max_wait': self.pool_wait_max
+        }
     
     def is_valid_instagram_url(self, url: str) -> bool:
         """Check if the provided URL is a valid Instagram URL"""
-        instagram_patterns = [
-            r'https?://(?:www\.)?instagram\.com/(?:p|reel|tv)/[\w-]+/?',
-            r'https?://(?:www\.)?instagram\.com/[\w.-]+/(?:p|reel|tv)/[\w-]+/?'
-        ]
-        
-        for pattern in instagram_patterns:
-            if re.match(pattern, url):
-                return True
-        return False
-    
+        return INSTAGRAM_URL_PATTERN.match(url) is not None
+
+    def get_shortcode(self, url: str) -> Optional[str]:
+        """Extract the post shortcode from an Instagram URL"""
+        link = parse_instagram_url(url)
+        return link.shortcode if link else None
+
     async def get_video_info(self, url: str) -> Optional[Dict[str, Any]]:
-        """Get video information from Instagram API"""
+        """Get normalized video information ({'items', 'metadata'}) from the upstream APIs"""
+        if not self.session or self.session.closed:
+            await self.start()
+
+        # Retries share one deadline so users never wait longer than DOWNLOAD_TIMEOUT
+        deadline = time.monotonic() + self.timeout
         try:
-            params = {'url': url}
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    self.api_url, 
-                    params=params,
-                    timeout=aiohttp.ClientTimeout(total=self.timeout)
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('status') and data.get('result'):
-                            return data['result']
-                    else:
-                        logger.error(f"API request failed with status {response.status}")
-                        return None
-                        
-        except aiohttp.ClientError as e:
-            logger.error(f"Network error while fetching video info: {e}")
-            return None
+            return await self.resolver.resolve(self.session, url, deadline)
         except Exception as e:
-            logger.error(f"Unexpected error while fetching video info: {e}")
+            logger.error("Unexpected error while fetching video info: %s", e)
             return None
-    
 
-    
+    async def _head_size(self, url: str) -> Optional[int]:
+        """Size of a media file from a HEAD request, or None if the CDN does not say"""
+        timeout = aiohttp.ClientTimeout(total=Config.MEDIA_PROBE_TIMEOUT)
+        try:
+            async with self.session.head(url, allow_redirects=True, timeout=timeout) as response:
+                return response.content_length if response.status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug("Size probe failed for %s: %r", url, e)
+            return None
+
+    async def probe_sizes(self, items: List[MediaItem]) -> List[MediaItem]:
+        """Fill in unknown item sizes with concurrent HEAD requests (at most MEDIA_PROBE_CONCURRENCY at once)"""
+        unknown = [index for index, item in enumerate(items) if item.size is None]
+        if not unknown or Config.MEDIA_PROBE_CONCURRENCY <= 0:
+            return items
+        sizes = await gather_bounded(
+            Config.MEDIA_PROBE_CONCURRENCY, (self._head_size(items[index].url) for index in unknown)
+        )
+        items = list(items)
+        for index, size in zip(unknown, sizes):
+            items[index] = items[index]._replace(size=size)
+        return items
+
+    def get_upstream_stats(self) -> Dict[str, Any]:
+        """Get upstream resolver statistics"""
+        return self.resolver.get_stats()
+
     async def process_instagram_url(self, url: str) -> Optional[Dict[str, Any]]:
         """Process Instagram URL and return video information"""
-        if not self.is_valid_instagram_url(url):
+        link = parse_instagram_url(url)
+        if not link:
             return None
+        return await self.process_link(link)
 
-        video_info = await self.get_video_info(url)
-        if not video_info:
+    async def get_cached(self, link: InstagramLink) -> Any:
+        """Cached video information for a link (None if it is known to fail), or MISSING; never resolves"""
+        cached = await self.cache.get(link.shortcode)
+        if cached is MISSING or cached is None:
+            return cached
+        return self._with_items(cached, link)
+
+    async def process_link(self, link: InstagramLink) -> Optional[Dict[str, Any]]:
+        """Return video information for an already parsed Instagram link"""
+        cached = await self.cache.get(link.shortcode)
+        if cached is MISSING:
+            cached = await self.singleflight.do(link.shortcode, lambda: self._resolve(link.url, link.shortcode))
+        if cached is None:
             return None
+        return self._with_items(cached, link)
+
+    def _with_items(self, cached: Dict[str, Any], link: InstagramLink) -> Dict[str, Any]:
+        """Result for a link with its items as MediaItems"""
+        # Cached items are plain dicts so every cache backend can store them; entries
+        # cached before carousel support only have 'urls'
+        items = [MediaItem(**item) for item in cached['items']] if 'items' in cached else [
+            parse_item(url) for url in cached['urls']
+        ]
+        return {**cached, 'items': items, 'original_url': link.url}
 
-        # Handle multiple possible API response formats
-        download_urls = []
-
-        # Try different possible field names for video URLs
-        possible_url_fields = ['downloadUrl', 'url', 'download_url', 'video_url', 'urls']
-
-        for field in possible_url_fields:
-            if field in video_info:
-                urls = video_info[field]
-                if isinstance(urls, list) and urls:
-                    download_urls = urls
-                    break
-                elif isinstance(urls, str) and urls:
-                    download_urls = [urls]
-                    break
-
-        # If no URLs found, log the response structure for debugging
-        if not download_urls:
-            logger.error(f"No video URLs found in API response. Response structure: {video_info}")
+    async def _resolve(self, url: str, shortcode: str) -> Optional[Dict[str, Any]]:
+        """Resolve a post through the upstream API and cache the outcome"""
+        result = await self._fetch_and_parse(url)
+        await self.cache.set(shortcode, result)
+        return result
+
+    async def _fetch_and_parse(self, url: str) -> Optional[Dict[str, Any]]:
+        """Fetch video information from the upstream APIs"""
+        video_info = await self.get_video_info(url)
+        if not video_info:
             return None
 
+        items = await self.probe_sizes(video_info['items'])
         return {
-            'urls': download_urls,
+            'items': [item._asdict() for item in items],
+            'urls': [item.url for item in items],
             'metadata': video_info.get('metadata', {}),
             'original_url': url
         }
-    
-
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set
+from pyrogram.types import (
+    InlineQuery, InlineQueryResultArticle, InlineQueryResultPhoto, InlineQueryResultVideo, InputTextMessageContent
+)
+from config import Config
+from cache import MISSING
+from downloader import InstagramDownloader, InstagramLink, find_instagram_urls
+from admission import AdmissionController, AdmissionRejected
+from metrics import INLINE_QUERIES
+
+logger = logging.getLogger(__name__)
+
+# Telegram shows at most 50 results per answer; one is the links article
+MAX_INLINE_RESULTS = 50
+
+# Metadata fields that may hold a post's thumbnail, needed for video results
+THUMBNAIL_FIELDS = ['thumbnail', 'thumbnail_url', 'thumb', 'cover', 'display_url']
+
+
+class InlineHandler:
+    """Answers inline queries ("@bot <instagram url>") from the result cache or a time-boxed resolve
+
+    Cached posts are answered at once with cache_time set, so Telegram
+    serves repeats itself. Otherwise only a user's latest query is resolved,
+    after INLINE_DEBOUNCE seconds without a newer one, so each keystroke of a
+    URL being typed does not reach the upstream API. If resolving takes
+    longer than INLINE_ANSWER_BUDGET the query gets an uncached "resolving…"
+    answer and resolution continues into the cache for the next query.
+    """
+
+    def __init__(self, downloader: InstagramDownloader, admission: AdmissionController):
+        self.downloader = downloader
+        self.admission = admission
+        # user_id -> ID of that user's newest inline query still being answered
+        self._latest: Dict[int, str] = {}
+        # Resolutions still running after their query was answered
+        self._background: Set[asyncio.Task] = set()
+
+    async def handle(self, query: InlineQuery):
+        """Answer an inline query"""
+        received = time.monotonic()
+        user_id = query.from_user.id
+        # Any newer query, even one answered at once, supersedes a query still being debounced
+        self._latest[user_id] = query.id
+        try:
+            await self._handle(query, user_id, received)
+        finally:
+            if self._latest.get(user_id) == query.id:
+                del self._latest[user_id]
+
+    async def _handle(self, query: InlineQuery, user_id: int, received: float):
+        links = find_instagram_urls(query.query)
+        if not links:
+            INLINE_QUERIES.inc(("invalid",))
+            await self._answer(
+                query, [], Config.INLINE_CACHE_TIME,
+                switch_pm_text="Paste an Instagram post or reel link", switch_pm_parameter="inline"
+            )
+            return
+        link = links[0]
+
+        cached = await self.downloader.get_cached(link)
+        if cached is not MISSING:
+            INLINE_QUERIES.inc(("cached",))
+            await self._answer_info(query, link, cached)
+            return
+
+        # Debounce: resolve only if no newer query from this user arrives meanwhile
+        await asyncio.sleep(Config.INLINE_DEBOUNCE)
+        if self._latest.get(user_id) != query.id:
+            INLINE_QUERIES.inc(("debounced",))
+            return
+
+        task = asyncio.create_task(
+            self.admission.run(user_id, lambda: self.downloader.process_link(link))
+        )
+        remaining = Config.INLINE_ANSWER_BUDGET - (time.monotonic() - received)
+        try:
+            info = await asyncio.wait_for(asyncio.shield(task), max(0.0, remaining))
+        except asyncio.TimeoutError:
+            # Keep resolving into the cache; the user's next keystroke or retry gets the answer
+            self._background.add(task)
+            task.add_done_callback(self._forget)
+            INLINE_QUERIES.inc(("pending",))
+            await self._answer(query, [self._notice(
+                link, "⏳ Resolving…", "Still fetching this post. Type a space to refresh in a moment."
+            )], 0, is_personal=True)
+            return
+        except AdmissionRejected:
+            INLINE_QUERIES.inc(("rejected",))
+            await self._answer(query, [self._notice(
+                link, "🐢 The bot is busy", "Please try again in a few seconds."
+            )], 0, is_personal=True)
+            return
+        except Exception as e:
+            logger.error("Error resolving inline query for %s: %s", link.url, e)
+            info = None
+
+        INLINE_QUERIES.inc(("resolved",))
+        await self._answer_info(query, link, info)
+
+    def _forget(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Background inline resolution failed: %s", task.exception())
+
+    async def _answer_info(self, query: InlineQuery, link: InstagramLink, info: Optional[dict]):
+        if not info or not info.get('items'):
+            await self._answer(query, [self._notice(
+                link, "❌ Couldn't fetch this post", "Check the link and try again."
+            )], 0)
+            return
+        await self._answer(query, self.build_results(link, info), Config.INLINE_CACHE_TIME)
+
+    async def _answer(self, query: InlineQuery, results: list, cache_time: int, **kwargs):
+        """Answer a query, ignoring queries that expired meanwhile"""
+        try:
+            await query.answer(results, cache_time=cache_time, **kwargs)
+        except Exception as e:
+            logger.debug("Could not answer inline query %s: %s", query.id, e)
+
+    @staticmethod
+    def _notice(link: InstagramLink, title: str, description: str) -> InlineQueryResultArticle:
+        """A single article result that sends the post link if chosen"""
+        return InlineQueryResultArticle(
+            title=title,
+            description=description,
+            input_message_content=InputTextMessageContent(link.url),
+            id=f"{link.shortcode}:notice"
+        )
+
+    def build_results(self, link: InstagramLink, info: dict) -> List:
+        """Photo/video results for each item plus an article with all download links"""
+        items = info['items']
+        metadata = info.get('metadata', {})
+        caption = f"👤 @{metadata['username']}" if metadata.get('username') else ""
+        thumbnail = next(
+            (metadata[field] for field in THUMBNAIL_FIELDS if isinstance(metadata.get(field), str) and metadata[field]),
+            next((item.url for item in items if item.kind == "photo"), None)
+        )
+
+        results = []
+        for index, item in enumerate(items[:MAX_INLINE_RESULTS - 1]):
+            result_id = f"{link.shortcode}:{index}"
+            title = f"{item.kind.title()} {index + 1}"
+            if item.kind == "photo":
+                results.append(InlineQueryResultPhoto(
+                    photo_url=item.url, thumb_url=item.url, photo_width=item.width or 0,
+                    photo_height=item.height or 0, id=result_id, title=title,
+                    description=item.describe() or None, caption=caption
+                ))
+            elif thumbnail:
+                # Telegram requires a JPEG thumbnail for video results; without one only the links article is offered
+                results.append(InlineQueryResultVideo(
+                    video_url=item.url, thumb_url=thumbnail, title=title, id=result_id,
+                    video_width=item.width or 0, video_height=item.height or 0,
+                    description=item.describe() or None, caption=caption
+                ))
+
+        text = f"🔗 {link.url}\n\n"
+        if caption:
+            text += f"{caption}\n\n"
+        for index, item in enumerate(items, 1):
+            details = item.describe()
+            text += f"**{index}.** [Download {item.kind.title()} {index}]({item.url})"
+            text += f" ({details})\n" if details else "\n"
+        results.append(InlineQueryResultArticle(
+            title="📥 Download links",
+            description=f"{len(items)} item{'s' if len(items) != 1 else ''}" + (f" • {caption}" if caption else ""),
+            input_message_content=InputTextMessageContent(text, disable_web_page_preview=True),
+            id=f"{link.shortcode}:links"
+        ))
+        return results
+
+    def get_stats(self) -> dict:
+        """Get inline query statistics"""
+        return {
+            'answering': len(self._latest),
+            'background': len(self._background),
+            **{outcome: int(value) for (outcome,), value in INLINE_QUERIES.series().items()}
+        }
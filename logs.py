@@ -0,0 +1,182 @@
+import atexit
+import functools
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+# ID of the update being handled, attached to every record logged while handling it
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+_request_counter = itertools.count(1)
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def with_request_id(func):
+    """Decorator giving each handled update its own request ID (chat:message, or a counter)"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        message = next((arg for arg in args if hasattr(arg, 'chat') and hasattr(arg, 'id')), None)
+        if message is not None and message.chat is not None:
+            request_id = f"{message.chat.id}:{message.id}"
+        else:
+            request_id = f"r{next(_request_counter)}"
+        token = request_id_var.set(request_id)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            request_id_var.reset(token)
+    return wrapper
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request ID (must run in the emitting context)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one in N records below WARNING for configured loggers
+
+    Rates apply to a logger and its children, e.g. {"database": 0.01}
+    keeps 1% of database INFO/DEBUG records. Warnings and errors always
+    pass. Sampling is deterministic (every Nth record) so counts stay exact.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._every: Dict[str, int] = {}
+        self._seen: Dict[str, int] = {}
+        self.dropped = 0
+
+    @classmethod
+    def parse(cls, spec: str) -> "SamplingFilter":
+        """Build from "logger=rate,logger=rate" """
+        rates = {}
+        for entry in filter(None, (part.strip() for part in spec.split(','))):
+            name, _, rate = entry.partition('=')
+            rates[name.strip()] = float(rate)
+        return cls(rates)
+
+    def _every_for(self, name: str) -> int:
+        """Keep-every-N for a logger name, resolving parents once per name"""
+        every = self._every.get(name)
+        if every is None:
+            rate = 1.0
+            candidate = name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition('.')[0]
+            every = self._every[name] = 0 if rate <= 0 else max(1, round(1 / rate))
+        return every
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        every = self._every_for(record.name)
+        if every == 1:
+            return True
+        seen = self._seen.get(record.name, 0)
+        self._seen[record.name] = seen + 1
+        if every and seen % every == 0:
+            return True
+        self.dropped += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with timestamp, level, logger, request ID, message and extras"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock handler formats the message on the emitting thread; here only
+    the message arguments are merged (so records stay picklable and
+    mutable arguments are captured) and everything else happens off-loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # Traceback objects hold frames alive; render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(level: str = "INFO", fmt: str = "text", sampling: str = "",
+                      handler: Optional[logging.Handler] = None) -> logging.handlers.QueueListener:
+    """Route all logging through a queue to a listener thread that does formatting and I/O"""
+    global _listener
+    stop_logging()
+
+    output = handler or logging.StreamHandler()
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+        ))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    if sampling:
+        # Drop sampled-out records before any other work
+        queue_handler.addFilter(SamplingFilter.parse(sampling))
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,396 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, List, Optional
+import aiohttp
+from pyrogram import Client
+from pyrogram.types import InputMediaPhoto, InputMediaVideo, Message
+from config import Config
+from cache import ResultCache
+from downloader import InstagramDownloader
+from resolver import MediaItem
+from ratelimit import TokenBucket
+from utils import clean_filename, format_file_size, ensure_directory_exists
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts 2-10 photos/videos per media group
+MEDIA_GROUP_LIMIT = 10
+
+
+class MediaTooLargeError(Exception):
+    """Raised when media exceeds MAX_FILE_SIZE"""
+
+    def __init__(self, size: int):
+        super().__init__(f"{format_file_size(size)} exceeds the {format_file_size(Config.MAX_FILE_SIZE)} limit")
+        self.size = size
+
+
+class MediaFetchError(Exception):
+    """Raised when media cannot be downloaded from the CDN"""
+
+
+class MediaSpool(tempfile.SpooledTemporaryFile):
+    """Spooled temp file with a name, which Pyrogram uses as the uploaded file's name"""
+
+    def __init__(self, file_name: str, **kwargs):
+        super().__init__(**kwargs)
+        self.file_name = file_name
+
+    @property
+    def name(self) -> str:
+        return self.file_name
+
+
+class DownloadScheduler:
+    """Bounds concurrent media downloads, their bandwidth and their temp-disk usage
+
+    Shard workers each get their own subdirectory of DOWNLOAD_DIR and an equal
+    share of the disk budget, so one worker's cleanup never removes another
+    worker's in-flight downloads and together they stay within the budget.
+    """
+
+    def __init__(self, shard_index: Optional[int] = None):
+        self.temp_dir = Config.DOWNLOAD_DIR
+        self.concurrency = Config.DOWNLOAD_CONCURRENCY
+        self.disk_budget = Config.DOWNLOAD_DISK_BUDGET
+        if shard_index is not None:
+            self.temp_dir = os.path.join(Config.DOWNLOAD_DIR, f"shard{shard_index}")
+            self.disk_budget = Config.DOWNLOAD_DISK_BUDGET // max(1, Config.SHARD_WORKERS)
+
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._disk_changed = asyncio.Condition()
+        self.disk_reserved = 0
+
+        # Global bandwidth cap in bytes/s; a second's worth of burst (at least one chunk)
+        self.bandwidth: Optional[TokenBucket] = None
+        if Config.DOWNLOAD_BANDWIDTH > 0:
+            self.bandwidth = TokenBucket(
+                Config.DOWNLOAD_BANDWIDTH, max(Config.DOWNLOAD_BANDWIDTH, Config.MEDIA_CHUNK_SIZE)
+            )
+
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.bytes_total = 0
+        self.seconds_total = 0.0
+
+        ensure_directory_exists(self.temp_dir)
+        self.cleanup_temp_dir()
+
+    def cleanup_temp_dir(self):
+        """Remove files left behind in the temp directory (e.g. by a crash)"""
+        removed = 0
+        for entry in os.scandir(self.temp_dir):
+            if entry.is_file():
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    logger.warning("Could not remove stale download %s: %s", entry.path, e)
+        if removed:
+            logger.info("Removed %d stale downloads from %s", removed, self.temp_dir)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one of the concurrent download slots"""
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+    async def reserve_disk(self, nbytes: int) -> int:
+        """Wait until nbytes fit in the disk budget and reserve them"""
+        nbytes = min(nbytes, self.disk_budget)
+        async with self._disk_changed:
+            await self._disk_changed.wait_for(lambda: self.disk_reserved + nbytes <= self.disk_budget)
+            self.disk_reserved += nbytes
+        return nbytes
+
+    async def release_disk(self, nbytes: int):
+        """Return reserved disk space to the budget"""
+        async with self._disk_changed:
+            self.disk_reserved -= nbytes
+            self._disk_changed.notify_all()
+
+    async def throttle(self, nbytes: int):
+        """Wait for bandwidth budget for nbytes"""
+        if self.bandwidth:
+            await self.bandwidth.acquire(nbytes)
+
+    def record(self, nbytes: int, seconds: float):
+        """Record a finished download"""
+        self.completed += 1
+        self.bytes_total += nbytes
+        self.seconds_total += seconds
+
+    def get_stats(self) -> dict:
+        """Get scheduler statistics"""
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'concurrency': self.concurrency,
+            'disk_reserved': self.disk_reserved,
+            'disk_budget': self.disk_budget,
+            'completed': self.completed,
+            'avg_throughput': self.bytes_total / self.seconds_total if self.seconds_total else 0.0
+        }
+
+
+class MediaSender:
+    """Streams media from the CDN and uploads it to Telegram, reusing file_ids per shortcode"""
+
+    def __init__(self, app: Client, downloader: InstagramDownloader, shard_index: Optional[int] = None):
+        self.app = app
+        self.downloader = downloader
+        self.max_file_size = Config.MAX_FILE_SIZE
+
+        # Telegram file_ids by "file_id:<shortcode>:<index>", persisted with the result cache backend
+        self.file_ids = ResultCache(
+            Config.FILE_ID_CACHE_SIZE, Config.FILE_ID_CACHE_TTL, 0, downloader.cache.backend, name="file_ids"
+        )
+
+        # Limits on concurrent downloads, bandwidth and temp disk usage
+        self.scheduler = DownloadScheduler(shard_index)
+
+        self.uploads = 0
+        self.reused = 0
+        self.groups = 0
+        self.bytes_downloaded = 0
+
+    @asynccontextmanager
+    async def download(self, url: str, file_name: str = "media",
+                       reserve: bool = True) -> AsyncIterator[MediaSpool]:
+        """Download a media URL into a temp file that is deleted as soon as the caller is done
+
+        With reserve=False the caller has already reserved disk budget for it.
+        """
+        async with self.scheduler.slot():
+            spool, reserved = await self._fetch(url, file_name, reserve)
+        try:
+            yield spool
+        finally:
+            spool.close()
+            if reserved:
+                await self.scheduler.release_disk(reserved)
+
+    async def _fetch(self, url: str, file_name: str, reserve: bool):
+        """Stream a media URL into a spooled temp file, enforcing MAX_FILE_SIZE as early as possible"""
+        if not self.downloader.session or self.downloader.session.closed:
+            await self.downloader.start()
+
+        spool = MediaSpool(file_name, max_size=Config.MEDIA_SPOOL_SIZE, dir=self.scheduler.temp_dir)
+        reserved = 0
+        size = 0
+        started = time.monotonic()
+        try:
+            timeout = aiohttp.ClientTimeout(
+                total=Config.MEDIA_DOWNLOAD_TIMEOUT,
+                connect=Config.UPSTREAM_CONNECT_TIMEOUT,
+                sock_read=Config.UPSTREAM_READ_TIMEOUT
+            )
+            async with self.downloader.session.get(url, timeout=timeout) as response:
+                if response.status != 200:
+                    raise MediaFetchError(f"CDN returned status {response.status}")
+
+                # Reject before reading any body when the size is announced
+                if response.content_length and response.content_length > self.max_file_size:
+                    raise MediaTooLargeError(response.content_length)
+
+                if reserve:
+                    # Reserve the announced size, or the worst case when it is unknown
+                    reserved = await self.scheduler.reserve_disk(response.content_length or self.max_file_size)
+
+                async for chunk in response.content.iter_chunked(Config.MEDIA_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_file_size:
+                        raise MediaTooLargeError(size)
+                    await self.scheduler.throttle(len(chunk))
+                    spool.write(chunk)
+
+            elapsed = time.monotonic() - started
+            self.scheduler.record(size, elapsed)
+            self.bytes_downloaded += size
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "Downloaded %s in %.1fs (%s/s)", format_file_size(size), elapsed,
+                    format_file_size(int(size / elapsed) if elapsed else size)
+                )
+            spool.seek(0)
+            return spool, reserved
+
+        except BaseException as e:
+            spool.close()
+            if reserved:
+                await self.scheduler.release_disk(reserved)
+            if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+                raise MediaFetchError(f"Network error while downloading media: {e!r}") from e
+            raise
+
+    def _file_name(self, shortcode: str, index: int, item: MediaItem) -> str:
+        extension = "jpg" if item.kind == "photo" else "mp4"
+        return clean_filename(f"{shortcode}_{index}.{extension}")
+
+    @staticmethod
+    def _sent_file_id(sent: Message) -> Optional[str]:
+        media = sent.photo or sent.video or sent.document
+        return media.file_id if media else None
+
+    async def _reply_item(self, message: Message, item: MediaItem, media, caption: str) -> Message:
+        if item.kind == "photo":
+            return await message.reply_photo(media, caption=caption)
+        return await message.reply_video(
+            media, caption=caption, width=item.width or 0, height=item.height or 0, supports_streaming=True
+        )
+
+    async def send_item(self, message: Message, shortcode: str, index: int, item: MediaItem,
+                        caption: str = "") -> Message:
+        """Send one photo or video as a reply, reusing a cached file_id when available"""
+        key = f"file_id:{shortcode}:{index}"
+        file_id = await self.file_ids.get(key, None)
+        if file_id:
+            try:
+                sent = await self._reply_item(message, item, file_id, caption)
+                self.reused += 1
+                return sent
+            except Exception as e:
+                # The file_id may have expired; fall back to a fresh upload
+                logger.warning("Cached file_id for %s could not be reused: %s", shortcode, e)
+
+        started = time.monotonic()
+        async with self.download(item.url, self._file_name(shortcode, index, item)) as spool:
+            sent = await self._reply_item(message, item, spool, caption)
+        self.uploads += 1
+        logger.info("Uploaded %s item %d in %.1fs", shortcode, index, time.monotonic() - started)
+
+        file_id = self._sent_file_id(sent)
+        if file_id:
+            await self.file_ids.set(key, file_id)
+        return sent
+
+    async def send_items(self, message: Message, shortcode: str, items: List[MediaItem],
+                         caption: str = "") -> List[Message]:
+        """Send a post's items as one reply: a single upload, or media groups of up to ten items
+
+        Items whose size is known to exceed MAX_FILE_SIZE raise MediaTooLargeError
+        before anything is downloaded.
+        """
+        for item in items:
+            if item.size and item.size > self.max_file_size:
+                raise MediaTooLargeError(item.size)
+
+        if len(items) == 1:
+            return [await self.send_item(message, shortcode, 0, items[0], caption)]
+
+        # Split into groups that fit both Telegram's limit and the temp disk budget
+        groups: List[List[int]] = [[]]
+        group_bytes = 0
+        for index, item in enumerate(items):
+            estimate = item.size or self.max_file_size
+            group = groups[-1]
+            if group and (len(group) == MEDIA_GROUP_LIMIT or group_bytes + estimate > self.scheduler.disk_budget):
+                groups.append([])
+                group_bytes = 0
+            groups[-1].append(index)
+            group_bytes += estimate
+
+        sent: List[Message] = []
+        for number, indexes in enumerate(groups):
+            sent += await self._send_group(message, shortcode, items, indexes, caption if number == 0 else "")
+        return sent
+
+    async def _send_group(self, message: Message, shortcode: str, items: List[MediaItem],
+                          indexes: List[int], caption: str) -> List[Message]:
+        """Send items as one media group, downloading the ones without a cached file_id concurrently"""
+        if len(indexes) == 1:
+            return [await self.send_item(message, shortcode, indexes[0], items[indexes[0]], caption)]
+
+        keys = [f"file_id:{shortcode}:{index}" for index in indexes]
+        file_ids = [await self.file_ids.get(key, None) for key in keys]
+        if all(file_ids):
+            try:
+                sent = await message.reply_media_group(self._group_media(items, indexes, file_ids, caption))
+                self.reused += len(indexes)
+                self.groups += 1
+                return sent
+            except Exception as e:
+                logger.warning("Cached file_ids for %s could not be reused: %s", shortcode, e)
+                file_ids = [None] * len(indexes)
+
+        missing = [position for position, file_id in enumerate(file_ids) if not file_id]
+        started = time.monotonic()
+        # One reservation for the whole group: per-item reservations could deadlock two groups
+        reserved = await self.scheduler.reserve_disk(
+            sum(items[indexes[position]].size or self.max_file_size for position in missing)
+        )
+        try:
+            async with AsyncExitStack() as stack:
+                results = await asyncio.gather(*(
+                    stack.enter_async_context(self.download(
+                        items[indexes[position]].url,
+                        self._file_name(shortcode, indexes[position], items[indexes[position]]),
+                        reserve=False
+                    ))
+                    for position in missing
+                ), return_exceptions=True)
+                # Let every download finish (so the stack cleans all of them up) before failing
+                error = next((result for result in results if isinstance(result, BaseException)), None)
+                if error is not None:
+                    raise error
+                media = list(file_ids)
+                for position, spool in zip(missing, results):
+                    media[position] = spool
+                sent = await message.reply_media_group(self._group_media(items, indexes, media, caption))
+        finally:
+            await self.scheduler.release_disk(reserved)
+
+        self.uploads += len(missing)
+        self.reused += len(indexes) - len(missing)
+        self.groups += 1
+        logger.info(
+            "Uploaded %s as a media group of %d items in %.1fs", shortcode, len(indexes), time.monotonic() - started
+        )
+
+        for position, key in enumerate(keys):
+            if position in missing and position < len(sent):
+                file_id = self._sent_file_id(sent[position])
+                if file_id:
+                    await self.file_ids.set(key, file_id)
+        return sent
+
+    @staticmethod
+    def _group_media(items: List[MediaItem], indexes: List[int], media: list, caption: str) -> list:
+        """InputMedia list for a media group; the caption goes on the first item"""
+        group = []
+        for position, (index, source) in enumerate(zip(indexes, media)):
+            item = items[index]
+            item_caption = caption if position == 0 else ""
+            if item.kind == "photo":
+                group.append(InputMediaPhoto(source, caption=item_caption))
+            else:
+                group.append(InputMediaVideo(
+                    source, caption=item_caption, width=item.width or 0, height=item.height or 0,
+                    supports_streaming=True
+                ))
+        return group
+
+    def get_stats(self) -> dict:
+        """Get upload statistics"""
+        return {
+            'uploads': self.uploads,
+            'reused': self.reused,
+            'groups': self.groups,
+            'bytes_downloaded': self.bytes_downloaded,
+            'cached_file_ids': self.file_ids.get_stats()['size'],
+            **{f"download_{key}": value for key, value in self.scheduler.get_stats().items()}
+        }
@@ -0,0 +1,393 @@
+import abc
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from aiohttp import web
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    """Escape a label value"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Render a Prometheus label set"""
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Render a sample value"""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(abc.ABC):
+    """Base class for metrics; label values are passed as a tuple in labelnames order
+
+    Updates are plain dict operations on the event loop thread, so the hot
+    path costs a dict lookup and an addition.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.register(self)
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[str, LabelValues, str, float]]:
+        """(suffix, label values, extra label, value) for every series"""
+
+    def render(self) -> str:
+        """Render the metric in Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A monotonically increasing count; the name is given without the _total suffix"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1.0):
+        """Increase the series for labels by amount"""
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        """Current value of a series"""
+        return self._values.get(labels, 0.0)
+
+    def total(self) -> float:
+        """Sum over all series"""
+        return sum(self._values.values())
+
+    def series(self) -> Dict[LabelValues, float]:
+        """Current value of every series"""
+        return dict(self._values)
+
+    def samples(self):
+        return [("_total", labels, "", value) for labels, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, either set directly or read at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function = function
+
+    def set(self, value: float, labels: LabelValues = ()):
+        """Set the series for labels"""
+        self._values[labels] = value
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]):
+        """Read the gauge from function() at scrape time instead of storing values"""
+        self._function = function
+
+    def value(self, labels: LabelValues = ()) -> float:
+        """Current value of a series"""
+        if self._function:
+            return self._function().get(labels, 0.0)
+        return self._values.get(labels, 0.0)
+
+    def samples(self):
+        if self._function:
+            try:
+                values = self._function()
+            except Exception as e:
+                logger.debug("Gauge %s callback failed: %s", self.name, e)
+                values = {}
+        else:
+            values = self._values
+        return [("", labels, "", value) for labels, value in values.items()]
+
+
+class _Timer:
+    """Context manager that observes the elapsed time into a histogram"""
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: LabelValues):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, self.labels)
+        return False
+
+
+class Histogram(Metric):
+    """Bucketed distribution of observations (e.g. latencies in seconds)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()):
+        """Record one observation"""
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, labels: LabelValues = ()) -> _Timer:
+        """Time a with-block into this histogram"""
+        return _Timer(self, labels)
+
+    def count(self, labels: Optional[LabelValues] = None) -> int:
+        """Number of observations for labels, or across all series"""
+        series = self._series.values() if labels is None else [self._series.get(labels, [[], 0.0, 0])]
+        return sum(item[2] for item in series)
+
+    def mean(self, labels: Optional[LabelValues] = None) -> float:
+        """Mean observation for labels, or across all series"""
+        series = self._series.values() if labels is None else [self._series.get(labels, [[], 0.0, 0])]
+        count = sum(item[2] for item in series)
+        return sum(item[1] for item in series) / count if count else 0.0
+
+    def quantile(self, q: float, labels: Optional[LabelValues] = None) -> float:
+        """Estimate a quantile (0-1) from the buckets, as Prometheus' histogram_quantile does"""
+        series = list(self._series.values()) if labels is None else [self._series.get(labels)]
+        series = [item for item in series if item]
+        if not series:
+            return 0.0
+        counts = [sum(item[0][i] for item in series) for i in range(len(self.buckets) + 1)]
+        total = sum(counts)
+        if not total:
+            return 0.0
+
+        rank = q * total
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def samples(self):
+        samples = []
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", labels, f'le="{_format_value(bound)}"', cumulative))
+            samples.append(("_sum", labels, "", total))
+            samples.append(("_count", labels, "", count))
+        return samples
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        """Add a metric; names must be unique"""
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Render every metric in Prometheus text format"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# Message handling
+MESSAGE_LATENCY = Histogram(
+    "bot_message_duration_seconds", "Time spent handling an incoming message", ["handler"]
+)
+LINKS_PROCESSED = Counter(
+    "bot_links", "Instagram links handled, by outcome", ["outcome"]
+)
+INLINE_QUERIES = Counter(
+    "bot_inline_queries", "Inline queries by how they were answered", ["outcome"]
+)
+
+# Upstream API
+UPSTREAM_REQUESTS = Counter(
+    "upstream_requests", "Upstream API requests by backend and status code", ["backend", "status"]
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Upstream API response time", ["backend"]
+)
+
+# Caches
+CACHE_LOOKUPS = Counter(
+    "cache_lookups", "Cache lookups by cache and result", ["cache", "result"]
+)
+
+# Storage
+DB_WRITE_LATENCY = Histogram(
+    "db_write_duration_seconds", "SQLite write transaction time", ["store"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+# Broadcasts
+BROADCAST_MESSAGES = Counter(
+    "broadcast_messages", "Broadcast deliveries by outcome", ["outcome"]
+)
+FLOOD_WAITS = Counter(
+    "telegram_flood_waits", "FloodWait errors from Telegram during broadcasts"
+)
+FLOOD_WAIT_SECONDS = Counter(
+    "telegram_flood_wait_seconds", "Seconds Telegram asked broadcasts to wait"
+)
+BROADCAST_RATE = Gauge(
+    "broadcast_send_rate", "Current broadcast send rate in messages per second"
+)
+
+# Event loop
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay between a timer's due time and when it ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+LOOP_LAG_MAX = Gauge(
+    "event_loop_lag_max_seconds", "Largest event loop lag since the last scrape"
+)
+
+
+def track_handler(name: str):
+    """Decorator timing a message handler into MESSAGE_LATENCY"""
+    def decorator(func):
+        labels = (name,)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with MESSAGE_LATENCY.time(labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a periodic timer"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.max_lag = 0.0
+        self.task: Optional[asyncio.Task] = None
+        LOOP_LAG_MAX.set_function(self._take_max)
+
+    def _take_max(self) -> Dict[LabelValues, float]:
+        """Report and reset the maximum lag seen since the last scrape"""
+        max_lag, self.max_lag = self.max_lag, 0.0
+        return {(): max_lag}
+
+    def start(self):
+        """Start sampling"""
+        if not self.task:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    async def stop(self):
+        """Stop sampling"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+class MetricsServer:
+    """Serves REGISTRY on /metrics in Prometheus text format"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.lag_monitor = LoopLagMonitor(Config.LOOP_LAG_INTERVAL)
+        self._runner: Optional[web.AppRunner] = None
+
+    @classmethod
+    def from_config(cls, shard_index: Optional[int] = None) -> "MetricsServer":
+        """Build a server from Config settings; shard workers use the ports after METRICS_PORT"""
+        port = Config.METRICS_PORT
+        if port and shard_index is not None:
+            port += shard_index + 1
+        return cls(Config.METRICS_HOST, port)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """Render the current metrics"""
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        """Start the lag monitor and, if a port is configured, the HTTP server"""
+        self.lag_monitor.start()
+        if not self.port:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            logger.info("Metrics available at http://%s:%s/metrics", self.host, self.port)
+        except OSError as e:
+            # Metrics are not worth failing the bot over
+            logger.error("Could not start metrics server on %s:%s: %s", self.host, self.port, e)
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def stop(self):
+        """Stop the HTTP server and lag monitor"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.lag_monitor.stop()
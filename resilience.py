@@ -0,0 +1,109 @@
+import random
+import time
+from collections import deque
+from typing import Deque
+
+# Circuit breaker states
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Fail fast while an upstream is down
+
+    After failure_threshold consecutive failures the breaker opens and
+    rejects calls for reset_timeout seconds. It then lets a single probe
+    through (half-open); a success closes it again, a failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Check whether a call may go through"""
+        if self.state == STATE_OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = STATE_HALF_OPEN
+            self._probe_in_flight = False
+
+        if self.state == STATE_HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def available(self) -> bool:
+        """Check whether allow() would let a call through, without taking the probe slot"""
+        if self.state == STATE_OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        if self.state == STATE_HALF_OPEN:
+            return not self._probe_in_flight
+        return True
+
+    def release_probe(self):
+        """Give back the half-open probe slot when a call ends without a verdict"""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        """Record a successful call"""
+        self.consecutive_failures = 0
+        self.state = STATE_CLOSED
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        """Record a failed call, opening the breaker if needed"""
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != STATE_OPEN:
+                self.times_opened += 1
+            self.state = STATE_OPEN
+            self.opened_at = time.monotonic()
+
+    def get_stats(self) -> dict:
+        """Get breaker statistics"""
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'times_opened': self.times_opened,
+            'rejected': self.rejected
+        }
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies for percentile estimates"""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        """Add a latency sample"""
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, percent: float) -> float:
+        """Get the given percentile (0-100) of the recent samples"""
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
@@ -0,0 +1,423 @@
+import abc
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Type
+from urllib.parse import urlparse
+import aiohttp
+from config import Config
+from metrics import UPSTREAM_LATENCY, UPSTREAM_REQUESTS
+from resilience import CircuitBreaker, LatencyTracker, backoff_delay
+from utils import format_file_size
+
+logger = logging.getLogger(__name__)
+
+# Upstream statuses worth retrying
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Field names that different APIs use for the media URL(s)
+URL_FIELDS = ['downloadUrl', 'url', 'download_url', 'video_url', 'urls']
+
+# Field names for a list of carousel items, tried before the URL fields
+ITEM_LIST_FIELDS = ['media', 'medias', 'items', 'carousel_media', 'carousel']
+
+# Field names for an item's own URL, best first (video_url over a thumbnail's url/display_url)
+ITEM_URL_FIELDS = ['video_url', 'downloadUrl', 'download_url', 'url', 'src', 'display_url']
+
+PHOTO_TYPES = {'photo', 'image', 'graphimage', '1'}
+VIDEO_TYPES = {'video', 'graphvideo', 'reel', '2'}
+PHOTO_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.heic'}
+
+
+class UpstreamError(Exception):
+    """A failed upstream attempt"""
+
+    def __init__(self, message: str, retryable: bool = True, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class MediaItem(NamedTuple):
+    """One photo or video of a post; dimensions and size are None when unknown"""
+    url: str
+    kind: str  # "photo" or "video"
+    width: Optional[int] = None
+    height: Optional[int] = None
+    size: Optional[int] = None
+
+    def describe(self) -> str:
+        """Known dimensions and size, e.g. "1080×1350, 2.1 MB" (empty when both are unknown)"""
+        details = []
+        if self.width and self.height:
+            details.append(f"{self.width}×{self.height}")
+        if self.size:
+            details.append(format_file_size(self.size))
+        return ", ".join(details)
+
+
+def guess_kind(url: str) -> str:
+    """Photo or video from the URL's file extension (videos are the default)"""
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    return 'photo' if extension in PHOTO_EXTENSIONS else 'video'
+
+
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_item(entry: Any) -> Optional[MediaItem]:
+    """Build a MediaItem from a URL string or an item object"""
+    if isinstance(entry, str):
+        return MediaItem(entry, guess_kind(entry)) if entry else None
+    if not isinstance(entry, dict):
+        return None
+
+    url = next((entry[field] for field in ITEM_URL_FIELDS if isinstance(entry.get(field), str) and entry[field]), None)
+    if not url:
+        return None
+
+    kind_hint = str(entry.get('type', entry.get('media_type', ''))).lower()
+    if entry.get('is_video') or kind_hint in VIDEO_TYPES:
+        kind = 'video'
+    elif kind_hint in PHOTO_TYPES or entry.get('is_video') is False:
+        kind = 'photo'
+    else:
+        kind = guess_kind(url)
+
+    dimensions = entry.get('dimensions') if isinstance(entry.get('dimensions'), dict) else entry
+    return MediaItem(
+        url,
+        kind,
+        _int_or_none(dimensions.get('width')),
+        _int_or_none(dimensions.get('height')),
+        _int_or_none(entry.get('size', entry.get('filesize', entry.get('file_size'))))
+    )
+
+
+def extract_items(info: Dict[str, Any]) -> List[MediaItem]:
+    """Find the media items of a post in a response object, carousel lists first"""
+    for field in ITEM_LIST_FIELDS + URL_FIELDS:
+        value = info.get(field)
+        if isinstance(value, str):
+            value = [value]
+        if isinstance(value, list):
+            items = [item for item in map(parse_item, value) if item]
+            if items:
+                return items
+    return []
+
+
+def extract_urls(info: Dict[str, Any]) -> List[str]:
+    """Find media URLs in a response object, trying the common field names"""
+    return [item.url for item in extract_items(info)]
+
+
+class Backend(abc.ABC):
+    """An upstream API that resolves Instagram URLs
+
+    Subclasses implement parse() for their response shape. Each backend
+    keeps its own circuit breaker and live latency/error averages (EWMA)
+    used by the Resolver for routing.
+    """
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self._latency_labels = (name,)
+        self.breaker = CircuitBreaker(Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_RESET_TIMEOUT)
+        self.latency = LatencyTracker()
+        self.ewma_latency: Optional[float] = None
+        self.ewma_errors = 0.0
+
+        self.requests = 0
+        self.failures = 0
+
+    def build_params(self, url: str) -> Dict[str, str]:
+        """Query parameters for a lookup"""
+        return {'url': url}
+
+    @abc.abstractmethod
+    def parse(self, data: Any) -> Optional[Dict[str, Any]]:
+        """Normalize a response into {'items': [MediaItem, ...], 'metadata': {...}}, or None if it has no media"""
+
+    def score(self) -> float:
+        """Routing cost: expected latency inflated by the recent error rate (lower is better)"""
+        if self.ewma_latency is None:
+            # Untried backends go first so they get measured; ones that have only failed go last
+            return 0.0 if not self.ewma_errors else float('inf')
+        return self.ewma_latency / max(0.05, 1.0 - self.ewma_errors)
+
+    def _observe(self, latency: Optional[float], error: bool):
+        """Update the latency and error averages"""
+        alpha = Config.RESOLVER_EWMA_ALPHA
+        self.ewma_errors = alpha * (1.0 if error else 0.0) + (1 - alpha) * self.ewma_errors
+        if latency is not None:
+            self.latency.record(latency)
+            self.ewma_latency = latency if self.ewma_latency is None else (
+                alpha * latency + (1 - alpha) * self.ewma_latency
+            )
+
+    async def request(self, session: aiohttp.ClientSession, url: str, deadline: float) -> Dict[str, Any]:
+        """Make a single lookup, raising UpstreamError on failure"""
+        if not self.breaker.allow():
+            UPSTREAM_REQUESTS.inc((self.name, "circuit_open"))
+            raise UpstreamError(f"{self.name}: circuit open")
+
+        self.requests += 1
+        timeout = aiohttp.ClientTimeout(
+            total=max(0.1, deadline - time.monotonic()),
+            connect=Config.UPSTREAM_CONNECT_TIMEOUT,
+            sock_read=Config.UPSTREAM_READ_TIMEOUT
+        )
+        started = time.monotonic()
+        try:
+            async with session.get(self.url, params=self.build_params(url), timeout=timeout) as response:
+                UPSTREAM_REQUESTS.inc((self.name, str(response.status)))
+                UPSTREAM_LATENCY.observe(time.monotonic() - started, self._latency_labels)
+                if response.status == 200:
+                    data = await response.json(content_type=None)
+                    latency = time.monotonic() - started
+                    try:
+                        result = self.parse(data)
+                    except Exception as e:
+                        # An unexpected shape must still reach the breaker bookkeeping below
+                        logger.error("%s: could not parse response: %r", self.name, e)
+                        result = None
+                    # The API answered either way, so the backend counts as healthy
+                    self._observe(latency, error=False)
+                    self.breaker.record_success()
+                    if result is None:
+                        raise UpstreamError(f"{self.name}: no media in response", retryable=False)
+                    return result
+
+                if response.status in RETRYABLE_STATUSES:
+                    retry_after = response.headers.get('Retry-After', '')
+                    raise UpstreamError(
+                        f"{self.name}: status {response.status}",
+                        retry_after=float(retry_after) if retry_after.isdigit() else 0.0
+                    )
+                self._observe(time.monotonic() - started, error=False)
+                self.breaker.record_success()
+                raise UpstreamError(f"{self.name}: status {response.status}", retryable=False)
+
+        except UpstreamError as e:
+            if e.retryable:
+                self.failures += 1
+                self._observe(None, error=True)
+                self.breaker.record_failure()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            UPSTREAM_REQUESTS.inc((self.name, "timeout" if isinstance(e, asyncio.TimeoutError) else "error"))
+            self.failures += 1
+            self._observe(None, error=True)
+            self.breaker.record_failure()
+            raise UpstreamError(f"{self.name}: network error: {e!r}") from e
+        except asyncio.CancelledError:
+            # Lost a race or the caller went away; this says nothing about health
+            self.breaker.release_probe()
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get backend statistics"""
+        return {
+            'name': self.name,
+            **self.breaker.get_stats(),
+            'requests': self.requests,
+            'failures': self.failures,
+            'ewma_latency': self.ewma_latency or 0.0,
+            'error_rate': self.ewma_errors * 100,
+            'p95': self.latency.percentile(95)
+        }
+
+
+class NekorinnBackend(Backend):
+    """api.nekorinn.my.id: {"status": true, "result": {...}}"""
+
+    def parse(self, data: Any) -> Optional[Dict[str, Any]]:
+        if not isinstance(data, dict) or not data.get('status') or not data.get('result'):
+            return None
+        result = data['result']
+        if not isinstance(result, dict):
+            logger.error("Unexpected result in API response: %r", result)
+            return None
+        items = extract_items(result)
+        if not items:
+            logger.error("No video URLs found in API response. Response structure: %s", result)
+            return None
+        return {'items': items, 'metadata': result.get('metadata', {})}
+
+
+class GenericBackend(Backend):
+    """APIs returning the media URL(s) at the top level or under "result"/"data" """
+
+    def parse(self, data: Any) -> Optional[Dict[str, Any]]:
+        if not isinstance(data, dict):
+            return None
+        for info in (data, data.get('result'), data.get('data')):
+            if isinstance(info, dict):
+                items = extract_items(info)
+                if items:
+                    return {'items': items, 'metadata': info.get('metadata', {})}
+        return None
+
+
+# Backend types available to RESOLVER_BACKENDS
+BACKEND_TYPES: Dict[str, Type[Backend]] = {
+    'nekorinn': NekorinnBackend,
+    'generic': GenericBackend,
+}
+
+
+def register_backend_type(name: str, backend_class: Type[Backend]):
+    """Make a backend type available to RESOLVER_BACKENDS"""
+    BACKEND_TYPES[name] = backend_class
+
+
+class Resolver:
+    """Routes lookups across backends by live latency and error rate
+
+    The cheapest available backend is tried first. With RESOLVER_RACE the
+    two cheapest are queried at once and the first answer wins; otherwise
+    a hedged request goes to the next backend once the first is slower than
+    its HEDGE_PERCENTILE latency. Remaining backends are tried in order
+    on failure, and whole rounds are retried with jittered backoff.
+    """
+
+    def __init__(self, backends: List[Backend]):
+        if not backends:
+            raise ValueError("At least one resolver backend is required")
+        self.backends = backends
+
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.failovers = 0
+        self.fast_failed = 0
+
+    @classmethod
+    def from_config(cls) -> "Resolver":
+        """Build backends from RESOLVER_BACKENDS ("type=url,type=url")"""
+        backends = []
+        for index, entry in enumerate(filter(None, (part.strip() for part in Config.RESOLVER_BACKENDS.split(',')))):
+            backend_type, _, url = entry.partition('=')
+            if backend_type not in BACKEND_TYPES or not url:
+                raise ValueError(f"Invalid resolver backend: {entry!r}")
+            names = [backend.name for backend in backends]
+            name = backend_type if backend_type not in names else f"{backend_type}{index + 1}"
+            backends.append(BACKEND_TYPES[backend_type](name, url))
+        return cls(backends)
+
+    def _candidates(self) -> List[Backend]:
+        """Backends whose breaker lets calls through, cheapest first"""
+        return sorted((backend for backend in self.backends if backend.breaker.available()), key=Backend.score)
+
+    async def resolve(self, session: aiohttp.ClientSession, url: str, deadline: float) -> Optional[Dict[str, Any]]:
+        """Resolve a URL, or return None if no backend could"""
+        attempt = 0
+        while True:
+            candidates = self._candidates()
+            if not candidates:
+                self.fast_failed += 1
+                logger.warning("All resolver backends have open circuit breakers, failing fast")
+                return None
+
+            try:
+                return await self._try_backends(session, url, deadline, candidates)
+            except UpstreamError as e:
+                if not e.retryable:
+                    logger.warning("API request failed: %s", e)
+                    return None
+
+                remaining = deadline - time.monotonic()
+                delay = max(
+                    backoff_delay(attempt, Config.UPSTREAM_BACKOFF_BASE, Config.UPSTREAM_BACKOFF_MAX),
+                    e.retry_after
+                )
+                if attempt >= Config.UPSTREAM_MAX_RETRIES or delay >= remaining:
+                    logger.error("API request failed after %d attempts: %s", attempt + 1, e)
+                    return None
+
+                attempt += 1
+                self.retries += 1
+                logger.warning("API request failed (%s), retry %d in %.2fs", e, attempt, delay)
+                await asyncio.sleep(delay)
+
+    async def _try_backends(self, session: aiohttp.ClientSession, url: str, deadline: float,
+                            candidates: List[Backend]) -> Dict[str, Any]:
+        """Race or hedge the two cheapest backends, then fail over through the rest"""
+        primary, rest = candidates[0], candidates[1:]
+        if Config.RESOLVER_RACE and rest:
+            secondary, delay = rest.pop(0), 0.0
+        elif Config.HEDGE_PERCENTILE and len(primary.latency) >= Config.HEDGE_MIN_SAMPLES:
+            # Hedge to the next backend, or to the same one if it is the only one
+            secondary = rest.pop(0) if rest else primary
+            delay = primary.latency.percentile(Config.HEDGE_PERCENTILE)
+        else:
+            secondary, delay = None, 0.0
+
+        errors: List[UpstreamError] = []
+        try:
+            return await self._first_success(session, url, deadline, primary, secondary, delay)
+        except UpstreamError as e:
+            errors.append(e)
+
+        for backend in rest:
+            self.failovers += 1
+            try:
+                return await backend.request(session, url, deadline)
+            except UpstreamError as e:
+                errors.append(e)
+
+        # Prefer reporting a retryable error so the round is retried
+        raise next((error for error in errors if error.retryable), errors[-1])
+
+    async def _first_success(self, session: aiohttp.ClientSession, url: str, deadline: float,
+                             primary: Backend, secondary: Optional[Backend], delay: float) -> Dict[str, Any]:
+        """Query primary, and secondary after delay if primary has not answered yet"""
+        first = asyncio.create_task(primary.request(session, url, deadline))
+        pending = {first}
+        try:
+            if secondary is None:
+                return await first
+
+            done = set()
+            if delay > 0:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if first in done and first.exception() is None:
+                    return first.result()
+
+            if delay:
+                self.hedges += 1
+            second = asyncio.create_task(secondary.request(session, url, deadline))
+            pending.add(second)
+
+            errors: List[UpstreamError] = [first.exception()] if first in done else []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        if task is second and delay:
+                            self.hedges_won += 1
+                        return task.result()
+                    errors.append(error)
+            raise next((error for error in errors if getattr(error, 'retryable', False)), errors[-1])
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get resolver statistics"""
+        return {
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'hedges_won': self.hedges_won,
+            'failovers': self.failovers,
+            'fast_failed': self.fast_failed,
+            'backends': [backend.get_stats() for backend in self.backends]
+        }
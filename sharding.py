@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import queue
+import signal
+from bisect import bisect
+from typing import Dict, Iterable, List, Optional
+from pyrogram import Client, enums
+from pyrogram.types import Chat, Message, User
+from config import Config
+from logs import with_request_id
+from metrics import track_handler
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """Consistent hash ring mapping keys (user IDs) to shards
+
+    Each shard owns many virtual points on the ring, so keys spread evenly
+    and changing the shard count only moves about 1/n of the users.
+    """
+
+    def __init__(self, nodes: Iterable[int], replicas: int = 100):
+        self._ring = sorted(
+            (self._hash(f"{node}:{replica}"), node) for node in nodes for replica in range(replicas)
+        )
+        if not self._ring:
+            raise ValueError("A hash ring needs at least one node")
+        self._points = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+    def get_node(self, key) -> int:
+        """Shard responsible for key"""
+        index = bisect(self._points, self._hash(str(key))) % len(self._points)
+        return self._ring[index][1]
+
+
+def run_shard_worker(index: int, work_queue: multiprocessing.Queue):
+    """Entry point of a shard worker process"""
+    # Ctrl+C reaches the whole process group; the main process shuts workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(ShardWorker(index, work_queue).run())
+
+
+class ShardDispatcher:
+    """Forwards incoming URL messages to worker processes by consistent hash of user ID
+
+    The main process keeps the only update-receiving client, the user
+    database and admin commands. Every message of a user goes to the same
+    worker, which keeps that user's messages in order and their rate limits
+    in one place.
+    """
+
+    def __init__(self, app: Client, workers: int):
+        self.app = app
+        self.workers = workers
+        self.ring = HashRing(range(workers))
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue(maxsize=Config.SHARD_QUEUE_SIZE) for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+
+        self.dispatched = [0] * workers
+        self.rejected = 0
+        self.restarts = 0
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=run_shard_worker, args=(index, self.queues[index]), name=f"shard-{index}", daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        """Start the worker processes"""
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info("Started %d shard workers", self.workers)
+
+    async def dispatch(self, message: Message) -> bool:
+        """Queue a message for its user's shard; return False if the shard is overloaded"""
+        user_id = message.from_user.id
+        shard = self.ring.get_node(user_id)
+
+        process = self.processes[shard]
+        if process is not None and not process.is_alive():
+            logger.warning("Shard %d exited with code %s, restarting it", shard, process.exitcode)
+            self.restarts += 1
+            self._spawn(shard)
+
+        # Pass the peer's access hash so the worker's session can reply without resolving it
+        try:
+            peer = await self.app.storage.get_peer_by_id(user_id)
+            access_hash = getattr(peer, 'access_hash', 0)
+        except KeyError:
+            access_hash = 0
+
+        payload = {
+            'user_id': user_id,
+            'access_hash': access_hash,
+            'first_name': message.from_user.first_name,
+            'chat_id': message.chat.id,
+            'message_id': message.id,
+            'text': message.text
+        }
+        try:
+            self.queues[shard].put_nowait(payload)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.dispatched[shard] += 1
+        return True
+
+    async def stop(self):
+        """Ask workers to finish their current messages and exit"""
+        for work_queue in self.queues:
+            try:
+                work_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        for process in self.processes:
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, Config.SHARD_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logger.warning("Shard %s did not stop in time, terminating it", process.name)
+                process.terminate()
+
+    def get_stats(self) -> dict:
+        """Get dispatcher statistics"""
+        return {
+            'workers': self.workers,
+            'alive': sum(1 for process in self.processes if process is not None and process.is_alive()),
+            'dispatched': list(self.dispatched),
+            'rejected': self.rejected,
+            'restarts': self.restarts
+        }
+
+
+class ShardWorker:
+    """Runs URL processing for one shard in its own process and event loop"""
+
+    def __init__(self, index: int, work_queue: multiprocessing.Queue):
+        # Imported here: bot.py imports this module
+        from bot import InstagramBot
+
+        self.index = index
+        self.work_queue = work_queue
+        self.bot = InstagramBot(shard_index=index)
+        # user_id -> that user's most recent task; the next one waits for it
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def build_message(self, payload: dict) -> Message:
+        """Rebuild enough of a Message for the URL handlers to reply through this worker's client"""
+        client = self.bot.app
+        return Message(
+            client=client,
+            id=payload['message_id'],
+            chat=Chat(client=client, id=payload['chat_id'], type=enums.ChatType.PRIVATE),
+            from_user=User(client=client, id=payload['user_id'], first_name=payload['first_name']),
+            text=payload['text']
+        )
+
+    async def run(self):
+        """Start the worker's client and process messages until told to stop"""
+        bot = self.bot
+        await bot.metrics_server.start()
+        await bot.downloader.start()
+        await bot.app.start()
+        logger.info("Shard %d started", self.index)
+
+        try:
+            await self._consume()
+        finally:
+            tails = list(self._tails.values())
+            if tails:
+                await asyncio.wait(tails, timeout=Config.SHARD_SHUTDOWN_TIMEOUT)
+            await bot.app.stop()
+            await bot.downloader.close()
+            await bot.metrics_server.stop()
+            logger.info("Shard %d stopped", self.index)
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            payload = await loop.run_in_executor(None, self.work_queue.get)
+            if payload is None:
+                return
+            if payload['access_hash']:
+                await self.bot.app.storage.update_peers(
+                    [(payload['user_id'], payload['access_hash'], "user", None, None)]
+                )
+            self._schedule(payload)
+
+    def _schedule(self, payload: dict):
+        """Run a message after the same user's previous one, concurrently with other users"""
+        user_id = payload['user_id']
+        task = asyncio.create_task(self._handle(payload, self._tails.get(user_id)))
+        self._tails[user_id] = task
+
+        def forget(done: asyncio.Task):
+            if self._tails.get(user_id) is done:
+                del self._tails[user_id]
+        task.add_done_callback(forget)
+
+    async def _handle(self, payload: dict, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.handle_message(self.build_message(payload))
+        except Exception as e:
+            logger.error("Shard %d failed to handle message from %s: %s", self.index, payload['user_id'], e)
+
+    @track_handler("text")
+    @with_request_id
+    async def handle_message(self, message: Message):
+        await self.bot.handle_instagram_url(message)
@@ -0,0 +1,88 @@
+import asyncio
+
+from admission import AdmissionController
+
+
+def make_controller(max_concurrent: int = 1) -> AdmissionController:
+    return AdmissionController(max_concurrent, max_queue=10, user_rate=1000, user_burst=1000)
+
+
+def test_cancel_during_queued_notice_frees_the_slot():
+    async def scenario():
+        admission = make_controller()
+        release = asyncio.Event()
+        notifying = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+
+        async def on_queued(position: int):
+            notifying.set()
+            await asyncio.sleep(10)
+
+        holder = asyncio.create_task(admission.run(1, hold))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(admission.run(2, hold, on_queued=on_queued))
+        await notifying.wait()
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert admission.queued == 0
+
+        release.set()
+        await holder
+        assert admission.active == 0
+
+        # The slot is usable again instead of waiting on the cancelled request forever
+        assert await asyncio.wait_for(admission.run(3, lambda: asyncio.sleep(0, "done")), 1) == "done"
+        assert admission.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_while_waiting_frees_the_slot():
+    async def scenario():
+        admission = make_controller()
+        release = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+
+        holder = asyncio.create_task(admission.run(1, hold))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(admission.run(2, hold))
+        await asyncio.sleep(0)
+        assert admission.queued == 1
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+
+        release.set()
+        await holder
+        assert admission.active == 0 and admission.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_is_served_round_robin_across_users():
+    async def scenario():
+        admission = make_controller()
+        release = asyncio.Event()
+        order = []
+
+        async def hold():
+            await release.wait()
+
+        def record(user_id: int):
+            async def func():
+                order.append(user_id)
+            return func
+
+        holder = asyncio.create_task(admission.run(0, hold))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(admission.run(user_id, record(user_id))) for user_id in (1, 1, 1, 2)]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        assert order == [1, 2, 1, 1]
+        assert admission.active == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,277 @@
+import asyncio
+import time
+
+import pytest
+
+from pyrogram.errors import FloodWait
+
+from broadcast import BroadcastManager
+from broadcast_store import STATUS_COMPLETED, STATUS_FAILED, STATUS_PREPARING
+from config import Config
+
+
+class FakeApp:
+    def __init__(self, flood_once=()):
+        self.sent = []
+        # Users whose first send raises FloodWait
+        self.flood_once = set(flood_once)
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.flood_once:
+            self.flood_once.discard(chat_id)
+            raise FloodWait(value=0)
+        self.sent.append(chat_id)
+        return type("Sent", (), {"chat": type("Chat", (), {"id": chat_id})(), "id": 1})()
+
+    async def edit_message_text(self, chat_id, message_id, text):
+        pass
+
+
+class FakeReply:
+    def __init__(self):
+        self.chat = type("Chat", (), {"id": 1})()
+        self.replies = []
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+        return type("Status", (), {"chat": self.chat, "id": len(self.replies)})()
+
+
+class UserDatabase:
+    """User store with a fixed list of users"""
+
+    def __init__(self, user_ids):
+        self.user_ids = list(user_ids)
+
+    async def count_segment(self, segment):
+        return len(self.user_ids)
+
+    async def iter_segment(self, segment, batch_size):
+        for start in range(0, len(self.user_ids), batch_size):
+            yield self.user_ids[start:start + batch_size]
+
+    def remove_users(self, user_ids):
+        return len(user_ids)
+
+    def record_failures(self, user_ids):
+        pass
+
+
+class BrokenSnapshotDatabase:
+    """User store whose segment iteration fails after the first batch"""
+
+    async def count_segment(self, segment):
+        return 3
+
+    async def iter_segment(self, segment, batch_size):
+        yield [10, 11]
+        raise RuntimeError("disk I/O error")
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "BROADCAST_DB_FILE", str(tmp_path / "broadcasts.db"))
+    return BroadcastManager(FakeApp(), BrokenSnapshotDatabase())
+
+
+def test_failed_snapshot_is_never_resumed(manager):
+    async def scenario():
+        admin = FakeReply()
+        with pytest.raises(RuntimeError):
+            await manager.broadcast_message("hello", admin)
+        jobs = await manager.store.list_jobs()
+        assert [job['status'] for job in jobs] == [STATUS_FAILED]
+        assert "failed while collecting recipients" in admin.replies[-1]
+
+        await manager.resume_jobs()
+        assert manager.jobs == {}
+        assert manager.app.sent == []
+        await manager.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_interrupted_snapshot_is_failed_on_restart(manager):
+    async def scenario():
+        job_id = await manager.store.create_job("hello", [10, 11], 1, STATUS_PREPARING)
+        await manager.resume_jobs()
+        assert (await manager.store.get_job(job_id))['status'] == STATUS_FAILED
+        assert manager.jobs == {}
+        assert manager.app.sent == []
+        await manager.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_resumed_job_failure_is_recorded_and_reported(manager, caplog):
+    async def scenario():
+        job_id = await manager.store.create_job("hello", [10, 11], 1)
+
+        async def broken_pending(job_id, after=None, limit=1000):
+            raise RuntimeError("database is locked")
+
+        manager.store.pending_recipients = broken_pending
+        await manager.resume_jobs()
+        job = manager.jobs[job_id]
+        await asyncio.gather(job.task, return_exceptions=True)
+
+        assert (await manager.store.get_job(job_id))['status'] == STATUS_FAILED
+        assert job_id not in manager.jobs
+        # The restart notice, then the failure notice
+        assert manager.app.sent == [1, 1]
+        assert "Broadcast #%s failed" % job_id in caplog.text
+        await manager.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_job_runs_detached_and_streams_recipients_in_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "BROADCAST_DB_FILE", str(tmp_path / "broadcasts.db"))
+    monkeypatch.setattr(Config, "BROADCAST_SNAPSHOT_BATCH", 100)
+    monkeypatch.setattr(Config, "BROADCAST_RATE", 1e6)
+    monkeypatch.setattr(Config, "BROADCAST_BURST", 1e6)
+    users = list(range(1000, 3500))
+    app = FakeApp(flood_once=[1500, 3499])
+    manager = BroadcastManager(app, UserDatabase(users))
+
+    async def scenario():
+        pages = []
+        read_page = manager.store.pending_recipients
+
+        async def recording_page(job_id, after=None, limit=1000):
+            page = await read_page(job_id, after, limit)
+            pages.append(len(page))
+            return page
+
+        manager.store.pending_recipients = recording_page
+        job = await manager.broadcast_message("hello", FakeReply())
+        # Returned while the job is still sending
+        assert not job.task.done()
+        result = await job.task
+
+        assert result == {"success": len(users), "failed": 0, "blocked": 0, "total": len(users)}
+        # Every user exactly once, the two FloodWait users retried
+        assert sorted(user for user in app.sent if user != 1) == users
+        assert max(pages) == 100
+        assert (await manager.store.get_job(job.job_id))['status'] == STATUS_COMPLETED
+        await manager.store.close()
+
+    asyncio.run(scenario())
+
+
+class EmptiedDatabase(UserDatabase):
+    """Counts users, but they are gone by the time the snapshot reads them"""
+
+    async def count_segment(self, segment):
+        return 5
+
+
+def test_segment_emptied_before_the_snapshot_completes_the_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "BROADCAST_DB_FILE", str(tmp_path / "broadcasts.db"))
+    manager = BroadcastManager(FakeApp(), EmptiedDatabase([]))
+
+    async def scenario():
+        admin = FakeReply()
+        assert await manager.broadcast_message("hello", admin) is None
+        assert "No users found" in admin.replies[-1]
+        assert [job['status'] for job in await manager.store.list_jobs()] == [STATUS_COMPLETED]
+        assert manager.jobs == {}
+        await manager.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_job_runs_when_the_status_reply_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "BROADCAST_DB_FILE", str(tmp_path / "broadcasts.db"))
+    app = FakeApp()
+    manager = BroadcastManager(app, UserDatabase([10, 11]))
+
+    class UnreachableAdmin(FakeReply):
+        async def reply_text(self, text):
+            raise ConnectionError("Telegram unreachable")
+
+    async def scenario():
+        job = await manager.broadcast_message("hello", UnreachableAdmin())
+        result = await job.task
+        assert result["success"] == 2
+        assert (await manager.store.get_job(job.job_id))['status'] == STATUS_COMPLETED
+        await manager.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_flood_wait_cuts_the_rate_once_per_window_and_recovers(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "BROADCAST_DB_FILE", str(tmp_path / "broadcasts.db"))
+    monkeypatch.setattr(Config, "BROADCAST_RATE", 20)
+    monkeypatch.setattr(Config, "BROADCAST_MIN_RATE", 4)
+    monkeypatch.setattr(Config, "BROADCAST_BACKOFF_FACTOR", 0.5)
+    monkeypatch.setattr(Config, "BROADCAST_RECOVERY_STEP", 10)
+    manager = BroadcastManager(FakeApp(), UserDatabase([]))
+
+    async def scenario():
+        limiter = manager.rate_limiter
+        manager._on_flood_wait(1)
+        assert limiter.is_paused()
+        assert limiter.rate == 10
+        # Other workers hitting the same flood window do not cut the rate again
+        manager._on_flood_wait(1)
+        assert limiter.rate == 10
+        assert manager.flood_waits == 2
+
+        # Each success adds step/rate, about +step msgs/s per second of sending
+        manager._on_send_success()
+        assert limiter.rate == 11
+        for _ in range(20):
+            manager._on_send_success()
+        assert limiter.rate == 20
+
+        # Repeated cuts stop at the floor
+        for _ in range(5):
+            limiter._paused_until = 0.0
+            manager._on_flood_wait(0)
+        assert limiter.rate == 4
+        await manager.store.close()
+
+    asyncio.run(scenario())
+
+
+class TimedApp(FakeApp):
+    """Records when each send happens; the first send to flood_user raises FloodWait(flood_seconds)"""
+
+    def __init__(self, flood_user, flood_seconds):
+        super().__init__()
+        self.flood_user = flood_user
+        self.flood_seconds = flood_seconds
+        self.flooded_at = None
+        self.sent_at = []
+
+    async def send_message(self, chat_id, text):
+        if chat_id == self.flood_user and self.flooded_at is None:
+            self.flooded_at = time.monotonic()
+            raise FloodWait(value=self.flood_seconds)
+        self.sent_at.append(time.monotonic())
+        return await super().send_message(chat_id, text)
+
+
+def test_flood_wait_pauses_every_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "BROADCAST_DB_FILE", str(tmp_path / "broadcasts.db"))
+    monkeypatch.setattr(Config, "BROADCAST_WORKERS", 4)
+    monkeypatch.setattr(Config, "BROADCAST_RATE", 200)
+    monkeypatch.setattr(Config, "BROADCAST_BURST", 4)
+    users = list(range(100, 140))
+    app = TimedApp(flood_user=110, flood_seconds=1)
+    manager = BroadcastManager(app, UserDatabase(users))
+
+    async def scenario():
+        job = await manager.broadcast_message("hello", FakeReply())
+        result = await job.task
+
+        assert result["success"] == len(users)
+        # No worker sends while the flood window is open
+        assert not [at for at in app.sent_at if app.flooded_at < at < app.flooded_at + 0.99]
+        assert sum(at > app.flooded_at for at in app.sent_at) >= 1
+        assert manager.flood_waits == 1
+        assert manager.rate_limiter.rate < 200
+        await manager.store.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,81 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import cache
+from cache import MISSING, ResultCache, SQLiteCacheBackend
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Frozen wall clock for the cache module; advance it by changing clock.now"""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_evicts_least_recently_used_at_max_size(clock):
+    async def main():
+        results = ResultCache(max_size=2, ttl=60, negative_ttl=10)
+        await results.set("a", 1)
+        await results.set("b", 2)
+        # Reading "a" makes "b" the least recently used entry
+        assert await results.get("a") == 1
+        await results.set("c", 3)
+
+        assert await results.get("b") is MISSING
+        assert await results.get("a") == 1
+        assert await results.get("c") == 3
+        assert results.get_stats()['size'] == 2
+        assert results.evictions == 1
+
+    asyncio.run(main())
+
+
+def test_positive_and_negative_ttls_expire(clock):
+    async def main():
+        results = ResultCache(max_size=10, ttl=60, negative_ttl=10)
+        await results.set("found", {"url": "x"})
+        await results.set("failed", None)
+
+        clock.now += 9
+        assert await results.get("failed") is None
+        clock.now += 2
+        assert await results.get("failed") is MISSING
+        assert await results.get("found") == {"url": "x"}
+
+        clock.now += 50
+        assert await results.get("found") is MISSING
+        assert results.expirations == 2
+        assert results.get_stats()['size'] == 0
+
+    asyncio.run(main())
+
+
+def test_zero_negative_ttl_does_not_cache_failures(clock):
+    async def main():
+        results = ResultCache(max_size=10, ttl=60, negative_ttl=0)
+        await results.set("failed", None)
+        assert await results.get("failed") is MISSING
+
+    asyncio.run(main())
+
+
+def test_backend_survives_restart_and_respects_expiry(clock, tmp_path):
+    async def main():
+        path = str(tmp_path / "cache.db")
+        first = ResultCache(max_size=10, ttl=60, negative_ttl=10, backend=SQLiteCacheBackend(path))
+        await first.set("key", ["a", "b"])
+        first.close()
+
+        second = ResultCache(max_size=10, ttl=60, negative_ttl=10, backend=SQLiteCacheBackend(path))
+        assert await second.get("key") == ["a", "b"]
+        assert second.backend_hits == 1
+
+        clock.now += 61
+        assert await second.get("key") is MISSING
+        assert second.backend.purge_expired() == 1
+        second.close()
+
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from config import Config
+from database import UserDatabase
+
+
+@pytest.fixture
+def db_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "DATABASE_FILE", str(tmp_path / "users.db"))
+    monkeypatch.setattr(Config, "LEGACY_DATABASE_FILE", str(tmp_path / "users.json"))
+    monkeypatch.setattr(Config, "DB_FLUSH_BATCH_SIZE", 5)
+    monkeypatch.setattr(Config, "DB_FLUSH_INTERVAL", 60)
+    return tmp_path
+
+
+def stored_users(db_files):
+    """Users as they are on disk, read through a fresh database"""
+    async def main():
+        db = UserDatabase()
+        users = list(db.get_all_users())
+        await db.close()
+        return users
+
+    return asyncio.run(main())
+
+
+def test_migrates_users_json_once(db_files):
+    legacy = db_files / "users.json"
+    legacy.write_text(json.dumps({"users": [3, "1", 2]}))
+
+    assert stored_users(db_files) == [1, 2, 3]
+    assert not legacy.exists()
+    assert os.path.exists(str(legacy) + ".migrated")
+
+    # The renamed file is not imported again
+    assert stored_users(db_files) == [1, 2, 3]
+
+
+def test_write_behind_flushes_full_batches_and_on_close(db_files):
+    async def main():
+        db = UserDatabase()
+        db.start()
+        db.add_user(10)
+        db.add_user(20)
+        await asyncio.sleep(0.05)
+        # Below the batch size nothing is written before the interval
+        assert stored_users_now(db) == []
+
+        db.add_user(30)
+        await asyncio.sleep(0.05)
+        # A new user is an insert plus its activity, so the third one fills the batch
+        assert stored_users_now(db) == [10, 20, 30]
+
+        db.add_user(40)
+        db.remove_user(10)
+        await db.close()
+
+    def stored_users_now(db):
+        return [row[0] for row in db._conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+
+    asyncio.run(main())
+    assert stored_users(db_files) == [20, 30, 40]
+
+
+def test_failed_flush_keeps_changes_for_the_next_one(db_files):
+    async def main():
+        db = UserDatabase()
+        db.start()
+        write_batch = db._write_batch
+
+        def disk_full(*batch):
+            raise OSError("disk full")
+
+        db._write_batch = disk_full
+        db.add_user(1)
+        await db.flush()
+        assert db._pending == {1: True}
+
+        db._write_batch = write_batch
+        await db.close()
+
+    asyncio.run(main())
+    assert stored_users(db_files) == [1]
+
+
+def test_writes_synchronously_without_write_behind(db_files):
+    async def main():
+        db = UserDatabase()
+        db.add_user(5)
+        assert db._pending_count() == 0
+        await db.close()
+
+    asyncio.run(main())
+    assert stored_users(db_files) == [5]
+
+
+def test_remove_users_in_bulk(db_files):
+    async def main():
+        db = UserDatabase()
+        db.start()
+        for user_id in range(1, 7):
+            db.add_user(user_id)
+        await db.flush()
+
+        # Unknown and repeated IDs are skipped
+        assert db.remove_users([2, 4, 4, 99, 6]) == 3
+        assert list(db.get_all_users()) == [1, 3, 5]
+        assert db.get_user_count() == 3
+        assert db.remove_users([]) == 0
+        await db.close()
+
+    asyncio.run(main())
+    assert stored_users(db_files) == [1, 3, 5]
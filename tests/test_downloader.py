@@ -0,0 +1,36 @@
+from downloader import InstagramLink, find_instagram_urls, parse_instagram_url
+
+
+def test_finds_links_embedded_in_text():
+    text = "look at this https://www.instagram.com/p/Cx1_a-B/ and this one (https://instagram.com/reel/R2e3l)!"
+    assert find_instagram_urls(text) == [InstagramLink("p", "Cx1_a-B"), InstagramLink("reel", "R2e3l")]
+
+
+def test_finds_username_prefixed_links():
+    text = "https://www.instagram.com/some.user_name/p/ABC123/ http://instagram.com/other-user/tv/TV9"
+    assert find_instagram_urls(text) == [InstagramLink("p", "ABC123"), InstagramLink("tv", "TV9")]
+
+
+def test_strips_tracking_query_strings():
+    links = find_instagram_urls("https://www.instagram.com/reel/ABC123/?igsh=MWQ1ZGUxMzBkMA==&utm_source=share")
+    assert links == [InstagramLink("reel", "ABC123")]
+    assert links[0].url == "https://www.instagram.com/reel/ABC123/"
+
+
+def test_deduplicates_by_shortcode():
+    text = (
+        "https://www.instagram.com/p/ABC123/ https://instagram.com/p/ABC123/?img_index=2 "
+        "https://www.instagram.com/someone/reel/ABC123/"
+    )
+    assert find_instagram_urls(text) == [InstagramLink("p", "ABC123")]
+
+
+def test_ignores_non_post_links():
+    text = "https://www.instagram.com/someone/ https://www.instagram.com/stories/x/1 https://example.com/p/ABC123/"
+    assert find_instagram_urls(text) == []
+    assert find_instagram_urls("no links here") == []
+
+
+def test_parse_requires_a_link_at_the_start():
+    assert parse_instagram_url("https://www.instagram.com/tv/XYZ/") == InstagramLink("tv", "XYZ")
+    assert parse_instagram_url("see https://www.instagram.com/tv/XYZ/") is None
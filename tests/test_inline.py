@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController
+from cache import MISSING
+from config import Config
+from inline import InlineHandler
+from resolver import MediaItem
+
+
+class FakeDownloader:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.cache = {}
+        self.resolved = []
+
+    async def get_cached(self, link):
+        return self.cache.get(link.shortcode, MISSING)
+
+    async def process_link(self, link):
+        self.resolved.append(link.shortcode)
+        await asyncio.sleep(self.delay)
+        info = {'items': [MediaItem("https://cdn.example/a.jpg", "photo", 10, 10, 100)], 'metadata': {}}
+        self.cache[link.shortcode] = info
+        return info
+
+
+class FakeQuery:
+    ids = iter(range(1, 10**6))
+
+    def __init__(self, text: str, user_id: int = 1):
+        self.id = str(next(self.ids))
+        self.query = text
+        self.from_user = type("User", (), {"id": user_id})()
+        self.answers = []
+
+    async def answer(self, results, **kwargs):
+        self.answers.append((results, kwargs))
+
+
+@pytest.fixture(autouse=True)
+def inline_config(monkeypatch):
+    monkeypatch.setattr(Config, "INLINE_DEBOUNCE", 0.1)
+    monkeypatch.setattr(Config, "INLINE_ANSWER_BUDGET", 0.4)
+
+
+def make_handler(downloader):
+    return InlineHandler(downloader, AdmissionController(10, 10, 1000, 1000))
+
+
+def test_newer_query_supersedes_one_being_debounced():
+    async def scenario():
+        downloader = FakeDownloader()
+        handler = make_handler(downloader)
+        # Keystrokes of the same user arrive while earlier ones are still debouncing
+        queries = [FakeQuery(f"https://instagram.com/p/{code}/") for code in ("AB", "ABC", "ABCD")]
+        tasks = []
+        for query in queries:
+            tasks.append(asyncio.create_task(handler.handle(query)))
+            await asyncio.sleep(0.02)
+        await asyncio.gather(*tasks)
+
+        assert downloader.resolved == ["ABCD"]
+        assert [len(query.answers) for query in queries] == [0, 0, 1]
+        assert handler.get_stats()['answering'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cached_post_is_answered_without_debounce():
+    async def scenario():
+        downloader = FakeDownloader()
+        handler = make_handler(downloader)
+        await handler.handle(FakeQuery("https://instagram.com/reel/CACHED/"))
+
+        query = FakeQuery("https://instagram.com/reel/CACHED/")
+        await asyncio.wait_for(handler.handle(query), Config.INLINE_DEBOUNCE / 2)
+        assert query.answers[0][1]['cache_time'] == Config.INLINE_CACHE_TIME
+        assert downloader.resolved == ["CACHED"]
+
+    asyncio.run(scenario())
+
+
+def test_slow_post_gets_a_pending_answer_then_fills_the_cache():
+    async def scenario():
+        downloader = FakeDownloader(delay=0.6)
+        handler = make_handler(downloader)
+        query = FakeQuery("https://instagram.com/reel/SLOW/")
+        await handler.handle(query)
+        results, kwargs = query.answers[0]
+        assert results[0].title == "⏳ Resolving…"
+        assert kwargs == {'cache_time': 0, 'is_personal': True}
+
+        await asyncio.sleep(0.4)
+        again = FakeQuery("https://instagram.com/reel/SLOW/")
+        await handler.handle(again)
+        assert again.answers[0][1]['cache_time'] == Config.INLINE_CACHE_TIME
+        assert downloader.resolved == ["SLOW"]
+
+    asyncio.run(scenario())
+
+
+def test_text_without_a_link_is_answered_with_a_hint():
+    async def scenario():
+        query = FakeQuery("hello")
+        await make_handler(FakeDownloader()).handle(query)
+        results, kwargs = query.answers[0]
+        assert results == [] and kwargs['switch_pm_text']
+
+    asyncio.run(scenario())
@@ -0,0 +1,35 @@
+import pytest
+
+from config import Config
+from media import DownloadScheduler
+
+
+@pytest.fixture
+def download_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "DOWNLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(Config, "DOWNLOAD_DISK_BUDGET", 900)
+    monkeypatch.setattr(Config, "SHARD_WORKERS", 3)
+    return tmp_path
+
+
+def test_shards_clean_up_only_their_own_directory(download_dir):
+    DownloadScheduler(None)
+    first = DownloadScheduler(0)
+    (download_dir / "shard0" / "in-flight").write_bytes(b"x")
+    (download_dir / "stale").write_bytes(b"x")
+
+    second = DownloadScheduler(1)
+    assert second.temp_dir == str(download_dir / "shard1")
+    assert (download_dir / "shard0" / "in-flight").exists()
+    assert (download_dir / "stale").exists()
+
+    # Restarting a shard clears what it left behind
+    DownloadScheduler(0)
+    assert first.temp_dir == str(download_dir / "shard0")
+    assert not (download_dir / "shard0" / "in-flight").exists()
+
+
+def test_shards_split_the_disk_budget(download_dir):
+    assert DownloadScheduler(None).disk_budget == 900
+    assert DownloadScheduler(2).disk_budget == 300
+
@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+from ratelimit import TokenBucket
+
+
+def test_pause_holds_every_waiter():
+    async def main():
+        bucket = TokenBucket(rate=1000, capacity=10)
+        bucket.pause(0.2)
+        assert bucket.is_paused()
+        assert not bucket.try_acquire()
+
+        started = time.monotonic()
+
+        async def acquire():
+            await bucket.acquire()
+            return time.monotonic() - started
+
+        waited = await asyncio.gather(*(acquire() for _ in range(5)))
+        assert min(waited) >= 0.19
+        assert not bucket.is_paused()
+
+    asyncio.run(main())
+
+
+def test_pause_is_not_shortened_by_a_later_shorter_pause():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    bucket.pause(0.5)
+    bucket.pause(0.01)
+    assert bucket.retry_after() > 0.4
+
+
+def test_set_rate_keeps_accumulated_tokens():
+    bucket = TokenBucket(rate=10, capacity=5)
+    bucket.set_rate(1)
+    assert all(bucket.try_acquire() for _ in range(5))
+    assert not bucket.try_acquire()
+    assert 0.9 < bucket.retry_after() <= 1.0
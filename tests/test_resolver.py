@@ -0,0 +1,204 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from config import Config
+from resilience import STATE_CLOSED, STATE_OPEN
+from resolver import NekorinnBackend, Resolver
+
+POST_URL = "https://www.instagram.com/reel/ABC123/"
+
+
+class StubApi:
+    """Local nekorinn-style API with a fixed latency; status 200 answers with a URL naming the stub"""
+
+    def __init__(self, name: str, latency: float = 0.0, status: int = 200, result=None):
+        self.name = name
+        self.latency = latency
+        self.status = status
+        # Overrides the "result" object of a 200 answer
+        self.result = result
+        self.requests = 0
+        self.runner = None
+        self.url = ""
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.status != 200:
+            return web.json_response({"status": False}, status=self.status)
+        if self.result is not None:
+            return web.json_response({"status": True, "result": self.result})
+        return web.json_response({
+            "status": True,
+            "result": {"downloadUrl": [f"https://cdn.example/{self.name}.mp4"], "metadata": {}}
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/downloader/instagram", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        self.url = f"http://127.0.0.1:{self.runner.addresses[0][1]}/downloader/instagram"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+@pytest.fixture(autouse=True)
+def resolver_config(monkeypatch):
+    monkeypatch.setattr(Config, "RESOLVER_RACE", False)
+    monkeypatch.setattr(Config, "HEDGE_PERCENTILE", 0.0)
+    monkeypatch.setattr(Config, "UPSTREAM_MAX_RETRIES", 0)
+    monkeypatch.setattr(Config, "UPSTREAM_READ_TIMEOUT", 15.0)
+    # High enough that routing is decided by the averages, not by an open breaker
+    monkeypatch.setattr(Config, "BREAKER_FAILURE_THRESHOLD", 100)
+
+
+def run_with_stubs(stubs, scenario):
+    """Start the stubs, build one backend per stub (in order) and run scenario(resolver, resolve)"""
+    async def main():
+        for stub in stubs:
+            await stub.start()
+        resolver = Resolver([NekorinnBackend(stub.name, stub.url) for stub in stubs])
+        try:
+            async with aiohttp.ClientSession() as session:
+                async def resolve():
+                    result = await resolver.resolve(session, POST_URL, time.monotonic() + 5)
+                    return result['items'][0].url.rsplit('/', 1)[-1][:-len('.mp4')] if result else None
+                await scenario(resolver, resolve)
+        finally:
+            for stub in stubs:
+                await stub.stop()
+
+    asyncio.run(main())
+
+
+def test_routes_to_the_lowest_latency_backend():
+    slow, fast = StubApi("slow", latency=0.15), StubApi("fast", latency=0.01)
+
+    async def scenario(resolver, resolve):
+        # Each untried backend is measured once, then the faster one takes the traffic
+        assert [await resolve() for _ in range(6)] == ["slow"] + ["fast"] * 5
+        assert (slow.requests, fast.requests) == (1, 5)
+
+    run_with_stubs([slow, fast], scenario)
+
+
+def test_error_rate_moves_traffic_to_a_slower_backend():
+    flaky, steady = StubApi("flaky", latency=0.01), StubApi("steady", latency=0.05)
+
+    async def scenario(resolver, resolve):
+        assert [await resolve() for _ in range(2)] == ["flaky", "steady"]
+
+        # Errors inflate the faster backend's cost until the slower one is cheaper
+        flaky.status = 503
+        assert [await resolve() for _ in range(10)] == ["steady"] * 10
+        tried = flaky.requests
+        assert 1 < tried < 12
+        assert resolver.failovers == tried - 1
+
+        assert [await resolve() for _ in range(3)] == ["steady"] * 3
+        assert flaky.requests == tried
+        assert resolver.backends[0].breaker.state == "closed"
+
+    run_with_stubs([flaky, steady], scenario)
+
+
+def test_backend_that_only_fails_is_not_preferred():
+    broken, working = StubApi("broken", status=500), StubApi("working", latency=0.01)
+
+    async def scenario(resolver, resolve):
+        assert [await resolve() for _ in range(4)] == ["working"] * 4
+        # Tried once, failed over, then ranked behind the measured backend
+        assert broken.requests == 1
+        assert resolver.failovers == 1
+
+    run_with_stubs([broken, working], scenario)
+
+
+def test_fails_over_when_a_backend_times_out(monkeypatch):
+    monkeypatch.setattr(Config, "UPSTREAM_READ_TIMEOUT", 0.2)
+    hanging, working = StubApi("hanging", latency=0.8), StubApi("working", latency=0.01)
+
+    async def scenario(resolver, resolve):
+        started = time.monotonic()
+        assert await resolve() == "working"
+        assert time.monotonic() - started < 0.6
+        assert resolver.failovers == 1
+        assert resolver.backends[0].failures == 1
+
+    run_with_stubs([hanging, working], scenario)
+
+
+def test_race_takes_the_first_answer(monkeypatch):
+    monkeypatch.setattr(Config, "RESOLVER_RACE", True)
+    slow, fast = StubApi("slow", latency=0.6), StubApi("fast", latency=0.02)
+
+    async def scenario(resolver, resolve):
+        started = time.monotonic()
+        assert await resolve() == "fast"
+        assert time.monotonic() - started < 0.4
+        assert (slow.requests, fast.requests) == (1, 1)
+        # The cancelled loser is not counted as a failure
+        assert resolver.backends[0].failures == 0
+        assert resolver.backends[0].breaker.consecutive_failures == 0
+
+    run_with_stubs([slow, fast], scenario)
+
+
+def test_returns_none_when_every_backend_fails():
+    first, second = StubApi("first", status=503), StubApi("second", status=404)
+
+    async def scenario(resolver, resolve):
+        assert await resolve() is None
+        assert (first.requests, second.requests) == (1, 1)
+
+    run_with_stubs([first, second], scenario)
+
+
+@pytest.mark.parametrize("result", [["https://cdn.example/a.mp4"], "https://cdn.example/a.mp4"])
+def test_unexpected_result_shape_closes_a_half_open_breaker(result, monkeypatch):
+    monkeypatch.setattr(Config, "BREAKER_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(Config, "BREAKER_RESET_TIMEOUT", 0.0)
+    odd = StubApi("odd", result=result)
+
+    async def scenario(resolver, resolve):
+        breaker = resolver.backends[0].breaker
+        breaker.record_failure()
+        assert breaker.state == STATE_OPEN
+
+        # The half-open probe gets an answer it cannot parse; the API still answered, so the probe completes
+        assert await resolve() is None
+        assert breaker.state == STATE_CLOSED
+        assert await resolve() is None
+        assert odd.requests == 2
+        assert resolver.backends[0].failures == 0
+
+    run_with_stubs([odd], scenario)
+
+
+def test_parser_errors_do_not_escape_the_breaker_bookkeeping(monkeypatch):
+    class CrashingBackend(NekorinnBackend):
+        def parse(self, data):
+            raise KeyError("downloadUrl")
+
+    stub = StubApi("crashing")
+
+    async def main():
+        await stub.start()
+        backend = CrashingBackend(stub.name, stub.url)
+        try:
+            async with aiohttp.ClientSession() as session:
+                resolver = Resolver([backend])
+                assert await resolver.resolve(session, POST_URL, time.monotonic() + 5) is None
+        finally:
+            await stub.stop()
+        assert backend.breaker.state == STATE_CLOSED
+        assert backend.ewma_latency is not None
+
+    asyncio.run(main())
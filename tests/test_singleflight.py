@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class Upstream:
+    """Shared call that blocks until released and records how it ended"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def fetch(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return "result"
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        flight, upstream = SingleFlight(), Upstream()
+        waiters = [asyncio.create_task(flight.do("key", upstream.fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+
+        assert await asyncio.gather(*waiters) == ["result"] * 3
+        assert upstream.calls == 1
+        assert flight.get_stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 2, 'abandoned': 0}
+
+    asyncio.run(main())
+
+
+def test_cancelling_one_waiter_keeps_the_shared_call():
+    async def main():
+        flight, upstream = SingleFlight(), Upstream()
+        first = asyncio.create_task(flight.do("key", upstream.fetch))
+        second = asyncio.create_task(flight.do("key", upstream.fetch))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert not upstream.cancelled
+
+        upstream.release.set()
+        assert await second == "result"
+        assert upstream.calls == 1
+        assert flight.abandoned == 0
+
+    asyncio.run(main())
+
+
+def test_timed_out_waiter_keeps_the_shared_call():
+    async def main():
+        flight, upstream = SingleFlight(), Upstream()
+        patient = asyncio.create_task(flight.do("key", upstream.fetch))
+        await asyncio.sleep(0)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await flight.do("key", upstream.fetch, timeout=0.01)
+        assert not upstream.cancelled
+
+        upstream.release.set()
+        assert await patient == "result"
+
+    asyncio.run(main())
+
+
+def test_cancelling_the_last_waiter_aborts_the_call():
+    async def main():
+        flight, upstream = SingleFlight(), Upstream()
+        waiters = [asyncio.create_task(flight.do("key", upstream.fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        assert upstream.cancelled
+        assert flight.abandoned == 1
+        assert flight.get_stats()['in_flight'] == 0
+
+        # A new caller starts a fresh call instead of joining the aborted one
+        upstream.release.set()
+        assert await flight.do("key", upstream.fetch) == "result"
+        assert upstream.calls == 2
+
+    asyncio.run(main())
+
+
+def test_exception_reaches_every_caller():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise ValueError("upstream down")
+
+        waiters = [asyncio.create_task(flight.do("key", failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight.get_stats()['in_flight'] == 0
+
+    asyncio.run(main())
+
+
+def test_key_is_cleared_after_the_call():
+    async def main():
+        flight, upstream = SingleFlight(), Upstream()
+        upstream.release.set()
+
+        assert await flight.do("key", upstream.fetch) == "result"
+        assert flight.get_stats()['in_flight'] == 0
+        assert await flight.do("key", upstream.fetch) == "result"
+        assert upstream.calls == 2
+        assert flight.leaders == 2
+
+    asyncio.run(main())
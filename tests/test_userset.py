@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from userset import CompactUserSet
+
+
+def check(users: CompactUserSet, expected: set):
+    """Compare against a plain set and verify the chunk invariants"""
+    assert list(users) == sorted(expected)
+    assert len(users) == len(expected)
+    assert all(len(chunk) for chunk in users._chunks)
+    assert users._maxes == [chunk[-1] for chunk in users._chunks]
+    assert all(len(chunk) <= 2 * users.load for chunk in users._chunks)
+
+
+def test_builds_chunks_from_sorted_ids():
+    users = CompactUserSet(range(0, 100, 2), load=8)
+    assert len(users._chunks) == 7
+    assert 42 in users and 43 not in users and -1 not in users and 1000 not in users
+    check(users, set(range(0, 100, 2)))
+
+
+def test_add_splits_full_chunks():
+    users = CompactUserSet(load=4)
+    for user_id in range(20, 0, -1):
+        users.add(user_id)
+    users.add(5)
+    assert len(users._chunks) > 1
+    check(users, set(range(1, 21)))
+
+
+def test_remove_merges_small_chunks():
+    users = CompactUserSet(range(100), load=8)
+    chunks = len(users._chunks)
+    for user_id in range(0, 100, 3):
+        users.remove(user_id)
+    assert len(users._chunks) < chunks
+    check(users, set(range(100)) - set(range(0, 100, 3)))
+
+    for user_id in list(users):
+        users.remove(user_id)
+    assert users._chunks == [] and len(users) == 0
+    assert 1 not in users
+
+
+def test_remove_missing_raises_and_discard_does_not():
+    users = CompactUserSet([1, 2, 3], load=2)
+    with pytest.raises(KeyError):
+        users.remove(4)
+    with pytest.raises(KeyError):
+        CompactUserSet().remove(1)
+    users.discard(4)
+    users.add(2)
+    check(users, {1, 2, 3})
+
+
+def test_matches_a_set_under_random_changes():
+    rng = random.Random(7)
+    users, expected = CompactUserSet(load=16), set()
+    for _ in range(5000):
+        user_id = rng.randrange(-500, 500)
+        if rng.random() < 0.55:
+            users.add(user_id)
+            expected.add(user_id)
+        else:
+            users.discard(user_id)
+            expected.discard(user_id)
+        assert (user_id in users) == (user_id in expected)
+    check(users, expected)
+    assert all((user_id in users) == (user_id in expected) for user_id in range(-510, 510))
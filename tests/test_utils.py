@@ -0,0 +1,45 @@
+import asyncio
+import logging
+
+from utils import BackgroundTasks
+
+
+def test_background_tasks_run_concurrently_and_log_failures(caplog):
+    async def scenario():
+        tasks = BackgroundTasks()
+        release = asyncio.Event()
+
+        async def wait():
+            await release.wait()
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        for _ in range(10):
+            tasks.spawn(wait())
+        failing = tasks.spawn(fail())
+        await asyncio.gather(failing, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert len(tasks) == 10
+
+        release.set()
+        # One step for the tasks to finish, one for their done callbacks
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert len(tasks) == 0
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(scenario())
+    assert "Background task failed: RuntimeError('boom')" in caplog.text
+
+
+def test_background_tasks_cancel():
+    async def scenario():
+        tasks = BackgroundTasks()
+        task = tasks.spawn(asyncio.sleep(10))
+        await asyncio.sleep(0)
+        await tasks.cancel()
+        assert task.cancelled()
+        assert len(tasks) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,125 @@
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import chain, islice
+from typing import Iterable, Iterator, List
+
+
+class CompactUserSet:
+    """Set of user IDs stored as sorted chunks of 64-bit ints
+
+    A Python set costs roughly 60-90 bytes per ID (the int object and its
+    hash slot); a sorted array('q') costs 8. The IDs are split into chunks
+    of up to 2 * load entries, so membership is two binary searches (the
+    chunk maxima, then one chunk) and an add or remove only shifts the
+    entries of one chunk instead of rebuilding a multi-megabyte array.
+    Chunks that shrink below load / 2 are merged into a neighbour.
+    """
+
+    def __init__(self, sorted_ids: Iterable[int] = (), load: int = 4096):
+        self.load = load
+        self._chunks: List[array] = []
+        # Last (largest) ID of each chunk, for the first binary search
+        self._maxes: List[int] = []
+        self._len = 0
+
+        # Must be sorted and unique, e.g. SELECT ... ORDER BY user_id
+        ids = iter(sorted_ids)
+        while True:
+            chunk = array('q', islice(ids, load))
+            if not chunk:
+                break
+            self._append_chunk(chunk)
+
+    def _append_chunk(self, chunk: array):
+        self._chunks.append(chunk)
+        self._maxes.append(chunk[-1])
+        self._len += len(chunk)
+
+    def _locate(self, user_id: int) -> int:
+        """Index of the chunk that holds or would hold user_id"""
+        position = bisect_left(self._maxes, user_id)
+        return min(position, len(self._chunks) - 1)
+
+    def __contains__(self, user_id: int) -> bool:
+        if not self._chunks:
+            return False
+        chunk = self._chunks[self._locate(user_id)]
+        index = bisect_left(chunk, user_id)
+        return index < len(chunk) and chunk[index] == user_id
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[int]:
+        """Yield IDs in ascending order without copying them"""
+        # Snapshot of the chunk list, not the IDs: changes made meanwhile may or may not be seen, but never raise
+        return chain.from_iterable(list(self._chunks))
+
+    def add(self, user_id: int):
+        """Add an ID"""
+        if not self._chunks:
+            self._append_chunk(array('q', (user_id,)))
+            return
+        position = self._locate(user_id)
+        chunk = self._chunks[position]
+        index = bisect_left(chunk, user_id)
+        if index < len(chunk) and chunk[index] == user_id:
+            return
+        chunk.insert(index, user_id)
+        self._maxes[position] = chunk[-1]
+        self._len += 1
+        if len(chunk) > 2 * self.load:
+            self._chunks[position:position + 1] = [chunk[:self.load], chunk[self.load:]]
+            self._maxes[position:position + 1] = [chunk[self.load - 1], chunk[-1]]
+
+    def remove(self, user_id: int):
+        """Remove an ID, raising KeyError if absent"""
+        if not self._chunks:
+            raise KeyError(user_id)
+        position = self._locate(user_id)
+        chunk = self._chunks[position]
+        index = bisect_left(chunk, user_id)
+        if index == len(chunk) or chunk[index] != user_id:
+            raise KeyError(user_id)
+        del chunk[index]
+        self._len -= 1
+        if len(chunk) < self.load // 2 and len(self._chunks) > 1:
+            # Fold a small chunk into a neighbour, so pruning many IDs does not leave many tiny chunks
+            self._merge(position if position + 1 < len(self._chunks) else position - 1)
+        elif chunk:
+            self._maxes[position] = chunk[-1]
+        else:
+            del self._chunks[position]
+            del self._maxes[position]
+
+    def _merge(self, position: int):
+        """Merge the chunks at position and position + 1, splitting the result if it is too large"""
+        merged = self._chunks[position] + self._chunks[position + 1]
+        if len(merged) > 2 * self.load:
+            half = len(merged) // 2
+            parts = [merged[:half], merged[half:]]
+        else:
+            parts = [merged]
+        self._chunks[position:position + 2] = parts
+        self._maxes[position:position + 2] = [part[-1] for part in parts]
+
+    def discard(self, user_id: int):
+        """Remove an ID if present"""
+        try:
+            self.remove(user_id)
+        except KeyError:
+            pass
+
+    def clear(self):
+        """Remove all IDs"""
+        self._chunks = []
+        self._maxes = []
+        self._len = 0
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the chunks and the index of chunk maxima"""
+        return (
+            sum(sys.getsizeof(chunk) for chunk in self._chunks)
+            + sys.getsizeof(self._chunks) + sys.getsizeof(self._maxes) + 32 * len(self._maxes)
+        )
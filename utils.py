@@ -1,21 +1,18 @@
+import asyncio
 import logging
 import os
 import time
 from functools import wraps
-from typing import Callable, Any
+from typing import Awaitable, Callable, Any, Coroutine, Iterable, List, Set
+from pyrogram.types import Message
 from config import Config
+from logs import configure_logging
 
 logger = logging.getLogger(__name__)
 
 def setup_logging():
-    """Setup logging configuration"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-        ]
-    )
+    """Setup logging configuration (non-blocking: records are written by a listener thread)"""
+    configure_logging(Config.LOG_LEVEL, Config.LOG_FORMAT, Config.LOG_SAMPLING)
 
 
 
@@ -32,11 +29,22 @@ def format_file_size(size_bytes: int) -> str:
     
     return f"{size_bytes:.1f} {size_names[i]}"
 
+def format_duration(seconds: float) -> str:
+    """Format a duration in human readable format"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m"
+
 def ensure_directory_exists(directory: str):
     """Ensure directory exists, create if it doesn't"""
     if not os.path.exists(directory):
         os.makedirs(directory, exist_ok=True)
-        logger.info(f"Created directory: {directory}")
+        logger.info("Created directory: %s", directory)
 
 def clean_filename(filename: str) -> str:
     """Clean filename by removing invalid characters"""
@@ -45,19 +53,65 @@ def clean_filename(filename: str) -> str:
         filename = filename.replace(char, '_')
     return filename
 
+async def gather_bounded(limit: int, awaitables: Iterable[Awaitable]) -> List[Any]:
+    """Like asyncio.gather, but with at most limit awaitables running at once"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(awaitable: Awaitable) -> Any:
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(run(awaitable) for awaitable in awaitables))
+
+class BackgroundTasks:
+    """Runs handler work as tasks, so Pyrogram's few dispatcher workers return to the update queue at once
+
+    Limits belong to whatever the work goes through (admission control,
+    the batch and inline handlers); this only keeps the tasks referenced,
+    logs their failures and cancels them on shutdown.
+    """
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+
+    def spawn(self, coro: Coroutine) -> asyncio.Task:
+        """Run coro in a task (it inherits the caller's request ID)"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background task failed: %r", task.exception(), exc_info=task.exception())
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def cancel(self):
+        """Cancel running tasks and wait for them to finish"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
 def admin_only(func: Callable) -> Callable:
     """Decorator to restrict access to admin only"""
     @wraps(func)
     async def wrapper(*args, **kwargs) -> Any:
-        # Get message from args
-        message = args[0] if args else None
-
-        if message and hasattr(message, 'from_user'):
-            user_id = message.from_user.id
-            if user_id != Config.ADMIN_USER_ID:
-                await message.reply_text("❌ You don't have permission to use this command.")
-                logger.warning(f"Unauthorized admin command attempt by user {user_id}")
-                return
+        # Get message from args (Pyrogram passes the client first)
+        message = next((arg for arg in args if isinstance(arg, Message)), None)
+
+        if message is None or message.from_user is None:
+            logger.warning("Refused admin command %s without a user to check", func.__name__)
+            return
+
+        user_id = message.from_user.id
+        if user_id != Config.ADMIN_USER_ID:
+            await message.reply_text("❌ You don't have permission to use this command.")
+            logger.warning("Unauthorized admin command attempt by user %s", user_id)
+            return
 
         return await func(*args, **kwargs)
     return wrapper